@@ -1,15 +1,28 @@
-from typing import List, Optional, Dict
-from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional, Dict
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from ...models.blood_test import BloodTestCreate, BloodTestUpdate, BloodTestInDB
+from ...models.blood_test import BloodTestCreate, BloodTestUpdate, BloodTestInDB, BloodTestSummary
+from ...models.pagination import Page
 from ...services.blood_test_service import BloodTestService
+from ...services.reference_ranges import ABNORMAL_FLAGS
+from ...services.time_series_service import TimeSeriesService
 from ...db.mongodb import get_database
+from ...db.versions import BLOOD_TESTS, EXAM_TYPES, PATIENT
+from ...core.conditional import Validators, document_validators, versioned
+from ...core.export import csv_chunks, ndjson_chunks
+from ...core.projection import fields_query
+from ...core.responses import trusted_response
+from ...core.streaming import iter_json_array, iter_ndjson
 
 router = APIRouter()
 
 def get_blood_test_service(db: AsyncIOMotorDatabase = Depends(get_database)) -> BloodTestService:
     return BloodTestService(db)
 
+blood_test_fields = fields_query(BloodTestInDB, {"summary": BloodTestSummary})
+
 @router.post("/", response_model=BloodTestInDB, status_code=201)
 async def create_blood_test(
     blood_test: BloodTestCreate,
@@ -21,16 +34,66 @@ async def create_blood_test(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/bulk", response_model=Dict)
+async def bulk_create_blood_tests(
+    request: Request,
+    blood_test_service: BloodTestService = Depends(get_blood_test_service)
+):
+    """Bulk-ingest blood tests from a JSON array or an NDJSON stream (application/x-ndjson); check stream_error in the report"""
+    content_type = request.headers.get("content-type", "")
+    parse = iter_ndjson if "ndjson" in content_type or "jsonl" in content_type else iter_json_array
+    report = await blood_test_service.bulk_create_blood_tests(parse(request.stream()))
+    if "stream_error" in report and not report["results"]:
+        # Nada foi lido: o corpo não é um array JSON
+        raise HTTPException(status_code=400, detail=report["stream_error"])
+    return report
+
+@router.get("/export")
+async def export_blood_tests(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    patient_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    exam_type_id: Optional[str] = None,
+    lab_name: Optional[str] = None,
+    blood_test_service: BloodTestService = Depends(get_blood_test_service)
+):
+    """Stream the blood-test history of a patient or of a filtered cohort as NDJSON or CSV (one row per result)"""
+    documents = blood_test_service.iter_blood_tests(
+        patient_id=patient_id, start=start, end=end, exam_type_id=exam_type_id, lab_name=lab_name
+    )
+    if format == "csv":
+        return StreamingResponse(
+            csv_chunks(documents, exam_type_id),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="blood_tests.csv"'}
+        )
+    return StreamingResponse(ndjson_chunks(documents), media_type="application/x-ndjson")
+
+@router.get("/abnormal", response_model=List[Dict])
+async def get_abnormal_results(
+    exam_type_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    flags: List[Literal["low", "high", "critical"]] = Query(ABNORMAL_FLAGS),
+    limit: int = Query(100, ge=1, le=1000),
+    blood_test_service: BloodTestService = Depends(get_blood_test_service)
+):
+    """List patients with out-of-range results of one exam type (default: the last 30 days), most recent first"""
+    start = start or datetime.utcnow() - timedelta(days=30)
+    return trusted_response(await blood_test_service.get_abnormal_results(exam_type_id, start, end, flags, limit))
+
 @router.get("/{test_id}", response_model=BloodTestInDB)
 async def get_blood_test(
     test_id: str,
+    request: Request,
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
     """Get a blood test by ID"""
     test = await blood_test_service.get_blood_test(test_id)
     if not test:
         raise HTTPException(status_code=404, detail="Blood test not found")
-    return test
+    return document_validators(request, test).check(request).response(test)
 
 @router.get("/patient/{patient_id}", response_model=List[BloodTestInDB])
 async def get_patient_blood_tests(
@@ -38,27 +101,48 @@ async def get_patient_blood_tests(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
     test_type: Optional[str] = None,
+    projection: Optional[dict] = Depends(blood_test_fields),
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
-    """Get all blood tests for a patient with optional filtering"""
-    return await blood_test_service.get_patient_blood_tests(
+    """Get all blood tests for a patient with optional filtering and field selection"""
+    return validators.response(await blood_test_service.get_patient_blood_tests(
         patient_id=patient_id,
         skip=skip,
         limit=limit,
-        test_type=test_type
-    )
+        test_type=test_type,
+        projection=projection
+    ))
+
+@router.get("/patient/{patient_id}/cursor", response_model=Page[BloodTestInDB])
+async def get_patient_blood_tests_by_cursor(
+    patient_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    projection: Optional[dict] = Depends(blood_test_fields),
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
+    blood_test_service: BloodTestService = Depends(get_blood_test_service)
+):
+    """Get a patient's blood tests, newest first, using keyset pagination; pass next_cursor to get the following page"""
+    try:
+        return validators.response(await blood_test_service.get_patient_blood_tests_page(
+            patient_id, cursor=cursor, limit=limit, projection=projection
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/patient/{patient_id}/latest", response_model=BloodTestInDB)
 async def get_latest_blood_test(
     patient_id: str,
     test_type: Optional[str] = None,
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
     """Get the latest blood test for a patient"""
     test = await blood_test_service.get_latest_blood_test(patient_id, test_type)
     if not test:
         raise HTTPException(status_code=404, detail="No blood tests found")
-    return test
+    return validators.response(test)
 
 @router.put("/{test_id}", response_model=BloodTestInDB)
 async def update_blood_test(
@@ -82,46 +166,51 @@ async def delete_blood_test(
     if not success:
         raise HTTPException(status_code=404, detail="Blood test not found")
 
-@router.get("/patient/{patient_id}/statistics/{test_type}/{metric}", response_model=Dict)
+@router.get("/patient/{patient_id}/statistics/{exam_type_id}", response_model=Dict)
 async def get_test_statistics(
     patient_id: str,
-    test_type: str,
-    metric: str,
+    exam_type_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    validators: Validators = Depends(versioned(PATIENT, BLOOD_TESTS, EXAM_TYPES)),
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
-    """Get statistics for a specific test metric over time"""
-    return await blood_test_service.get_test_statistics(patient_id, test_type, metric)
+    """Get the series and statistics (mean, percentiles, slope, out-of-range counts) of one exam type over time"""
+    try:
+        return validators.response(await blood_test_service.get_test_statistics(patient_id, exam_type_id, start, end))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/patient/{patient_id}/series/{exam_type_id}", response_model=List[Dict])
+async def get_exam_type_series(
+    patient_id: str,
+    exam_type_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[Literal["day", "month"]] = None,
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get a patient's values for one exam type over time, optionally downsampled to daily/monthly buckets"""
+    return validators.response(await TimeSeriesService(db).get_series(patient_id, exam_type_id, start, end, bucket))
 
 @router.get("/patient/{patient_id}/recent", response_model=List[BloodTestInDB])
 async def get_recent_blood_tests(
     patient_id: str,
     limit: int = Query(5, ge=1, le=50),
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
     """Get the most recent blood tests for a patient"""
-    return await blood_test_service.get_patient_blood_tests(patient_id=patient_id, skip=0, limit=limit)
+    return validators.response(await blood_test_service.get_patient_blood_tests(patient_id=patient_id, skip=0, limit=limit))
 
 @router.get("/patient/{patient_id}/summary", response_model=Dict)
 async def get_patient_blood_tests_summary(
     patient_id: str,
-    metric: Optional[str] = None,
+    exam_type_id: Optional[str] = None,
+    metric: Optional[str] = Query(None, deprecated=True),
+    validators: Validators = Depends(versioned(BLOOD_TESTS)),
     blood_test_service: BloodTestService = Depends(get_blood_test_service)
 ):
-    """Get summary statistics for a patient's blood tests: total count, count by type, and (optionally) average of a metric."""
-    # Buscar todos os exames do paciente
-    tests = await blood_test_service.get_patient_blood_tests(patient_id=patient_id, skip=0, limit=1000)
-    summary = {
-        "total_tests": len(tests),
-        "count_by_type": {},
-        "metric_avg": None
-    }
-    # Contagem por tipo
-    for test in tests:
-        ttype = test.test_type
-        summary["count_by_type"][ttype] = summary["count_by_type"].get(ttype, 0) + 1
-    # Média de um resultado específico
-    if metric:
-        values = [test.results.get(metric) for test in tests if metric in test.results]
-        if values:
-            summary["metric_avg"] = sum(values) / len(values)
-    return summary 
\ No newline at end of file
+    """Get summary statistics for a patient's blood tests: total count, count by exam type, and (optionally) avg/min/max/stddev of one exam type."""
+    return validators.response(await blood_test_service.get_patient_summary(patient_id, exam_type_id or metric))
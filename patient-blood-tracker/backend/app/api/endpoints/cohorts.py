@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import ExecutionTimeout
+from ...core.responses import trusted_response
+from ...db.mongodb import get_database
+from ...services.cohort_service import CohortService
+from ...services.reference_ranges import AGE_BAND_LABELS
+
+router = APIRouter()
+
+def get_cohort_service(db: AsyncIOMotorDatabase = Depends(get_database)) -> CohortService:
+    return CohortService(db)
+
+def age_bands_query(age_band: Optional[List[str]] = Query(None, description=f"Age bands: {', '.join(AGE_BAND_LABELS)}")) -> Optional[List[str]]:
+    unknown = [band for band in age_band or [] if band not in AGE_BAND_LABELS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown age bands: {', '.join(unknown)}")
+    return age_band
+
+@router.get("/{exam_type_id}/distribution", response_model=Dict)
+async def get_cohort_distribution(
+    exam_type_id: str,
+    gender: Optional[Literal["male", "female"]] = None,
+    age_bands: Optional[List[str]] = Depends(age_bands_query),
+    disease: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bins: int = Query(20, ge=1, le=100),
+    cohort_service: CohortService = Depends(get_cohort_service)
+):
+    """Get the distribution (mean, stddev, percentiles, histogram, flag counts) of an exam type across patients"""
+    try:
+        return trusted_response(await cohort_service.get_distribution(
+            exam_type_id, gender=gender, age_bands=age_bands, disease=disease, start=start, end=end, bins=bins
+        ))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Cohort too large for a live query; narrow the filters or use /trend")
+
+@router.get("/{exam_type_id}/trend", response_model=Dict)
+async def get_cohort_trend(
+    exam_type_id: str,
+    gender: Optional[Literal["male", "female"]] = None,
+    age_bands: Optional[List[str]] = Depends(age_bands_query),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cohort_service: CohortService = Depends(get_cohort_service)
+):
+    """Get monthly population statistics of an exam type from the precomputed rollups"""
+    return trusted_response(await cohort_service.get_trend(
+        exam_type_id, gender=gender, age_bands=age_bands, start=start, end=end
+    ))
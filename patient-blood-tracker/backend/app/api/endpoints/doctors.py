@@ -1,42 +1,83 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Request
+from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from ...models.doctor import Doctor
+from ...models.doctor import Doctor, DoctorSummary
 from ...db.mongodb import get_database
+from ...core.projection import apply_projection, fields_query
+from ...core.config import settings
+from ...core.conditional import Validators, version_validators
+from ...services.deletion_service import DOCTOR_KIND, DeletionService
+from ...services.reference_data import ReferenceDataService, doctor_reference
+from .jobs import submit_deletion
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
 
+def get_doctor_reference(db: AsyncIOMotorDatabase = Depends(get_database)) -> ReferenceDataService:
+    return doctor_reference(db)
+
+async def doctor_validators(
+    request: Request,
+    reference: ReferenceDataService = Depends(get_doctor_reference)
+) -> Validators:
+    # Answers 304 from the cached change counter, before the data is even loaded
+    versions = {reference.collection.name: await reference.version()}
+    return version_validators(request, versions, settings.REFERENCE_CACHE_CONTROL).check(request)
+
+doctor_fields = fields_query(Doctor, {"summary": DoctorSummary})
+
 @router.get("/", response_model=List[Doctor])
-async def list_doctors(db: AsyncIOMotorDatabase = Depends(get_database)):
-    items = await db.doctors.find().to_list(100)
-    return [Doctor(**item) for item in items]
+async def list_doctors(
+    projection: Optional[dict] = Depends(doctor_fields),
+    validators: Validators = Depends(doctor_validators),
+    reference: ReferenceDataService = Depends(get_doctor_reference)
+):
+    items = (await reference.list_all())[:100]
+    if projection:
+        return validators.response([apply_projection(item, projection) for item in items])
+    return validators.response([Doctor.model_construct(**item) for item in items])
 
 @router.post("/", response_model=Doctor, status_code=201)
 async def create_doctor(data: Doctor, db: AsyncIOMotorDatabase = Depends(get_database)):
     obj = data.dict()
-    result = await db.doctors.insert_one(obj)
-    created = await db.doctors.find_one({"_id": result.inserted_id})
-    return Doctor(**created)
+    try:
+        result = await db.doctors.insert_one(obj)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="A doctor with this email already exists.")
+    obj["_id"] = result.inserted_id
+    await doctor_reference(db).invalidate()
+    return Doctor(**obj)
 
 @router.get("/{doctor_id}", response_model=Doctor)
-async def get_doctor(doctor_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    item = await db.doctors.find_one({"_id": ObjectId(doctor_id)})
+async def get_doctor(doctor_id: str,
+    validators: Validators = Depends(doctor_validators),
+    reference: ReferenceDataService = Depends(get_doctor_reference)
+):
+    item = await reference.get(doctor_id)
     if not item:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return Doctor(**item)
+    return validators.response(Doctor.model_construct(**item))
 
 @router.put("/{doctor_id}", response_model=Doctor)
 async def update_doctor(doctor_id: str, data: Doctor, db: AsyncIOMotorDatabase = Depends(get_database)):
     update_data = {k: v for k, v in data.dict().items() if v is not None}
-    await db.doctors.update_one({"_id": ObjectId(doctor_id)}, {"$set": update_data})
-    updated = await db.doctors.find_one({"_id": ObjectId(doctor_id)})
+    try:
+        updated = await db.doctors.find_one_and_update(
+            {"_id": ObjectId(doctor_id)}, {"$set": update_data}, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="A doctor with this email already exists.")
+    await doctor_reference(db).invalidate(doctor_id)
     if not updated:
         raise HTTPException(status_code=404, detail="Doctor not found")
     return Doctor(**updated)
 
-@router.delete("/{doctor_id}", status_code=204)
+@router.delete("/{doctor_id}", status_code=202, response_model=Dict)
 async def delete_doctor(doctor_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    result = await db.doctors.delete_one({"_id": ObjectId(doctor_id)})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Doctor not found") 
\ No newline at end of file
+    """Delete a doctor; their blood tests are unlinked (doctor_id set to null) in the background"""
+    deletion = await DeletionService(db).delete(DOCTOR_KIND, doctor_id)
+    if not deletion:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return await submit_deletion(deletion)
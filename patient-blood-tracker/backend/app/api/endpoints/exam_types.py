@@ -1,42 +1,82 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Request
+from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from ...models.exam_type import ExamTypeCreate, ExamTypeUpdate, ExamTypeInDB
+from ...models.exam_type import ExamTypeCreate, ExamTypeUpdate, ExamTypeInDB, ExamTypeSummary
 from ...db.mongodb import get_database
+from ...core.projection import apply_projection, fields_query
+from ...core.config import settings
+from ...core.conditional import Validators, version_validators
+from ...jobs import recompute_stale_flags
+from ...services.blood_test_service import BloodTestService
+from ...services.deletion_service import EXAM_TYPE_KIND, DeletionService
+from ...services.reference_data import ReferenceDataService, exam_type_reference
+from .jobs import submit_deletion, submit_follow_up
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 router = APIRouter()
 
+def get_exam_type_reference(db: AsyncIOMotorDatabase = Depends(get_database)) -> ReferenceDataService:
+    return exam_type_reference(db)
+
+async def exam_type_validators(
+    request: Request,
+    reference: ReferenceDataService = Depends(get_exam_type_reference)
+) -> Validators:
+    # Answers 304 from the cached change counter, before the data is even loaded
+    versions = {reference.collection.name: await reference.version()}
+    return version_validators(request, versions, settings.REFERENCE_CACHE_CONTROL).check(request)
+
+exam_type_fields = fields_query(ExamTypeInDB, {"summary": ExamTypeSummary})
+
 @router.get("/", response_model=List[ExamTypeInDB])
-async def list_exam_types(db: AsyncIOMotorDatabase = Depends(get_database)):
-    items = await db.exam_types.find().to_list(100)
-    return [ExamTypeInDB(**item) for item in items]
+async def list_exam_types(
+    projection: Optional[dict] = Depends(exam_type_fields),
+    validators: Validators = Depends(exam_type_validators),
+    reference: ReferenceDataService = Depends(get_exam_type_reference)
+):
+    items = (await reference.list_all())[:100]
+    if projection:
+        return validators.response([apply_projection(item, projection) for item in items])
+    return validators.response([ExamTypeInDB.model_construct(**item) for item in items])
 
 @router.post("/", response_model=ExamTypeInDB, status_code=201)
 async def create_exam_type(data: ExamTypeCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     obj = data.dict()
     result = await db.exam_types.insert_one(obj)
-    created = await db.exam_types.find_one({"_id": result.inserted_id})
-    return ExamTypeInDB(**created)
+    obj["_id"] = result.inserted_id
+    await exam_type_reference(db).invalidate()
+    return ExamTypeInDB(**obj)
 
 @router.get("/{exam_type_id}", response_model=ExamTypeInDB)
-async def get_exam_type(exam_type_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    item = await db.exam_types.find_one({"_id": ObjectId(exam_type_id)})
+async def get_exam_type(exam_type_id: str,
+    validators: Validators = Depends(exam_type_validators),
+    reference: ReferenceDataService = Depends(get_exam_type_reference)
+):
+    item = await reference.get(exam_type_id)
     if not item:
         raise HTTPException(status_code=404, detail="ExamType not found")
-    return ExamTypeInDB(**item)
+    return validators.response(ExamTypeInDB.model_construct(**item))
 
 @router.put("/{exam_type_id}", response_model=ExamTypeInDB)
 async def update_exam_type(exam_type_id: str, data: ExamTypeUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
     update_data = {k: v for k, v in data.dict().items() if v is not None}
-    await db.exam_types.update_one({"_id": ObjectId(exam_type_id)}, {"$set": update_data})
-    updated = await db.exam_types.find_one({"_id": ObjectId(exam_type_id)})
+    updated = await db.exam_types.find_one_and_update(
+        {"_id": ObjectId(exam_type_id)}, {"$set": update_data}, return_document=ReturnDocument.AFTER
+    )
+    await exam_type_reference(db).invalidate(exam_type_id)
     if not updated:
         raise HTTPException(status_code=404, detail="ExamType not found")
+    if "reference_values" in update_data:
+        # Resultados já gravados foram classificados com as faixas antigas
+        await BloodTestService(db).mark_flags_stale(exam_type_id=exam_type_id)
+        await submit_follow_up(recompute_stale_flags)
     return ExamTypeInDB(**updated)
 
-@router.delete("/{exam_type_id}", status_code=204)
+@router.delete("/{exam_type_id}", status_code=202, response_model=Dict)
 async def delete_exam_type(exam_type_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    result = await db.exam_types.delete_one({"_id": ObjectId(exam_type_id)})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="ExamType not found") 
\ No newline at end of file
+    """Delete an exam type; its results are removed from the blood tests in the background"""
+    deletion = await DeletionService(db).delete(EXAM_TYPE_KIND, exam_type_id)
+    if not deletion:
+        raise HTTPException(status_code=404, detail="ExamType not found")
+    return await submit_deletion(deletion)
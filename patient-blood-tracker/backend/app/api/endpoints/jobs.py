@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Literal, Optional
+from bson import ObjectId
+from celery.result import AsyncResult
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from ...core.config import settings
+from ...db.mongodb import get_database
+from ...jobs import MAINTENANCE_JOBS, export_blood_tests, import_blood_tests, job_files, process_deletions, read_chunks
+from ...worker import celery_app
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_follow_up_tasks = set()
+
+async def submit(task, *args, **kwargs) -> Dict:
+    # apply_async publica no broker (ou executa o job, em modo eager) de forma bloqueante
+    result = await run_in_threadpool(task.apply_async, args=args, kwargs=kwargs)
+    return {"job_id": result.id, "status_url": f"{settings.API_V1_PREFIX}/jobs/{result.id}"}
+
+async def submit_follow_up(task, *args, **kwargs) -> Dict:
+    """Start a job that follows a write already committed, without ever failing the request.
+
+    The caller records a durable marker first (e.g. mark_flags_stale) that a
+    beat sweep also picks up, so a broker failure is only logged. In eager
+    mode the job runs after the response instead of inside the request.
+    """
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        follow_up = asyncio.create_task(run_in_threadpool(task.apply, args=args, kwargs=kwargs))
+        _follow_up_tasks.add(follow_up)
+        follow_up.add_done_callback(_follow_up_done)
+        return {"job_id": None, "status": "scheduled"}
+    try:
+        return await submit(task, *args, **kwargs)
+    except Exception as e:
+        logger.warning("Could not submit %s, left for the scheduled sweep: %s", task.name, e)
+        return {"job_id": None, "status": "deferred"}
+
+def _follow_up_done(follow_up: asyncio.Task) -> None:
+    _follow_up_tasks.discard(follow_up)
+    if not follow_up.cancelled() and follow_up.exception():
+        logger.error("Follow-up job failed: %s", follow_up.exception())
+
+async def submit_deletion(deletion: Dict) -> Dict:
+    """Start the cascade of a recorded deletion; the response of the DELETE endpoints.
+
+    The document is already deleted and the tombstone is picked up by the
+    deletion sweep, so a broker failure does not fail the request.
+    """
+    job = await submit_follow_up(process_deletions, deletion["_id"])
+    return {**job, "deletion": deletion}
+
+@router.post("/blood-tests/import", status_code=202)
+async def submit_blood_test_import(request: Request, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Upload a JSON array or NDJSON file of blood tests and import it in the background"""
+    content_type = request.headers.get("content-type", "application/json")
+    upload = job_files(db).open_upload_stream("blood_tests_import", metadata={"content_type": content_type})
+    try:
+        async for chunk in request.stream():
+            await upload.write(chunk)
+    except BaseException:
+        # Cliente desconectou (ou falha ao gravar): descarta os chunks já gravados
+        await upload.abort()
+        raise
+    await upload.close()
+    try:
+        return await submit(import_blood_tests, str(upload._id), content_type)
+    except BaseException:
+        # Nenhum job vai consumir (e apagar) o arquivo
+        try:
+            await job_files(db).delete(upload._id)
+        except NoFile:
+            pass
+        raise
+
+@router.post("/blood-tests/export", status_code=202)
+async def submit_blood_test_export(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    patient_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    exam_type_id: Optional[str] = None,
+    lab_name: Optional[str] = None
+):
+    """Export blood tests in the background; download the file from /jobs/{job_id}/download when done"""
+    filters = {
+        "patient_id": patient_id,
+        "start": start,
+        "end": end,
+        "exam_type_id": exam_type_id,
+        "lab_name": lab_name
+    }
+    return await submit(export_blood_tests, format, {k: v for k, v in filters.items() if v is not None})
+
+@router.post("/maintenance/{job_name}", status_code=202)
+async def submit_maintenance_job(job_name: str):
+    """Start a maintenance job: rebuild-time-series, recompute-flags, recompute-stale-flags, refresh-cohort-rollups, process-deletions, migrate-blood-test-layout, backfill-search-keys, ensure-indexes or cleanup-job-files"""
+    task = MAINTENANCE_JOBS.get(job_name)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_name}")
+    return await submit(task)
+
+@router.get("/deletions/{deletion_id}", response_model=Dict)
+async def get_deletion(deletion_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Get a cascade delete's tombstone (status and blood tests processed), e.g. patient:<patient_id>"""
+    deletion = await db.deletions.find_one({"_id": deletion_id})
+    if not deletion:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion
+
+@router.get("/{job_id}", response_model=Dict)
+async def get_job_status(job_id: str):
+    """Get a job's state (PENDING, STARTED, PROGRESS, RETRY, SUCCESS, FAILURE) with progress or result"""
+    result = AsyncResult(job_id, app=celery_app)
+    state, info = await run_in_threadpool(lambda: (result.state, result.info))
+    status = {"job_id": job_id, "state": state}
+    if state == "FAILURE":
+        status["error"] = str(info)
+    elif state == "SUCCESS":
+        status["result"] = info
+    elif isinstance(info, dict):
+        status["progress"] = info
+    return status
+
+@router.get("/{job_id}/download")
+async def download_job_file(job_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Download the file produced by a finished export job"""
+    result = AsyncResult(job_id, app=celery_app)
+    state, info = await run_in_threadpool(lambda: (result.state, result.info))
+    if state != "SUCCESS" or not isinstance(info, dict) or "file_id" not in info:
+        raise HTTPException(status_code=404, detail="No file available for this job")
+    try:
+        stream = await job_files(db).open_download_stream(ObjectId(info["file_id"]))
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Export file has expired")
+    media_type = (stream.metadata or {}).get("content_type", "application/octet-stream")
+    return StreamingResponse(
+        read_chunks(stream),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{info["filename"]}"'}
+    )
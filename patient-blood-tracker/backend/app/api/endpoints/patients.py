@@ -1,43 +1,139 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Dict, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from ...models.patient import PatientCreate, PatientUpdate, PatientInDB
+from pymongo.errors import ExecutionTimeout
+from ...models.patient import PatientCreate, PatientUpdate, PatientInDB, PatientSummary
+from ...models.pagination import Page
+from ...core.conditional import Validators, document_validators, versioned
+from ...core.projection import fields_query
+from ...core.streaming import iter_csv, iter_json_array, iter_ndjson
+from ...services.dashboard_service import DashboardService
+from ...services.live_updates import patient_event_stream
 from ...services.patient_service import PatientService
+from ...db.change_feed import change_feed
 from ...db.mongodb import get_database
+from ...db.versions import BLOOD_TESTS, EXAM_TYPES, PATIENT, PATIENTS
+from ...jobs import recompute_stale_flags
+from ...services.blood_test_service import BloodTestService
+from .jobs import submit_deletion, submit_follow_up
 
 router = APIRouter()
 
 def get_patient_service(db: AsyncIOMotorDatabase = Depends(get_database)) -> PatientService:
     return PatientService(db)
 
+patient_fields = fields_query(PatientInDB, {"summary": PatientSummary})
+
 @router.post("/", response_model=PatientInDB, status_code=201)
 async def create_patient(
     patient: PatientCreate,
     patient_service: PatientService = Depends(get_patient_service)
 ):
     """Create a new patient"""
-    return await patient_service.create_patient(patient)
+    try:
+        return await patient_service.create_patient(patient)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/bulk", response_model=Dict)
+async def bulk_upsert_patients(
+    request: Request,
+    patient_service: PatientService = Depends(get_patient_service)
+):
+    """Bulk-import patients from CSV (text/csv), NDJSON or a JSON array, upserting by email"""
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        records = iter_csv(request.stream(), list_columns=["diseases"])
+    elif "ndjson" in content_type or "jsonl" in content_type:
+        records = iter_ndjson(request.stream())
+    else:
+        records = iter_json_array(request.stream())
+    report = await patient_service.bulk_upsert_patients(records)
+    if "stream_error" in report and not (report["created"] or report["updated"] or report["failed"]):
+        raise HTTPException(status_code=400, detail=report["stream_error"])
+    if report["profile_changed"]:
+        await BloodTestService(patient_service.db).mark_flags_stale(patient_ids=report["profile_changed"])
+        report["recompute_flags"] = await submit_follow_up(recompute_stale_flags)
+    return report
+
+@router.get("/cursor", response_model=Page[PatientInDB])
+async def list_patients_by_cursor(
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    search: Optional[str] = Query(None, max_length=100),
+    projection: Optional[dict] = Depends(patient_fields),
+    validators: Validators = Depends(versioned(PATIENTS)),
+    patient_service: PatientService = Depends(get_patient_service)
+):
+    """List patients ordered by name using keyset pagination; pass next_cursor to get the following page"""
+    try:
+        return validators.response(await patient_service.get_patients_page(
+            cursor=cursor, limit=limit, search=search, projection=projection
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Search took too long; try a more specific term")
 
 @router.get("/{patient_id}", response_model=PatientInDB)
 async def get_patient(
     patient_id: str,
+    request: Request,
     patient_service: PatientService = Depends(get_patient_service)
 ):
     """Get a patient by ID"""
     patient = await patient_service.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return patient
+    return document_validators(request, patient).check(request).response(patient)
+
+@router.get("/{patient_id}/dashboard", response_model=Dict)
+async def get_patient_dashboard(
+    patient_id: str,
+    validators: Validators = Depends(versioned(PATIENT, BLOOD_TESTS, EXAM_TYPES)),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Get the patient, recent and latest tests, summary and per-analyte trends in one request"""
+    dashboard = await DashboardService(db).get_patient_dashboard(patient_id)
+    if not dashboard:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return validators.response(dashboard)
+
+@router.get("/{patient_id}/events")
+async def patient_events(
+    patient_id: str,
+    patient_service: PatientService = Depends(get_patient_service)
+):
+    """Stream the patient's changes (blood tests, profile) as Server-Sent Events"""
+    if not change_feed.running:
+        raise HTTPException(status_code=503, detail="Live updates need MongoDB change streams (a replica set)")
+    if not await patient_service.get_patient(patient_id):
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return StreamingResponse(
+        patient_event_stream(patient_id),
+        media_type="text/event-stream",
+        # Sem buffer em proxies (nginx) para os eventos saírem na hora
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/", response_model=List[PatientInDB])
 async def list_patients(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
-    search: Optional[str] = None,
+    search: Optional[str] = Query(None, max_length=100),
+    search_mode: Literal["prefix", "text"] = "prefix",
+    projection: Optional[dict] = Depends(patient_fields),
+    validators: Validators = Depends(versioned(PATIENTS)),
     patient_service: PatientService = Depends(get_patient_service)
 ):
-    """List patients with optional search and pagination"""
-    return await patient_service.get_patients(skip=skip, limit=limit, search=search)
+    """List patients with optional search (ranked by relevance), pagination and field selection"""
+    try:
+        return validators.response(await patient_service.get_patients(
+            skip=skip, limit=limit, search=search, search_mode=search_mode, projection=projection
+        ))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Search took too long; try a more specific term")
 
 @router.put("/{patient_id}", response_model=PatientInDB)
 async def update_patient(
@@ -46,17 +142,25 @@ async def update_patient(
     patient_service: PatientService = Depends(get_patient_service)
 ):
     """Update a patient"""
-    updated_patient = await patient_service.update_patient(patient_id, patient_update)
+    try:
+        updated_patient = await patient_service.update_patient(patient_id, patient_update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    if {"gender", "date_of_birth", "diseases"} & patient_update.dict(exclude_unset=True).keys():
+        # A faixa de referência depende de sexo e idade, e os pontos das séries copiam o perfil
+        await BloodTestService(patient_service.db).mark_flags_stale(patient_ids=[patient_id])
+        await submit_follow_up(recompute_stale_flags)
     return updated_patient
 
-@router.delete("/{patient_id}", status_code=204)
+@router.delete("/{patient_id}", status_code=202, response_model=Dict)
 async def delete_patient(
     patient_id: str,
     patient_service: PatientService = Depends(get_patient_service)
 ):
-    """Delete a patient"""
-    success = await patient_service.delete_patient(patient_id)
-    if not success:
-        raise HTTPException(status_code=404, detail="Patient not found") 
\ No newline at end of file
+    """Delete a patient; its blood tests are deleted in the background (follow status_url)"""
+    deletion = await patient_service.delete_patient(patient_id)
+    if not deletion:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return await submit_deletion(deletion)
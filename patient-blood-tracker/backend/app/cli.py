@@ -0,0 +1,174 @@
+"""Management commands.
+
+Usage: python -m app.cli <command> [options]
+"""
+import argparse
+import asyncio
+import time
+
+from .core.config import settings
+from .core.streaming import iter_csv, iter_json_array, iter_ndjson
+from .db.indexes import ensure_indexes, missing_indexes, unused_indexes
+from .db.mongodb import connect_to_mongo, close_mongo_connection
+from .services.blood_test_layout import LAYOUTS
+from .services.blood_test_service import BloodTestService
+from .services.cohort_service import CohortService
+from .services.deletion_service import DeletionService
+from .services.patient_service import PatientService
+from .services.time_series_service import TimeSeriesService
+
+
+def _print_index_names(title, by_collection):
+    print(title)
+    for collection_name, names in by_collection.items() or [("-", ["none"])]:
+        print(f"  {collection_name}: {', '.join(names)}")
+
+
+async def indexes(db, args):
+    if args.action == "ensure":
+        await ensure_indexes(db)
+    missing, unused = await asyncio.gather(missing_indexes(db), unused_indexes(db))
+    _print_index_names("Missing indexes:", missing)
+    _print_index_names("Unused indexes (no accesses since server start):", unused)
+
+
+async def backfill_search_keys(db, args):
+    service = PatientService(db)
+    updated = await service.backfill_search_keys()
+    print(f"Search keys computed for {updated} patients")
+    emails = await service.normalize_stored_emails()
+    print(f"Emails normalized for {emails['normalized']} patients")
+    for collision in emails["collisions"]:
+        # Dois pacientes com o mesmo e-mail normalizado: precisam ser unificados manualmente
+        print(f"  collision: patient {collision['patient_id']} ({collision['email']}) "
+              f"conflicts with patient {collision['conflicts_with']}")
+
+
+async def backfill_time_series(db, args):
+    processed = await TimeSeriesService(db).backfill()
+    print(f"Time series rebuilt from {processed} blood tests")
+
+
+async def recompute_flags(db, args):
+    service = BloodTestService(db)
+    if args.stale:
+        updated = await service.recompute_stale_flags()
+    else:
+        updated = await service.recompute_flags(exam_type_id=args.exam_type_id, patient_id=args.patient_id)
+    print(f"Flags changed on {updated} blood tests")
+
+
+async def refresh_cohort_rollups(db, args):
+    refreshed = await CohortService(db).refresh_rollups(full=args.full)
+    print("Cohort rollups rebuilt" if args.full else f"Refreshed {refreshed} cohort rollup months")
+
+
+async def process_deletions(db, args):
+    def progress(deletion):
+        print(f"  {deletion['_id']}: {deletion['processed']} blood tests processed")
+
+    finished = await DeletionService(db).process(args.id, progress=progress)
+    print(f"Finished {len(finished)} cascade deletes")
+
+
+def _print_layout_stats(title, stats):
+    print(title)
+    for layout, values in stats.items() or [("-", None)]:
+        print(f"  {layout}: {values['count']} tests, {values['avg_size']} bytes on average" if values else "  none")
+
+
+async def migrate_blood_test_layout(db, args):
+    service = BloodTestService(db)
+    _print_layout_stats("Before:", await service.layout_stats())
+    migrated = await service.migrate_layout(args.layout, progress=lambda n: print(f"  {n} tests migrated"))
+    _print_layout_stats(f"Migrated {migrated} blood tests. After:", await service.layout_stats())
+
+
+async def _file_chunks(path, size=1 << 16):
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+async def import_patients(db, args):
+    file_format = args.format or ("csv" if args.file.endswith(".csv") else "ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "json")
+    chunks = _file_chunks(args.file)
+    records = {
+        "csv": lambda: iter_csv(chunks, list_columns=["diseases"]),
+        "ndjson": lambda: iter_ndjson(chunks),
+        "json": lambda: iter_json_array(chunks),
+    }[file_format]()
+    started = time.perf_counter()
+
+    def progress(report):
+        print(f"  {report['created']} created, {report['updated']} updated, {report['failed']} failed")
+
+    report = await PatientService(db).bulk_upsert_patients(records, chunk_size=args.chunk_size, progress=progress)
+    elapsed = time.perf_counter() - started
+    rows = report["created"] + report["updated"] + report["failed"]
+    print(f"{report['created']} created, {report['updated']} updated, {report['failed']} failed "
+          f"in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
+    for failure in report["failures"][:args.show_failures]:
+        print(f"  row {failure['index']}: {'; '.join(failure['errors'])}")
+    if "stream_error" in report:
+        print(f"Input stopped early: {report['stream_error']}")
+    if report["profile_changed"]:
+        # Sexo, idade e doenças mudaram: as classificações dos resultados dependem deles
+        print(f"Recomputing result flags of {len(report['profile_changed'])} patients whose profile changed")
+        service = BloodTestService(db)
+        for patient_id in report["profile_changed"]:
+            await service.recompute_flags(patient_id=patient_id)
+
+
+async def _run(args):
+    client = await connect_to_mongo()
+    try:
+        await args.handler(client[settings.MONGODB_DB_NAME], args)
+    finally:
+        await close_mongo_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="People Health Tracker management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_indexes = commands.add_parser("indexes", help="Report missing and unused indexes")
+    parser_indexes.add_argument("action", nargs="?", choices=["report", "ensure"], default="report")
+    parser_indexes.set_defaults(handler=indexes)
+
+    parser_search = commands.add_parser("backfill-search-keys", help="Compute patient search keys and normalize emails of existing documents")
+    parser_search.set_defaults(handler=backfill_search_keys)
+
+    parser_series = commands.add_parser("backfill-time-series", help="Rebuild the per-analyte time series from blood_tests")
+    parser_series.set_defaults(handler=backfill_time_series)
+
+    parser_flags = commands.add_parser("recompute-flags", help="Reclassify results (low/normal/high/critical) against the current reference ranges")
+    parser_flags.add_argument("--exam-type-id", help="Only tests with results of this exam type")
+    parser_flags.add_argument("--patient-id", help="Only tests of this patient")
+    parser_flags.add_argument("--stale", action="store_true", help="Only the exam types and patients marked stale by API writes")
+    parser_flags.set_defaults(handler=recompute_flags)
+
+    parser_rollups = commands.add_parser("refresh-cohort-rollups", help="Re-aggregate the cohort rollups changed since the last refresh")
+    parser_rollups.add_argument("--full", action="store_true", help="Rebuild all rollups")
+    parser_rollups.set_defaults(handler=refresh_cohort_rollups)
+
+    parser_import = commands.add_parser("import-patients", help="Upsert patients by email from a CSV, NDJSON or JSON array file")
+    parser_import.add_argument("file")
+    parser_import.add_argument("--format", choices=["csv", "ndjson", "json"], help="Default: from the file extension")
+    parser_import.add_argument("--chunk-size", type=int, default=1000)
+    parser_import.add_argument("--show-failures", type=int, default=20, help="Failed rows to print")
+    parser_import.set_defaults(handler=import_patients)
+
+    parser_layout = commands.add_parser("migrate-blood-test-layout", help="Rewrite blood tests into a storage layout and report document sizes")
+    parser_layout.add_argument("layout", nargs="?", choices=LAYOUTS, help="Target layout (default: BLOOD_TEST_LAYOUT)")
+    parser_layout.set_defaults(handler=migrate_blood_test_layout)
+
+    parser_deletions = commands.add_parser("process-deletions", help="Run (or resume) the pending cascade deletes")
+    parser_deletions.add_argument("--id", help="Only this deletion, e.g. patient:<patient_id>")
+    parser_deletions.set_defaults(handler=process_deletions)
+
+    asyncio.run(_run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import bson
+
+from .config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis é opcional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class TTLCache:
+    """In-process LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None and aioredis is not None and settings.CACHE_REDIS_ENABLED:
+        _redis_client = aioredis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+class TieredCache:
+    """In-process TTL/LRU cache with an optional Redis second tier.
+
+    Values must be BSON-encodable (Mongo documents or lists of them). Redis
+    errors are logged and treated as misses, so Redis is never required.
+    """
+
+    def __init__(self, namespace: str, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.ttl = ttl or settings.CACHE_TTL_SECONDS
+        self.local = TTLCache(maxsize or settings.CACHE_MAX_ENTRIES, self.ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        redis = _get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning("Redis cache read failed: %s", e)
+                raw = None
+            if raw is not None:
+                value = bson.decode(raw)["v"]
+                self.local.set(key, value)
+                self.redis_hits += 1
+                return value
+        self.misses += 1
+        return MISSING
+
+    async def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+        redis = _get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self._redis_key(key), bson.encode({"v": value}), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("Redis cache write failed: %s", e)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.local.delete(key)
+        redis = _get_redis()
+        if redis is not None and keys:
+            try:
+                await redis.delete(*(self._redis_key(key) for key in keys))
+            except Exception as e:
+                logger.warning("Redis cache invalidation failed: %s", e)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self.local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
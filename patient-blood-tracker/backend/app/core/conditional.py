@@ -0,0 +1,120 @@
+"""Conditional GET support: ETag / Last-Modified validators and 304 responses.
+
+Single documents are validated by their id and `updated_at`; lists and
+aggregates by the change counters of the scopes they read (see db.versions),
+checked before the query runs. A 304 never renders the payload.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Depends, HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .config import settings
+from .responses import MongoJSONResponse
+from ..db.mongodb import get_database
+from ..db.versions import get_versions
+
+
+def make_etag(request: Request, *parts: Any) -> str:
+    """Weak ETag over the validator parts, the path and the query string (fields=, paging, filters)"""
+    digest = hashlib.sha1()
+    for part in (request.url.path, request.url.query, *parts):
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Comparação fraca (RFC 9110), a única permitida para GET condicional
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+class Validators:
+    """Cache validators of one response plus the Cache-Control policy to send with it"""
+
+    def __init__(
+        self,
+        etag: str,
+        last_modified: Optional[datetime] = None,
+        cache_control: str = settings.PRIVATE_CACHE_CONTROL
+    ):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.cache_control = cache_control
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control}
+        if self.last_modified:
+            headers["Last-Modified"] = _http_date(self.last_modified)
+        return headers
+
+    def not_modified(self, request: Request) -> bool:
+        """If-None-Match wins over If-Modified-Since, which is only compared to the second"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return _etag_matches(if_none_match, self.etag)
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            last_modified = self.last_modified
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            return last_modified.replace(microsecond=0) <= since
+        return False
+
+    def check(self, request: Request) -> "Validators":
+        """Raise a 304 (which carries no body) when the client's copy is current"""
+        if self.not_modified(request):
+            raise HTTPException(status_code=304, headers=self.headers)
+        return self
+
+    def response(self, content: Any, status_code: int = 200) -> MongoJSONResponse:
+        """Trusted response carrying the validators"""
+        return MongoJSONResponse(content=content, status_code=status_code, headers=self.headers)
+
+
+def document_validators(request: Request, document: Any, cache_control: str = settings.PRIVATE_CACHE_CONTROL) -> Validators:
+    """Validators of a single stored document (a dict or a model), from its id and updated_at"""
+    if isinstance(document, dict):
+        document_id, updated_at = document.get("_id"), document.get("updated_at")
+    else:
+        document_id, updated_at = getattr(document, "id", None), getattr(document, "updated_at", None)
+    return Validators(make_etag(request, document_id, updated_at), updated_at, cache_control)
+
+
+def version_validators(request: Request, versions: Dict[str, Dict], cache_control: str = settings.PRIVATE_CACHE_CONTROL) -> Validators:
+    """Validators of a response derived from the given scopes' change counters"""
+    parts = [f"{scope}:{state['version']}:{state['updated_at']}" for scope, state in sorted(versions.items())]
+    changes = [state["updated_at"] for state in versions.values() if state["updated_at"]]
+    return Validators(make_etag(request, *parts), max(changes) if changes else None, cache_control)
+
+
+def versioned(*scopes: str, cache_control: str = settings.PRIVATE_CACHE_CONTROL):
+    """FastAPI dependency answering 304 before the endpoint runs when none of the scopes changed.
+
+    Scopes may use path parameters as placeholders, e.g. "blood_tests:{patient_id}".
+    """
+
+    async def dependency(request: Request, db: AsyncIOMotorDatabase = Depends(get_database)) -> Validators:
+        names = [scope.format(**request.path_params) for scope in scopes]
+        return version_validators(request, await get_versions(db, *names), cache_control).check(request)
+
+    return dependency
@@ -11,8 +11,43 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "People Health Tracker"
     
     # MongoDB Settings
-    MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://mongodb:27017")
+    # directConnection: the local single-node replica set advertises itself as localhost (see docker-compose.yml)
+    MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://mongodb:27017/?directConnection=true")
     MONGODB_DB_NAME: str = os.getenv("MONGODB_DB_NAME", "health_tracker")
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+    MONGODB_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+    # "create" builds missing indexes at startup, "verify" only logs them, "off" skips the check
+    MONGODB_INDEX_MODE: str = os.getenv("MONGODB_INDEX_MODE", "create")
+    
+    # Request Metrics Settings
+    # Requests slower than this, or issuing more MongoDB commands than the limit, are logged with their query shapes
+    SLOW_REQUEST_MS: int = int(os.getenv("SLOW_REQUEST_MS", "500"))
+    SLOW_REQUEST_MAX_COMMANDS: int = int(os.getenv("SLOW_REQUEST_MAX_COMMANDS", "50"))
+    # Re-runs the slowest reads of a slow request with explain to log docs/keys examined
+    MONGODB_EXPLAIN_SLOW_QUERIES: bool = os.getenv("MONGODB_EXPLAIN_SLOW_QUERIES", "false").lower() == "true"
+    
+    # Change Stream Settings (cache invalidation and live updates; need a replica set, off on a standalone server)
+    CHANGE_STREAMS_ENABLED: bool = os.getenv("CHANGE_STREAMS_ENABLED", "true").lower() == "true"
+    # Resume token key in change_stream_tokens, unique per API process. Defaults to host name and pid,
+    # which a restarted process does not reuse; set it (one value per process) to resume across restarts
+    CHANGE_STREAM_NAME: str = os.getenv("CHANGE_STREAM_NAME", "")
+    CHANGE_STREAM_TOKEN_SAVE_SECONDS: int = int(os.getenv("CHANGE_STREAM_TOKEN_SAVE_SECONDS", "5"))
+    # Events buffered per live-update subscriber before it is sent a reset
+    LIVE_UPDATES_QUEUE_SIZE: int = int(os.getenv("LIVE_UPDATES_QUEUE_SIZE", "100"))
+    LIVE_UPDATES_KEEPALIVE_SECONDS: int = int(os.getenv("LIVE_UPDATES_KEEPALIVE_SECONDS", "15"))
+    
+    # Blood Test Storage Settings
+    # "documents" (results as subdocuments) or "compact" (parallel arrays); see services/blood_test_layout.py
+    BLOOD_TEST_LAYOUT: str = os.getenv("BLOOD_TEST_LAYOUT", "documents")
+    
+    # Search Settings
+    SEARCH_MAX_TIME_MS: int = int(os.getenv("SEARCH_MAX_TIME_MS", "2000"))
+    
+    # Cohort Analytics Settings
+    COHORT_MAX_TIME_MS: int = int(os.getenv("COHORT_MAX_TIME_MS", "10000"))
+    COHORT_ROLLUP_REFRESH_SECONDS: int = int(os.getenv("COHORT_ROLLUP_REFRESH_SECONDS", "300"))
     
     # JWT Settings
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "your-secret-key-here")
@@ -21,6 +56,27 @@ class Settings(BaseSettings):
     
     # Redis Settings
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
+    
+    # Cache Settings
+    CACHE_TTL_SECONDS: int = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    CACHE_REDIS_ENABLED: bool = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
+    
+    # HTTP Caching Settings (Cache-Control sent with ETag/Last-Modified)
+    REFERENCE_CACHE_CONTROL: str = os.getenv("REFERENCE_CACHE_CONTROL", "public, max-age=300")
+    PRIVATE_CACHE_CONTROL: str = os.getenv("PRIVATE_CACHE_CONTROL", "private, no-cache")
+    
+    # Background Job Settings
+    CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", os.getenv("REDIS_URL", "redis://redis:6379/0"))
+    CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", os.getenv("REDIS_URL", "redis://redis:6379/0"))
+    # Runs jobs inline (no broker needed), for local development and tests
+    CELERY_TASK_ALWAYS_EAGER: bool = os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() == "true"
+    # How often celery beat resumes cascade deletes whose job was lost
+    DELETION_SWEEP_SECONDS: int = int(os.getenv("DELETION_SWEEP_SECONDS", "600"))
+    # How often celery beat reclassifies results marked stale whose job could not be submitted
+    FLAG_RECOMPUTE_SWEEP_SECONDS: int = int(os.getenv("FLAG_RECOMPUTE_SWEEP_SECONDS", "300"))
+    # How often celery beat deletes job files (exports, unconsumed uploads) older than the job results
+    JOB_FILES_SWEEP_SECONDS: int = int(os.getenv("JOB_FILES_SWEEP_SECONDS", "3600"))
 
     class Config:
         case_sensitive = True
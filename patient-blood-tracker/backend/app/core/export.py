@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Optional
+
+from bson import ObjectId
+
+CSV_COLUMNS = ["blood_test_id", "patient_id", "test_date", "lab_name", "doctor_id", "exam_type_id", "value"]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def ndjson_chunks(documents: AsyncIterable[Dict], flush_every: int = 500) -> AsyncIterator[str]:
+    """Serialize raw Mongo documents as NDJSON, yielding one string per `flush_every` documents"""
+    lines = []
+    async for document in documents:
+        document["id"] = str(document.pop("_id"))
+        lines.append(json.dumps(document, default=_json_default, separators=(",", ":")))
+        if len(lines) >= flush_every:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def csv_chunks(
+    documents: AsyncIterable[Dict],
+    exam_type_id: Optional[str] = None,
+    flush_every: int = 500
+) -> AsyncIterator[str]:
+    """Serialize blood tests as CSV with one row per result (optionally only one exam type)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    pending = 0
+    async for document in documents:
+        test_date = document.get("test_date")
+        for result in document.get("results") or []:
+            if exam_type_id and result.get("exam_type_id") != exam_type_id:
+                continue
+            writer.writerow([
+                str(document["_id"]),
+                document.get("patient_id"),
+                test_date.isoformat() if test_date else "",
+                document.get("lab_name") or "",
+                document.get("doctor_id") or "",
+                result.get("exam_type_id"),
+                result.get("value"),
+            ])
+        pending += 1
+        if pending >= flush_every:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.getvalue():
+        yield buffer.getvalue()
@@ -0,0 +1,45 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from bson import ObjectId
+
+
+def encode_cursor(value: Any, object_id: ObjectId) -> str:
+    """Build an opaque continuation token from the last item's sort key"""
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    payload = json.dumps({"v": value, "id": str(object_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[Any, ObjectId]:
+    """Inverse of encode_cursor; raises ValueError for malformed tokens"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = payload["v"]
+        if isinstance(value, dict) and "$date" in value:
+            value = datetime.fromisoformat(value["$date"])
+        if not ObjectId.is_valid(payload["id"]):
+            raise ValueError
+        return value, ObjectId(payload["id"])
+    except (binascii.Error, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise ValueError("Invalid pagination cursor.")
+
+
+def keyset_filter(field: str, token: str, descending: bool = False) -> Dict:
+    """Filter selecting the items after the cursor for a sort on (field, _id)"""
+    value, object_id = decode_cursor(token)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: object_id}}
+    ]}
+
+
+def keyset_sort(field: str, descending: bool = False) -> List[Tuple[str, int]]:
+    direction = -1 if descending else 1
+    return [(field, direction), ("_id", direction)]
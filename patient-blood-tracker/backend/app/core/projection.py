@@ -0,0 +1,60 @@
+from typing import Dict, Iterable, List, Optional, Type
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+
+def output_fields(model: Type[BaseModel]) -> List[str]:
+    """Field names as they appear in responses and in MongoDB (aliases, e.g. "_id")"""
+    return [field.alias or name for name, field in model.model_fields.items()]
+
+
+def build_projection(
+    fields: Optional[str],
+    model: Type[BaseModel],
+    presets: Optional[Dict[str, Type[BaseModel]]] = None
+) -> Optional[Dict[str, int]]:
+    """Turn a `fields=` query value (comma-separated names or a preset name) into a MongoDB projection.
+
+    Returns None when all fields are requested; raises ValueError for unknown fields.
+    """
+    if not fields:
+        return None
+    if presets and fields in presets:
+        names = output_fields(presets[fields])
+    else:
+        names = ["_id" if name == "id" else name for name in (f.strip() for f in fields.split(",")) if name]
+        allowed = output_fields(model)
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    projection = {name: 1 for name in names}
+    if "_id" not in projection:
+        projection["_id"] = 0
+    return projection
+
+
+def with_fields(projection: Dict[str, int], extra: Iterable[str]) -> Dict[str, int]:
+    """Projection that also fetches `extra` fields (e.g. a sort key needed for a cursor)"""
+    merged = dict(projection)
+    for name in extra:
+        merged[name] = 1
+    return merged
+
+
+def apply_projection(document: Dict, projection: Dict[str, int]) -> Dict:
+    """Apply an inclusion projection in Python, for documents that come from a cache"""
+    return {key: value for key, value in document.items() if projection.get(key)}
+
+
+def fields_query(model: Type[BaseModel], presets: Optional[Dict[str, Type[BaseModel]]] = None):
+    """FastAPI dependency reading `fields=` and returning the matching projection (or None)"""
+    description = f"Comma-separated fields to return, or a preset ({', '.join(presets or {}) or 'none'})"
+
+    def dependency(fields: Optional[str] = Query(None, description=description)) -> Optional[Dict[str, int]]:
+        try:
+            return build_projection(fields, model, presets)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return dependency
@@ -0,0 +1,103 @@
+"""Per-request timing: latency histograms by route and a log of slow requests with their MongoDB query shapes."""
+import asyncio
+import logging
+import time
+
+from .config import settings
+from .metrics import COUNT_BUCKETS, Histogram
+from ..db.command_metrics import RequestTrace, current_trace, explain_commands
+
+logger = logging.getLogger(__name__)
+
+SLOW_LOG_SHAPES = 10
+EXPLAIN_COMMANDS = 3
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+request_db_commands = Histogram(
+    "http_request_db_commands", "MongoDB commands issued per HTTP request", ["method", "route"], buckets=COUNT_BUCKETS
+)
+request_db_duration = Histogram(
+    "http_request_db_seconds", "Time spent in MongoDB commands per HTTP request", ["method", "route"]
+)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware that times each HTTP request and traces the MongoDB commands it issues.
+
+    Routes are labelled by their path template (e.g. /api/v1/patients/{patient_id}),
+    so the histograms keep a bounded set of series. Requests slower than
+    SLOW_REQUEST_MS, or issuing more than SLOW_REQUEST_MAX_COMMANDS commands,
+    are logged with their commands grouped by query shape. Server-Sent Events
+    streams are long-lived by design and are not recorded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._explain_tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500, "event_stream": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["event_stream"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_trace.reset(token)
+            if status["event_stream"]:
+                # Streams SSE ficam abertos por minutos: não são latência de requisição
+                return
+            # O roteador grava a rota encontrada no próprio scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            request_duration.observe(elapsed, method, route, str(status["code"]))
+            request_db_commands.observe(trace.count, method, route)
+            request_db_duration.observe(trace.duration_ms / 1000, method, route)
+            if elapsed * 1000 >= settings.SLOW_REQUEST_MS or trace.count > settings.SLOW_REQUEST_MAX_COMMANDS:
+                self._log_slow_request(method, scope.get("path", ""), route, status["code"], elapsed, trace)
+
+    def _log_slow_request(self, method: str, path: str, route: str, status: int, elapsed: float, trace: RequestTrace) -> None:
+        shapes = "\n".join(
+            f"  {group['count']}x {group['total_ms']:.1f}ms {group['documents']} docs  {group['shape']}"
+            for group in trace.by_shape()[:SLOW_LOG_SHAPES]
+        )
+        logger.warning(
+            "Slow request %s %s (%s) -> %s in %.1fms; %d MongoDB commands, %.1fms in MongoDB\n%s",
+            method, path, route, status, elapsed * 1000, trace.count, trace.duration_ms, shapes
+        )
+        if settings.MONGODB_EXPLAIN_SLOW_QUERIES:
+            slowest = sorted(
+                (command for command in trace.commands if command.command is not None),
+                key=lambda command: command.duration_ms, reverse=True
+            )[:EXPLAIN_COMMANDS]
+            if slowest:
+                task = asyncio.create_task(self._explain(method, route, slowest))
+                self._explain_tasks.add(task)
+                task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, method: str, route: str, commands) -> None:
+        from ..db.mongodb import get_client
+
+        for stats in await explain_commands(get_client(), commands):
+            logger.warning(
+                "Slow request %s %s: %s took %sms, examined %s docs / %s keys, returned %s",
+                method, route, stats["shape"], stats["duration_ms"], stats["docs_examined"],
+                stats["keys_examined"], stats["documents_returned"]
+            )
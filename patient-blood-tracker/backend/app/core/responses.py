@@ -0,0 +1,48 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+@lru_cache(maxsize=None)
+def _output_keys(model_cls: type) -> Dict[str, str]:
+    return {name: field.alias or name for name, field in model_cls.model_fields.items()}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        # Só os campos do modelo: model_construct guarda também as chaves extras do documento
+        keys = _output_keys(type(value))
+        fields = value.__dict__
+        return {key: fields[name] for name, key in keys.items() if name in fields}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response rendered with orjson that understands ObjectId and pydantic models.
+
+    Models are dumped straight from their __dict__ (their fields only, keyed by
+    alias, as FastAPI does with response_model), so models built with
+    model_construct from trusted database documents are never validated or
+    converted again, and internal keys of those documents are not sent.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def trusted_response(content: Any, status_code: int = 200) -> MongoJSONResponse:
+    """Send content built from database documents without re-validating it against response_model"""
+    return MongoJSONResponse(content=content, status_code=status_code)
@@ -0,0 +1,160 @@
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List
+
+# Maior elemento de um array JSON aceito enquanto ainda está incompleto
+MAX_JSON_ELEMENT_CHARS = 1 << 20
+JSON_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+NUMBER_CHARS = set("0123456789.eE+-")
+
+
+class MalformedRecord:
+    """Placeholder yielded for an input record that could not be decoded"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """Decode an NDJSON byte stream one line at a time"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _decode_line(line, line_number)
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield _decode_line(buffer, line_number + 1)
+
+
+def _decode_line(line: str, line_number: int) -> Any:
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return MalformedRecord(f"Invalid JSON on line {line_number}: {e.msg}")
+
+
+async def iter_json_array(chunks: AsyncIterable[bytes]) -> AsyncIterator[Any]:
+    """Decode the elements of a top-level JSON array incrementally.
+
+    Only the element currently being received is kept in memory, so large
+    uploads are not buffered whole: a malformed element raises ValueError as
+    soon as it is seen, and an element still incomplete after
+    MAX_JSON_ELEMENT_CHARS characters raises too.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    buffer = ""
+    state = "start"  # start -> value -> separator -> value ... -> end
+    async for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer) or state == "end":
+                break
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                pos += 1
+                state = "first"
+            elif state in ("first", "value"):
+                if char == "]" and state == "first":
+                    pos += 1
+                    state = "end"
+                    continue
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if not _is_incomplete(buffer, e):
+                        raise ValueError(f"Malformed JSON array element: {e.msg}")
+                    if len(buffer) - pos > MAX_JSON_ELEMENT_CHARS:
+                        raise ValueError(f"JSON array element larger than {MAX_JSON_ELEMENT_CHARS} characters")
+                    break  # Elemento incompleto: aguarda o próximo chunk
+                if end >= len(buffer) or (isinstance(value, (int, float)) and buffer[end] in NUMBER_CHARS):
+                    break  # Um número no fim do buffer pode continuar no próximo chunk
+                pos = end
+                state = "separator"
+                yield value
+            elif state == "separator":
+                if char == ",":
+                    state = "value"
+                elif char == "]":
+                    state = "end"
+                else:
+                    raise ValueError(f"Unexpected character {char!r} in JSON array")
+                pos += 1
+        buffer = buffer[pos:]
+    buffer += text_decoder.decode(b"", final=True)
+    if state != "end" or buffer.strip():
+        raise ValueError("Malformed or truncated JSON array")
+
+
+def _is_incomplete(text: str, error: json.JSONDecodeError) -> bool:
+    """Whether more input could fix the decode error, i.e. the element is only cut at the end of the buffer"""
+    if error.pos >= len(text) or error.msg.startswith("Unterminated string"):
+        return True
+    rest = text[error.pos:]
+    # Literal ou número cortado no fim do buffer ("tr", "-", "1.", "2e")
+    return any(literal.startswith(rest) for literal in JSON_LITERALS) or set(rest) <= NUMBER_CHARS
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+
+async def iter_csv(chunks: AsyncIterable[bytes], list_columns: List[str] = ()) -> AsyncIterator[Any]:
+    """Decode a CSV byte stream with a header row into one dict per row.
+
+    Empty cells are left out (so model defaults apply) and the cells of
+    `list_columns` are split on ";". Rows whose column count does not match
+    the header are yielded as MalformedRecord.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    record = ""
+    header = None
+    line_number = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_number += 1
+            record += line + "\n"
+            if record.count('"') % 2:
+                continue  # Campo entre aspas com quebra de linha: o registro continua na próxima linha
+            if header is None:
+                header = _parse_csv_record(record)
+            elif record.strip():
+                yield _csv_row(header, _parse_csv_record(record), list_columns, line_number)
+            record = ""
+    record += buffer + decoder.decode(b"", final=True)
+    if record.strip():
+        if header is None:
+            return
+        yield _csv_row(header, _parse_csv_record(record), list_columns, line_number + 1)
+
+
+def _parse_csv_record(record: str) -> List[str]:
+    return next(csv.reader([record]), [])
+
+
+def _csv_row(header: List[str], cells: List[str], list_columns: List[str], line_number: int) -> Any:
+    if len(cells) != len(header):
+        return MalformedRecord(f"Line {line_number}: expected {len(header)} columns, got {len(cells)}")
+    row: Dict[str, Any] = {}
+    for name, cell in zip(header, cells):
+        cell = cell.strip()
+        if not cell:
+            continue
+        row[name.strip()] = [item.strip() for item in cell.split(";") if item.strip()] if name.strip() in list_columns else cell
+    return row
@@ -0,0 +1,32 @@
+import re
+import unicodedata
+from typing import List, Optional
+
+
+def normalize_search_text(text: str) -> str:
+    """Lowercase, strip accents and collapse whitespace ("  José  Álvares" -> "jose alvares")"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.lower().split())
+
+
+def normalize_email(email: str) -> str:
+    """Email as stored and deduplicated on: trimmed and lowercased"""
+    return email.strip().lower()
+
+
+def build_search_keys(name: Optional[str], email: Optional[str]) -> List[str]:
+    """Keys stored on a patient for indexed prefix search: full name, each name token and the email"""
+    keys = []
+    if name:
+        full_name = normalize_search_text(name)
+        keys.append(full_name)
+        keys.extend(full_name.split())
+    if email:
+        keys.append(normalize_email(email))
+    return list(dict.fromkeys(keys))
+
+
+def prefix_pattern(text: str) -> str:
+    """Anchored regex matching the normalized input literally, so it can use an index"""
+    return "^" + re.escape(normalize_search_text(text))
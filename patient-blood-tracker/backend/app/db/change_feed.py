@@ -0,0 +1,190 @@
+"""Change-stream consumer that fans database writes out to in-process hooks.
+
+Every API process runs one consumer (started in the FastAPI lifespan) over
+the watched collections, whoever made the write: this process, another
+replica, a worker or the shell. Hooks keep in-process state in step, e.g.
+the local tier of the reference caches and the live update feed.
+
+Events are projected down to what routing needs (the document key, and the
+patient_id of inserted/replaced documents); hooks that need a full document
+fetch it themselves, and only when someone is interested in it, so a bulk
+rewrite of blood_tests costs no document lookups in the API processes.
+
+The resume token is saved in `change_stream_tokens` under the consumer name
+(at most every CHANGE_STREAM_TOKEN_SAVE_SECONDS and on shutdown), also while
+the watched collections are idle, so a restarted process resumes where it
+stopped; events since the last save are delivered again, so hooks must be
+idempotent. The default name includes the pid, so that the workers of one
+host do not overwrite each other's token; a process resumes across restarts
+only with a stable CHANGE_STREAM_NAME, and the tokens of gone processes
+expire (see db/indexes.py). When the token has fallen off the oplog, or the
+stream is invalidated, hooks receive a RESET event and should drop
+everything they derived. Change streams need a replica set (a single-node
+one is enough, see docker-compose.yml) or a sharded cluster; on a
+standalone server the consumer logs that and does nothing.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ..core.config import settings
+from ..core.metrics import Counter
+from .mongodb import is_replicated
+
+logger = logging.getLogger(__name__)
+
+TOKENS_COLLECTION = "change_stream_tokens"
+WATCHED_COLLECTIONS = ("patients", "blood_tests", "exam_types", "doctors")
+RESET = "reset"
+RETRY_SECONDS = 5
+# ChangeStreamHistoryLost, ChangeStreamFatalError
+RESUME_FAILED_CODES = (286, 280)
+
+change_events = Counter("change_stream_events_total", "Change stream events dispatched", ["collection", "operation"])
+
+
+class ChangeEvent:
+    """A write seen on the change stream (operation insert/update/replace/delete), or a RESET.
+
+    `patient_id` is only known for inserts and replaces (the stream carries
+    no document for updates and deletes).
+    """
+
+    __slots__ = ("collection", "operation", "document_id", "patient_id")
+
+    def __init__(self, collection: Optional[str], operation: str, document_id=None, patient_id: Optional[str] = None):
+        self.collection = collection
+        self.operation = operation
+        self.document_id = document_id
+        self.patient_id = patient_id
+
+    @classmethod
+    def from_change(cls, change: Dict) -> "ChangeEvent":
+        return cls(
+            change["ns"]["coll"],
+            change["operationType"],
+            change.get("documentKey", {}).get("_id"),
+            (change.get("fullDocument") or {}).get("patient_id"),
+        )
+
+
+Hook = Callable[[ChangeEvent], Awaitable[None]]
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._hooks: List[Tuple[Tuple[str, ...], Hook]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._token: Optional[Dict] = None
+        self._saved_token: Optional[Dict] = None
+        self._saved_at = 0.0
+        self.name = settings.CHANGE_STREAM_NAME or f"api:{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def add_hook(self, collections: Iterable[str], hook: Hook) -> None:
+        """Call `hook` for every change to these collections, and for RESET events"""
+        self._hooks.append((tuple(collections), hook))
+
+    async def _dispatch(self, event: ChangeEvent) -> None:
+        change_events.inc(event.collection or "", event.operation)
+        for collections, hook in self._hooks:
+            if event.operation == RESET or event.collection in collections:
+                try:
+                    await hook(event)
+                except Exception:
+                    logger.exception("Change stream hook %s failed", getattr(hook, "__name__", hook))
+
+    async def start(self, db: AsyncIOMotorDatabase) -> None:
+        if not settings.CHANGE_STREAMS_ENABLED:
+            return
+        if not await is_replicated(db.client):
+            logger.info("MongoDB is a standalone server; change streams (cache invalidation, live updates) are disabled")
+            return
+        self._db = db
+        state = await db[TOKENS_COLLECTION].find_one({"_id": self.name})
+        self._token = self._saved_token = state["token"] if state else None
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._save_token(force=True)
+
+    async def _run(self) -> None:
+        pipeline = [
+            {"$match": {
+                "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+                "operationType": {"$in": ["insert", "update", "replace", "delete", "drop", "rename", "invalidate"]},
+            }},
+            # Sem updateLookup: só o necessário para rotear; os hooks buscam o documento se alguém o assina
+            {"$project": {"operationType": 1, "ns": 1, "documentKey": 1, "fullDocument.patient_id": 1}},
+        ]
+        while True:
+            try:
+                async with self._db.watch(pipeline, resume_after=self._token) as stream:
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is None:
+                            # Lote vazio: o postBatchResumeToken avança mesmo sem eventos das coleções assistidas
+                            if stream.resume_token is not None:
+                                self._token = stream.resume_token
+                            await self._save_token()
+                            continue
+                        self._token = change["_id"]
+                        if change["operationType"] in ("drop", "rename", "invalidate"):
+                            await self._dispatch(ChangeEvent(change.get("ns", {}).get("coll"), RESET))
+                            if change["operationType"] == "invalidate":
+                                self._token = None
+                                break
+                            continue
+                        await self._dispatch(ChangeEvent.from_change(change))
+                        await self._save_token()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in RESUME_FAILED_CODES:
+                    # O token saiu do oplog: eventos foram perdidos, os hooks descartam o estado derivado
+                    logger.warning("Change stream cannot resume (%s); restarting from now", e)
+                    self._token = None
+                    await self._dispatch(ChangeEvent(None, RESET))
+                else:
+                    logger.error("Change stream failed: %s", e)
+                    await asyncio.sleep(RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.warning("Change stream interrupted: %s", e)
+                await asyncio.sleep(RETRY_SECONDS)
+
+    async def _save_token(self, force: bool = False) -> None:
+        if self._db is None or self._token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._saved_at < settings.CHANGE_STREAM_TOKEN_SAVE_SECONDS:
+            return
+        try:
+            await self._db[TOKENS_COLLECTION].update_one(
+                {"_id": self.name}, {"$set": {"token": self._token, "updated_at": datetime.utcnow()}}, upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning("Could not save the change stream resume token: %s", e)
+            return
+        self._saved_token = self._token
+        self._saved_at = time.monotonic()
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,220 @@
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from ..core.metrics import COUNT_BUCKETS, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Campos que o driver acrescenta ao comando e que não fazem parte da consulta
+DRIVER_FIELDS = {"$db", "lsid", "$clusterTime", "$readPreference", "txnNumber", "readConcern", "apiVersion", "apiStrict"}
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+MAX_TRACE_COMMANDS = 1000
+MAX_SHAPE_LENGTH = 300
+
+command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command duration", ["command", "collection"]
+)
+command_documents = Histogram(
+    "mongodb_command_documents", "Documents returned (or written) per MongoDB command",
+    ["command", "collection"], buckets=COUNT_BUCKETS
+)
+command_failures = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ["command", "collection"]
+)
+
+
+class TracedCommand:
+    __slots__ = ("name", "collection", "shape", "duration_ms", "documents", "database", "command")
+
+    def __init__(self, name, collection, shape, duration_ms, documents, database, command):
+        self.name = name
+        self.collection = collection
+        self.shape = shape
+        self.duration_ms = duration_ms
+        self.documents = documents
+        self.database = database
+        # Guardado só para os comandos que podem passar por explain
+        self.command = command
+
+
+class RequestTrace:
+    """MongoDB commands issued while serving one request"""
+
+    def __init__(self):
+        self.commands: List[TracedCommand] = []
+        self.count = 0
+        self.duration_ms = 0.0
+
+    def add(self, command: TracedCommand) -> None:
+        self.count += 1
+        self.duration_ms += command.duration_ms
+        if len(self.commands) < MAX_TRACE_COMMANDS:
+            self.commands.append(command)
+
+    def by_shape(self) -> List[Dict]:
+        """Commands grouped by query shape, most expensive first; repeated shapes point at N+1 loops"""
+        groups: Dict[str, Dict] = {}
+        for command in self.commands:
+            group = groups.setdefault(command.shape, {"shape": command.shape, "count": 0, "total_ms": 0.0, "documents": 0})
+            group["count"] += 1
+            group["total_ms"] += command.duration_ms
+            group["documents"] += command.documents
+        return sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)
+
+
+# Motor copia o contexto para as threads do executor, então os eventos do
+# driver enxergam o trace da requisição que originou o comando
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def _shape(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [_shape(item) for item in value]
+    return "?"
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key}: {_format(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ", ".join(_format(item) for item in value) + "]"
+    return str(value)
+
+
+def command_collection(command_name: str, command: Dict) -> str:
+    target = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+def query_shape(command_name: str, command: Dict) -> str:
+    """Command with its literal values replaced by '?', so equal queries group together"""
+    if command_name == "aggregate":
+        parts = {"pipeline": command.get("pipeline", [])}
+    elif command_name in ("find", "count", "distinct"):
+        parts = {key: command[key] for key in ("filter", "query", "key", "sort") if key in command}
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        parts = {"q": statements[0].get("q", {})} if statements else {}
+    elif command_name == "findAndModify":
+        parts = {"query": command.get("query", {})}
+    else:
+        parts = {}
+    shape = f"{command_name} {command_collection(command_name, command)}"
+    if parts:
+        shape += " " + _format(_shape(parts))
+    return shape[:MAX_SHAPE_LENGTH]
+
+
+def _documents(reply: Dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if "value" in reply:
+        return 1 if reply["value"] is not None else 0
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command and attributes it to the current request trace.
+
+    Started and succeeded events of a command arrive on the same thread, but
+    several commands may be in flight at once, so started commands are kept
+    by (request_id, connection_id) until they finish.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[Tuple[int, Any], Tuple[str, str, str, Optional[Dict]]] = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = command_collection(name, event.command)
+        command = event.command if name in EXPLAINABLE else None
+        with self._lock:
+            self._started[(event.request_id, event.connection_id)] = (
+                collection, query_shape(name, event.command), event.database_name, command
+            )
+
+    def _finish(self, event) -> Optional[Tuple[str, str, str, Optional[Dict]]]:
+        with self._lock:
+            return self._started.pop((event.request_id, event.connection_id), None)
+
+    def succeeded(self, event):
+        started = self._finish(event)
+        if started is None:
+            return
+        collection, shape, database, command = started
+        documents = _documents(event.reply)
+        command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+        command_documents.observe(documents, event.command_name, collection)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(TracedCommand(
+                event.command_name, collection, shape, event.duration_micros / 1000, documents, database, command
+            ))
+
+    def failed(self, event):
+        started = self._finish(event)
+        collection = started[0] if started else ""
+        command_failures.inc(event.command_name, collection)
+        command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+
+command_metrics = CommandMetricsListener()
+
+
+def _execution_stats(explain: Any) -> Optional[Dict]:
+    """First executionStats section of an explain result (nested under $cursor for pipelines)"""
+    if isinstance(explain, dict):
+        if "executionStats" in explain:
+            return explain["executionStats"]
+        values = explain.values()
+    elif isinstance(explain, list):
+        values = explain
+    else:
+        return None
+    for value in values:
+        stats = _execution_stats(value)
+        if stats is not None:
+            return stats
+    return None
+
+
+async def explain_commands(client, commands: List[TracedCommand]) -> List[Dict]:
+    """Re-run read commands with explain to get the documents and keys they examined.
+
+    Explain executes the query again, so this is only used for the slowest
+    commands of slow requests, and off the request path.
+    """
+    token = current_trace.set(None)
+    explained = []
+    try:
+        for traced in commands:
+            if traced.command is None:
+                continue
+            command = {key: value for key, value in traced.command.items() if key not in DRIVER_FIELDS}
+            try:
+                explain = await client[traced.database].command(
+                    {"explain": command, "verbosity": "executionStats"}
+                )
+            except Exception as e:
+                logger.warning("Could not explain %s: %s", traced.shape, e)
+                continue
+            stats = _execution_stats(explain) or {}
+            explained.append({
+                "shape": traced.shape,
+                "duration_ms": round(traced.duration_ms, 1),
+                "documents_returned": traced.documents,
+                "docs_examined": stats.get("totalDocsExamined"),
+                "keys_examined": stats.get("totalKeysExamined"),
+            })
+    finally:
+        current_trace.reset(token)
+    return explained
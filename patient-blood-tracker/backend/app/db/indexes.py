@@ -0,0 +1,137 @@
+"""Index registry for the MongoDB collections.
+
+Indexes are declared here and ensured on application startup. Run
+``python -m app.cli indexes [report|ensure]`` to report missing and unused
+indexes, optionally creating the missing ones first.
+"""
+import logging
+from typing import Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "blood_tests": [
+        IndexModel([("patient_id", ASCENDING), ("test_date", DESCENDING), ("_id", DESCENDING)], name="patient_test_date_id"),
+        IndexModel([("results.exam_type_id", ASCENDING), ("test_date", ASCENDING)], name="result_exam_type_test_date"),
+        IndexModel([("doctor_id", ASCENDING)], name="doctor_id", sparse=True),
+        # Exportação sem paciente nem tipo de exame (só laboratório/período): ordena por test_date sem sort em memória
+        IndexModel([("test_date", ASCENDING)], name="test_date"),
+        # Layout compacto (result_ids); parcial, para não indexar os testes ainda no layout de documentos
+        IndexModel(
+            [("result_ids", ASCENDING), ("test_date", ASCENDING)],
+            name="result_ids_test_date",
+            partialFilterExpression={"result_ids": {"$exists": True}}
+        ),
+    ],
+    "blood_test_points": [
+        IndexModel([("patient_id", ASCENDING), ("exam_type_id", ASCENDING), ("test_date", ASCENDING)], name="patient_exam_type_test_date"),
+        IndexModel([("blood_test_id", ASCENDING)], name="blood_test_id"),
+        IndexModel([("exam_type_id", ASCENDING), ("flag", ASCENDING), ("test_date", DESCENDING)], name="exam_type_flag_test_date"),
+        IndexModel(
+            [("exam_type_id", ASCENDING), ("test_date", ASCENDING), ("gender", ASCENDING), ("age_band", ASCENDING)],
+            name="exam_type_test_date_cohort"
+        ),
+    ],
+    "cohort_rollups": [
+        IndexModel([("_id.exam_type_id", ASCENDING), ("_id.month", ASCENDING)], name="exam_type_month"),
+    ],
+    "patients": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+        IndexModel([("search_keys", ASCENDING)], name="search_keys"),
+        IndexModel(
+            [("name", TEXT), ("email", TEXT)],
+            name="name_email_text",
+            weights={"name": 10, "email": 5},
+            default_language="none"
+        ),
+    ],
+    "doctors": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    # Tokens de consumidores que não existem mais (nome padrão inclui o pid) expiram
+    "change_stream_tokens": [
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl", expireAfterSeconds=7 * 24 * 60 * 60),
+    ],
+    "deletions": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+}
+
+# Indexes replaced by the registry; dropped by ensure_indexes when they still exist
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    # Substituído por patient_test_date_id (paginação por cursor)
+    "blood_tests": ["patient_test_date"],
+}
+
+
+async def missing_indexes(db: AsyncIOMotorDatabase) -> Dict[str, List[str]]:
+    """Return the registered index names that do not exist yet, per collection"""
+    missing = {}
+    for collection_name, models in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        names = [model.document["name"] for model in models if model.document["name"] not in existing]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, verify_only: bool = False) -> Dict[str, List[str]]:
+    """Create the registered indexes (idempotent) or, in verify-only mode, just log the missing ones.
+
+    Indexes are created one at a time, so one that cannot be built (e.g. a
+    unique index over duplicate legacy values) does not keep the others of
+    its collection from being created. Retired indexes are dropped.
+    """
+    missing = await missing_indexes(db)
+    if verify_only:
+        for collection_name, names in missing.items():
+            logger.warning("Missing indexes on %s: %s", collection_name, ", ".join(names))
+        return missing
+
+    for collection_name, names in missing.items():
+        for model in INDEXES[collection_name]:
+            if model.document["name"] not in names:
+                continue
+            try:
+                await db[collection_name].create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s on %s: %s", model.document["name"], collection_name, e)
+    await drop_retired_indexes(db)
+    return await missing_indexes(db)
+
+
+async def drop_retired_indexes(db: AsyncIOMotorDatabase) -> List[str]:
+    """Drop the indexes of RETIRED_INDEXES that still exist; returns them as collection.name"""
+    dropped = []
+    for collection_name, names in RETIRED_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                await db[collection_name].drop_index(name)
+            except OperationFailure as e:
+                logger.error("Could not drop retired index %s on %s: %s", name, collection_name, e)
+                continue
+            dropped.append(f"{collection_name}.{name}")
+            logger.info("Dropped retired index %s on %s", name, collection_name)
+    return dropped
+
+
+async def unused_indexes(db: AsyncIOMotorDatabase) -> Dict[str, List[str]]:
+    """Return indexes with no recorded accesses since the server started, using $indexStats"""
+    unused = {}
+    for collection_name in await db.list_collection_names():
+        try:
+            stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except OperationFailure:
+            continue  # Views e coleções de sistema não suportam $indexStats
+        names = [s["name"] for s in stats if s["name"] != "_id_" and s["accesses"]["ops"] == 0]
+        if names:
+            unused[collection_name] = names
+    return unused
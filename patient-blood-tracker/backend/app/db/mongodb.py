@@ -1,11 +1,44 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-from fastapi import Depends
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from ..core.config import settings
+from .pool_metrics import pool_metrics
+from .command_metrics import command_metrics
 
-async def get_database() -> AsyncIOMotorClient:
-    """Get MongoDB database instance"""
-    client = AsyncIOMotorClient(settings.MONGODB_URL)
-    try:
-        yield client[settings.MONGODB_DB_NAME]
-    finally:
-        client.close() 
\ No newline at end of file
+class MongoDB:
+    client: Optional[AsyncIOMotorClient] = None
+
+db = MongoDB()
+
+async def connect_to_mongo() -> AsyncIOMotorClient:
+    """Create the process-wide MongoDB client and warm up its pool"""
+    if db.client is None:
+        db.client = AsyncIOMotorClient(
+            settings.MONGODB_URL,
+            maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            maxIdleTimeMS=settings.MONGODB_MAX_IDLE_TIME_MS,
+            event_listeners=[pool_metrics, command_metrics],
+        )
+        # Força a descoberta do servidor e a abertura da primeira conexão
+        await db.client.admin.command("ping")
+    return db.client
+
+async def close_mongo_connection() -> None:
+    if db.client is not None:
+        db.client.close()
+        db.client = None
+
+async def is_replicated(client: AsyncIOMotorClient) -> bool:
+    """Whether the deployment is a replica set or sharded cluster (needed by transactions and change streams)"""
+    hello = await client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+def get_client() -> AsyncIOMotorClient:
+    if db.client is None:
+        raise RuntimeError("MongoDB client is not initialized; call connect_to_mongo() first.")
+    return db.client
+
+async def get_database() -> AsyncIOMotorDatabase:
+    """Get MongoDB database instance from the shared client"""
+    return get_client()[settings.MONGODB_DB_NAME]
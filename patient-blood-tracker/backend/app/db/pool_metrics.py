@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import Dict
+
+from pymongo import monitoring
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool counters for the shared MongoDB client.
+
+    Check-out start and completion are published on the same thread, so the
+    wait time of each check-out is measured with a thread-local timestamp.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.waiters = 0
+        self.checkouts_total = 0
+        self.checkout_failures_total = 0
+        self.wait_time_total_ms = 0.0
+        self.wait_time_max_ms = 0.0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "waiters": self.waiters,
+                "checkouts_total": self.checkouts_total,
+                "checkout_failures_total": self.checkout_failures_total,
+                "wait_time_avg_ms": (
+                    self.wait_time_total_ms / self.checkouts_total if self.checkouts_total else 0.0
+                ),
+                "wait_time_max_ms": self.wait_time_max_ms,
+            }
+
+    def _finish_wait(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open = max(self.connections_open - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiters += 1
+
+    def connection_check_out_failed(self, event):
+        self._finish_wait()
+        with self._lock:
+            self.waiters = max(self.waiters - 1, 0)
+            self.checkout_failures_total += 1
+
+    def connection_checked_out(self, event):
+        waited_ms = self._finish_wait()
+        with self._lock:
+            self.waiters = max(self.waiters - 1, 0)
+            self.checked_out += 1
+            self.checkouts_total += 1
+            self.wait_time_total_ms += waited_ms
+            self.wait_time_max_ms = max(self.wait_time_max_ms, waited_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+
+pool_metrics = PoolMetricsListener()
@@ -0,0 +1,43 @@
+"""Change counters used to validate cached responses.
+
+Every write through the services bumps the counter of each scope it affects,
+so a list or aggregate response can be revalidated by reading one small
+document instead of re-running its query. Writes made outside the services
+(e.g. directly in the shell) do not bump anything and are only noticed after
+the next write to the same scope.
+"""
+from datetime import datetime
+from typing import Dict
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+VERSIONS_COLLECTION = "collection_versions"
+
+# Scopes; the ones with placeholders are filled with str.format
+PATIENTS = "patients"
+PATIENT = "patients:{patient_id}"
+BLOOD_TESTS = "blood_tests:{patient_id}"
+EXAM_TYPES = "exam_types"
+DOCTORS = "doctors"
+
+
+async def bump_versions(db: AsyncIOMotorDatabase, *scopes: str) -> None:
+    """Increment the counter of each scope (call after the write it describes has completed)"""
+    if not scopes:
+        return
+    now = datetime.utcnow()
+    await db[VERSIONS_COLLECTION].bulk_write([
+        UpdateOne({"_id": scope}, {"$inc": {"version": 1}, "$set": {"updated_at": now}}, upsert=True)
+        for scope in dict.fromkeys(scopes)
+    ], ordered=False)
+
+
+async def get_versions(db: AsyncIOMotorDatabase, *scopes: str) -> Dict[str, Dict]:
+    """Return {"version", "updated_at"} per scope, with version 0 for scopes never written"""
+    cursor = db[VERSIONS_COLLECTION].find({"_id": {"$in": list(scopes)}})
+    found = {doc["_id"]: doc async for doc in cursor}
+    return {
+        scope: {"version": found.get(scope, {}).get("version", 0), "updated_at": found.get(scope, {}).get("updated_at")}
+        for scope in scopes
+    }
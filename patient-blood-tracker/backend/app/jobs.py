@@ -0,0 +1,276 @@
+"""Background jobs: bulk imports, exports, derived-data rebuilds, result flagging, cascade deletes,
+storage layout migrations and index builds.
+
+Uploaded inputs and produced exports live in the `job_files` GridFS bucket so
+the API and the workers can exchange them without shared disk. Files outlive
+neither the job results that point to them (RESULT_EXPIRES_SECONDS) nor a
+failed upload: `cleanup_job_files` deletes the older ones.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from pymongo.errors import AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+
+from .core.config import settings
+from .core.export import csv_chunks, ndjson_chunks
+from .core.streaming import iter_json_array, iter_ndjson
+from .db.indexes import ensure_indexes as ensure_registered_indexes
+from .services.blood_test_service import BloodTestService
+from .services.cohort_service import CohortService
+from .services.deletion_service import DeletionService
+from .services.patient_service import PatientService
+from .services.time_series_service import TimeSeriesService
+from .worker import RESULT_EXPIRES_SECONDS, celery_app
+
+JOB_FILES_BUCKET = "job_files"
+RETRYABLE_ERRORS = (AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError)
+
+
+def job_files(db: AsyncIOMotorDatabase) -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=JOB_FILES_BUCKET)
+
+
+async def iter_file_chunks(db: AsyncIOMotorDatabase, file_id: ObjectId) -> AsyncIterator[bytes]:
+    stream = await job_files(db).open_download_stream(file_id)
+    async for chunk in read_chunks(stream):
+        yield chunk
+
+
+async def delete_expired_job_files(db: AsyncIOMotorDatabase, older_than: datetime) -> int:
+    """Delete the job files uploaded before `older_than`, and chunks left by uploads that never finished"""
+    bucket = job_files(db)
+    files = db[f"{JOB_FILES_BUCKET}.files"]
+    deleted = 0
+    async for file in files.find({"uploadDate": {"$lt": older_than}}, {"_id": 1}):
+        try:
+            await bucket.delete(file["_id"])
+        except NoFile:
+            continue  # Apagado em paralelo (job de importação, outra limpeza)
+        deleted += 1
+    # Upload abortado sem abort(): ficam chunks sem documento em .files; o files_id é da abertura do upload
+    cutoff = ObjectId.from_datetime(older_than)
+    pending = [file["_id"] async for file in files.find({"_id": {"$lt": cutoff}}, {"_id": 1})]
+    await db[f"{JOB_FILES_BUCKET}.chunks"].delete_many({"files_id": {"$lt": cutoff, "$nin": pending}})
+    return deleted
+
+
+async def read_chunks(stream) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await stream.readchunk()
+        if not chunk:
+            break
+        yield chunk
+
+
+def _run(job: Callable[[AsyncIOMotorDatabase], Awaitable[Dict]]) -> Dict:
+    """Run an async job body on its own event loop with its own client.
+
+    The shared API client is bound to the API's event loop, so jobs (which may
+    also run inline in eager mode, from a worker thread) open a short-lived one.
+    """
+    async def runner():
+        client = AsyncIOMotorClient(settings.MONGODB_URL)
+        try:
+            return await job(client[settings.MONGODB_DB_NAME])
+        finally:
+            client.close()
+    return asyncio.run(runner())
+
+
+# acks_late desligado: se o worker cair no meio, a mensagem reentregue inseriria de novo os chunks já gravados
+@celery_app.task(bind=True, name="jobs.import_blood_tests", acks_late=False)
+def import_blood_tests(self, file_id: str, content_type: str) -> Dict:
+    """Ingest an uploaded JSON array / NDJSON file. Not retried nor redelivered: a second run would re-insert accepted records."""
+    def progress(report):
+        self.update_state(state="PROGRESS", meta={"accepted": report["accepted"], "rejected": report["rejected"]})
+
+    async def job(db):
+        chunks = iter_file_chunks(db, ObjectId(file_id))
+        parse = iter_ndjson if "ndjson" in content_type or "jsonl" in content_type else iter_json_array
+        try:
+            report = await BloodTestService(db).bulk_create_blood_tests(parse(chunks), progress=progress)
+        finally:
+            await job_files(db).delete(ObjectId(file_id))
+        return {
+            "accepted": report["accepted"],
+            "rejected": report["rejected"],
+            "rejections": [r for r in report["results"] if r["status"] == "rejected"],
+            **({"stream_error": report["stream_error"]} if "stream_error" in report else {}),
+        }
+    result = _run(job)
+    if result["accepted"]:
+        refresh_cohort_rollups.apply_async()
+    return result
+
+
+@celery_app.task(
+    bind=True, name="jobs.export_blood_tests",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def export_blood_tests(self, format: str = "ndjson", filters: Optional[Dict] = None) -> Dict:
+    """Write a blood-test export to GridFS; the result holds the file id to download"""
+    filters = filters or {}
+
+    async def job(db):
+        service = BloodTestService(db)
+        exported = 0
+
+        async def documents():
+            nonlocal exported
+            async for document in service.iter_blood_tests(**filters):
+                exported += 1
+                if exported % 10000 == 0:
+                    self.update_state(state="PROGRESS", meta={"exported": exported})
+                yield document
+
+        chunks = csv_chunks(documents(), filters.get("exam_type_id")) if format == "csv" else ndjson_chunks(documents())
+        filename = f"blood_tests.{'csv' if format == 'csv' else 'ndjson'}"
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        upload = job_files(db).open_upload_stream(filename, metadata={"content_type": media_type})
+        try:
+            async for chunk in chunks:
+                await upload.write(chunk.encode())
+        except Exception:
+            await upload.abort()
+            raise
+        await upload.close()
+        return {"exported": exported, "file_id": str(upload._id), "filename": filename}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.rebuild_time_series",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def rebuild_time_series(self) -> Dict:
+    async def job(db):
+        return {"processed": await TimeSeriesService(db).backfill()}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.recompute_flags",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def recompute_flags(
+    self, exam_type_id: Optional[str] = None, patient_id: Optional[str] = None, patient_ids: Optional[List[str]] = None
+) -> Dict:
+    """Reclassify stored results (all, or those of one exam type or of some patients); safe to retry"""
+    async def job(db):
+        service = BloodTestService(db)
+        if patient_ids:
+            updated = 0
+            for i, pid in enumerate(patient_ids):
+                updated += await service.recompute_flags(patient_id=pid)
+                self.update_state(state="PROGRESS", meta={"patients": i + 1, "of": len(patient_ids)})
+            return {"updated": updated}
+        return {"updated": await service.recompute_flags(exam_type_id=exam_type_id, patient_id=patient_id)}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.recompute_stale_flags",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def recompute_stale_flags(self) -> Dict:
+    """Reclassify the exam types and patients marked stale by API writes (also scheduled by celery beat)"""
+    def progress(done):
+        self.update_state(state="PROGRESS", meta={"targets": done})
+
+    async def job(db):
+        return {"updated": await BloodTestService(db).recompute_stale_flags(progress=progress)}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.refresh_cohort_rollups",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def refresh_cohort_rollups(self, full: bool = False) -> Dict:
+    """Re-aggregate the cohort rollup months changed since the last run (scheduled by celery beat)"""
+    async def job(db):
+        return {"refreshed": await CohortService(db).refresh_rollups(full=full)}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.process_deletions",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def process_deletions(self, deletion_id: Optional[str] = None) -> Dict:
+    """Cascade a delete (or every pending one) to the referencing blood tests in chunks; idempotent, safe to retry"""
+    def progress(deletion):
+        self.update_state(state="PROGRESS", meta={"deletion_id": deletion["_id"], "processed": deletion["processed"]})
+
+    async def job(db):
+        finished = await DeletionService(db).process(deletion_id, progress=progress)
+        return {"deletions": [{"deletion_id": d["_id"], "status": d["status"], "processed": d["processed"]} for d in finished]}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.migrate_blood_test_layout",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def migrate_blood_test_layout(self, layout: Optional[str] = None) -> Dict:
+    """Rewrite blood tests into the given (default: configured) storage layout; resumable, safe to retry"""
+    def progress(migrated):
+        self.update_state(state="PROGRESS", meta={"migrated": migrated})
+
+    async def job(db):
+        service = BloodTestService(db)
+        migrated = await service.migrate_layout(layout, progress=progress)
+        return {"migrated": migrated, "layouts": await service.layout_stats()}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.backfill_search_keys",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def backfill_search_keys(self) -> Dict:
+    """Compute missing search keys and normalize legacy emails; collisions are reported, not merged"""
+    async def job(db):
+        service = PatientService(db)
+        return {"updated": await service.backfill_search_keys(), **await service.normalize_stored_emails()}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.ensure_indexes",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def ensure_indexes(self) -> Dict:
+    async def job(db):
+        return {"missing": await ensure_registered_indexes(db)}
+    return _run(job)
+
+
+@celery_app.task(
+    bind=True, name="jobs.cleanup_job_files",
+    autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, max_retries=3
+)
+def cleanup_job_files(self) -> Dict:
+    """Delete job files whose job result has expired (their download link is gone)"""
+    async def job(db):
+        older_than = datetime.utcnow() - timedelta(seconds=RESULT_EXPIRES_SECONDS)
+        return {"deleted": await delete_expired_job_files(db, older_than)}
+    return _run(job)
+
+
+# Jobs that can be started by name from the API, without parameters
+MAINTENANCE_JOBS = {
+    "rebuild-time-series": rebuild_time_series,
+    "recompute-flags": recompute_flags,
+    "recompute-stale-flags": recompute_stale_flags,
+    "refresh-cohort-rollups": refresh_cohort_rollups,
+    "process-deletions": process_deletions,
+    "migrate-blood-test-layout": migrate_blood_test_layout,
+    "backfill-search-keys": backfill_search_keys,
+    "ensure-indexes": ensure_indexes,
+    "cleanup-job-files": cleanup_job_files,
+}
@@ -1,20 +1,49 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 import os
 
 from .core.config import settings
-from .api.endpoints import patients, blood_tests, exam_types, doctors
+from .core.metrics import render_gauges, render_metrics
+from .core.request_metrics import RequestMetricsMiddleware
+from .db.mongodb import connect_to_mongo, close_mongo_connection
+from .db.change_feed import change_feed
+from .db.pool_metrics import pool_metrics
+from .db.indexes import ensure_indexes
+from .services.reference_data import cache_stats
+from .services.live_updates import patient_events
+from .api.endpoints import patients, blood_tests, exam_types, doctors, jobs, cohorts
 
 # Load environment variables
 load_dotenv()
 
+# MongoDB connection and change feed
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.mongodb_client = await connect_to_mongo()
+    app.mongodb = app.mongodb_client[settings.MONGODB_DB_NAME]
+    if settings.MONGODB_INDEX_MODE != "off":
+        # Roda em background para não atrasar o startup
+        app.index_task = asyncio.create_task(
+            ensure_indexes(app.mongodb, verify_only=settings.MONGODB_INDEX_MODE == "verify")
+        )
+    # Invalida caches locais e alimenta /patients/{id}/events com as escritas de qualquer réplica
+    await change_feed.start(app.mongodb)
+    try:
+        yield
+    finally:
+        await change_feed.stop()
+        await close_mongo_connection()
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description="API for tracking patient health data and blood tests",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -26,15 +55,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB connection
-@app.on_event("startup")
-async def startup_db_client():
-    app.mongodb_client = AsyncIOMotorClient(settings.MONGODB_URL)
-    app.mongodb = app.mongodb_client[settings.MONGODB_DB_NAME]
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    app.mongodb_client.close()
+# Latency histograms by route and slow-request log (outermost, so it times the whole stack)
+app.add_middleware(RequestMetricsMiddleware)
 
 # Include routers
 app.include_router(
@@ -61,10 +83,45 @@ app.include_router(
     tags=["doctors"]
 )
 
+app.include_router(
+    cohorts.router,
+    prefix=f"{settings.API_V1_PREFIX}/cohorts",
+    tags=["cohorts"]
+)
+
+app.include_router(
+    jobs.router,
+    prefix=f"{settings.API_V1_PREFIX}/jobs",
+    tags=["jobs"]
+)
+
 # Root endpoint
 @app.get("/")
 async def root():
     return {
         "message": "Welcome to People Health Tracker API",
         "status": "operational"
-    } 
\ No newline at end of file
+    } 
+
+@app.get("/health/db-pool")
+async def db_pool_metrics():
+    """MongoDB connection pool metrics (checked-out, waiters, wait time)"""
+    return pool_metrics.snapshot()
+
+@app.get("/health/cache")
+async def reference_cache_metrics():
+    """Hit/miss counters of the exam type and doctor caches"""
+    return cache_stats()
+
+@app.get("/health/change-feed")
+async def change_feed_status():
+    """Whether the change stream consumer is running, and how many live-update streams are open"""
+    return {"running": change_feed.running, "consumer": change_feed.name, "subscribers": patient_events.subscriber_count()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request, MongoDB command and pool metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        render_metrics(render_gauges("mongodb_pool", pool_metrics.snapshot(), "MongoDB connection pool metric")),
+        media_type="text/plain; version=0.0.4"
+    )
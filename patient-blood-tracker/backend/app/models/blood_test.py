@@ -6,6 +6,7 @@ from .objectid import PydanticObjectId
 class ExamResult(BaseModel):
     exam_type_id: str
     value: float
+    flag: Optional[str] = None  # low/normal/high/critical, set by the server on write
 
 class BloodTestBase(BaseModel):
     patient_id: str
@@ -37,4 +38,12 @@ class BloodTestInDB(BloodTestBase):
         allow_population_by_field_name = True
         json_encoders = {
             datetime: lambda v: v.isoformat()
-        } 
\ No newline at end of file
+        }
+
+# Slim preset for listings (fields=summary)
+class BloodTestSummary(BaseModel):
+    id: PydanticObjectId = Field(..., alias="_id")
+    patient_id: str
+    test_date: datetime
+    lab_name: str
+    doctor_id: Optional[str] = None
@@ -1,5 +1,11 @@
 from .person import Person
-from pydantic import Field
+from pydantic import BaseModel, EmailStr, Field
 
 class Doctor(Person):
-    specialty: str = Field(...) 
\ No newline at end of file
+    specialty: str = Field(...)
+
+# Slim preset for listings (fields=summary)
+class DoctorSummary(BaseModel):
+    name: str
+    email: EmailStr
+    specialty: str
@@ -1,11 +1,14 @@
 from datetime import datetime
-from typing import Dict, Any
+from typing import Any, Dict, Optional
 from pydantic import BaseModel, Field
 from .objectid import PydanticObjectId
 
 class ReferenceRange(BaseModel):
     min: float
     max: float
+    # Optional panic values; results beyond them are flagged "critical"
+    critical_min: Optional[float] = None
+    critical_max: Optional[float] = None
 
 class ExamTypeBase(BaseModel):
     name: str
@@ -29,4 +32,9 @@ class ExamTypeInDB(ExamTypeBase):
         allow_population_by_field_name = True
         json_encoders = {
             datetime: lambda v: v.isoformat()
-        } 
\ No newline at end of file
+        }
+
+# Slim preset for listings (fields=summary)
+class ExamTypeSummary(BaseModel):
+    id: PydanticObjectId = Field(..., alias="_id")
+    name: str
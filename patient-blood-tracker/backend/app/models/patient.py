@@ -29,4 +29,12 @@ class PatientInDB(PatientBase):
         validate_by_name = True
         json_encoders = {
             datetime: lambda v: v.isoformat(),
-        } 
\ No newline at end of file
+        }
+
+# Slim preset for listings (fields=summary)
+class PatientSummary(BaseModel):
+    id: PydanticObjectId = Field(..., alias="_id")
+    name: str
+    email: EmailStr
+    gender: str
+    date_of_birth: datetime
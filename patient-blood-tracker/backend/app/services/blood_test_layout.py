@@ -0,0 +1,149 @@
+"""Storage layouts of blood-test results.
+
+"documents" (the original layout) stores `results` as a list of
+{exam_type_id, value, flag} subdocuments next to a separate `exam_types` list.
+"compact" stores the results as parallel arrays: `result_ids` (ObjectIds, 12
+bytes instead of a 24-character string), `result_values` (doubles) and
+`result_flags`, with no per-result key names. `exam_types` is derived from
+result_ids and only stored when it differs from them.
+
+Services always work with the documents shape: encode before writing,
+decode after reading. Both layouts are read, so a collection can be migrated
+(BloodTestService.migrate_layout) while the API serves it; new writes use
+BLOOD_TEST_LAYOUT.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from ..core.config import settings
+
+DOCUMENTS = "documents"
+COMPACT = "compact"
+LAYOUTS = (DOCUMENTS, COMPACT)
+
+RESULT_IDS = "result_ids"
+RESULT_VALUES = "result_values"
+RESULT_FLAGS = "result_flags"
+COMPACT_FIELDS = (RESULT_IDS, RESULT_VALUES, RESULT_FLAGS)
+
+# Projection that fetches the results and exam types in either layout
+RESULT_PROJECTION = {"results": 1, "exam_types": 1, **{field: 1 for field in COMPACT_FIELDS}}
+
+
+def resolve_layout(layout: Optional[str] = None) -> str:
+    layout = layout or settings.BLOOD_TEST_LAYOUT
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown blood test layout: {layout} (expected one of {', '.join(LAYOUTS)})")
+    return layout
+
+
+def _object_id(value: Any) -> Any:
+    return ObjectId(value) if isinstance(value, str) and ObjectId.is_valid(value) else value
+
+
+def derived_exam_types(results: List[Dict]) -> List[str]:
+    return list(dict.fromkeys(result["exam_type_id"] for result in results))
+
+
+def encode_results(
+    results: List[Dict], exam_types: List[str], layout: Optional[str] = None
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Fields to set and fields to remove to store these results in the layout"""
+    if resolve_layout(layout) == DOCUMENTS:
+        return {"results": results, "exam_types": exam_types}, list(COMPACT_FIELDS)
+    stored = {
+        RESULT_IDS: [_object_id(result["exam_type_id"]) for result in results],
+        RESULT_VALUES: [float(result["value"]) for result in results],
+        RESULT_FLAGS: [result.get("flag") for result in results],
+    }
+    if list(exam_types) == derived_exam_types(results):
+        return stored, ["results", "exam_types"]
+    stored["exam_types"] = exam_types
+    return stored, ["results"]
+
+
+def encode(document: Dict, layout: Optional[str] = None) -> Dict:
+    """Copy of a blood-test dict (documents shape) as stored in the layout"""
+    if "results" not in document:
+        return dict(document)
+    stored_fields, removed = encode_results(document["results"] or [], document.get("exam_types") or [], layout)
+    stored = {key: value for key, value in document.items() if key not in removed}
+    stored.update(stored_fields)
+    return stored
+
+
+def results_update(results: List[Dict], exam_types: List[str], layout: Optional[str] = None) -> Dict:
+    """Update operators that store the results in the layout, replacing the fields of the other one"""
+    stored, removed = encode_results(results, exam_types, layout)
+    update = {"$set": stored}
+    if removed:
+        update["$unset"] = {field: "" for field in removed}
+    return update
+
+
+def decode(document: Optional[Dict], projection: Optional[Dict[str, int]] = None) -> Optional[Dict]:
+    """Turn a stored document (either layout) into the documents shape, in place.
+
+    With a projection, results/exam_types are only kept when it asked for them
+    (compact fields fetched to derive one of them are dropped).
+    """
+    if not document or not any(field in document for field in COMPACT_FIELDS):
+        return document
+    has_ids = RESULT_IDS in document
+    ids = [str(i) for i in document.pop(RESULT_IDS, None) or []]
+    values = document.pop(RESULT_VALUES, None)
+    flags = document.pop(RESULT_FLAGS, None)
+    if values is not None:
+        flags = flags or [None] * len(values)
+        document["results"] = [
+            {"exam_type_id": exam_type_id, "value": value, "flag": flag}
+            for exam_type_id, value, flag in zip(ids, values, flags)
+        ]
+    if has_ids and "exam_types" not in document:
+        document["exam_types"] = list(dict.fromkeys(ids))
+    if projection:
+        for field in ("results", "exam_types"):
+            if not projection.get(field):
+                document.pop(field, None)
+    return document
+
+
+def storage_projection(projection: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """Projection on the API fields extended with the compact fields they are derived from"""
+    if not projection:
+        return projection
+    stored = dict(projection)
+    if projection.get("results"):
+        stored.update({field: 1 for field in COMPACT_FIELDS})
+    if projection.get("exam_types"):
+        stored[RESULT_IDS] = 1
+    return stored
+
+
+def exam_type_filter(exam_type_id: str) -> Dict:
+    """Query matching the tests with a result of the exam type, in either layout"""
+    return {"$or": [{"results.exam_type_id": exam_type_id}, {RESULT_IDS: _object_id(exam_type_id)}]}
+
+
+def result_value(exam_type_id: str) -> Dict:
+    """Aggregation expression: the test's value for the exam type, in either layout, without $unwind.
+
+    Only meaningful on tests matched by exam_type_filter ($indexOfArray
+    returns -1, i.e. the last value, when the exam type is absent); a test
+    with the same exam type twice yields its first result.
+    """
+    return {"$cond": [
+        {"$isArray": f"${RESULT_VALUES}"},
+        {"$arrayElemAt": [f"${RESULT_VALUES}", {"$indexOfArray": [f"${RESULT_IDS}", _object_id(exam_type_id)]}]},
+        {"$arrayElemAt": ["$results.value", {"$indexOfArray": ["$results.exam_type_id", exam_type_id]}]},
+    ]}
+
+
+# Aggregation expression: the exam type ids of a test's results as strings, in either layout
+RESULT_EXAM_TYPE_IDS = {"$cond": [
+    {"$isArray": f"${RESULT_IDS}"},
+    {"$map": {"input": f"${RESULT_IDS}", "in": {"$toString": "$$this"}}},
+    {"$ifNull": ["$results.exam_type_id", []]},
+]}
+
+# Aggregation expression: "compact" or "documents", for layout statistics
+STORED_LAYOUT = {"$cond": [{"$isArray": f"${RESULT_VALUES}"}, COMPACT, DOCUMENTS]}
@@ -1,64 +1,301 @@
+import asyncio
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, List, Optional, Dict, Tuple, Union
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo import ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from ..core.pagination import encode_cursor, keyset_filter, keyset_sort
+from ..core.projection import apply_projection, with_fields
+from ..core.streaming import MalformedRecord
+from ..db.versions import BLOOD_TESTS, bump_versions
+from ..models.pagination import Page
 from ..models.blood_test import BloodTestCreate, BloodTestUpdate, BloodTestInDB
+from .blood_test_layout import (
+    COMPACT, RESULT_EXAM_TYPE_IDS, RESULT_PROJECTION, RESULT_VALUES, STORED_LAYOUT,
+    decode, encode, exam_type_filter, resolve_layout, result_value, results_update, storage_projection
+)
+from .reference_data import doctor_reference, exam_type_reference
+from .reference_ranges import ABNORMAL_FLAGS, classify_results, reference_range_key
+from .time_series_service import PATIENT_PROFILE, TimeSeriesService
+
+BULK_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 2000
+RECOMPUTE_BATCH_SIZE = 1000
+MIGRATE_BATCH_SIZE = 1000
+# Releituras de um lote de recompute_flags cujos testes foram alterados entre a leitura e a escrita
+RECOMPUTE_RETRIES = 3
+RECOMPUTE_PROJECTION = {"patient_id": 1, "test_date": 1, "updated_at": 1, **RESULT_PROJECTION}
+
+PATIENT_FLAGS = "patient"
+EXAM_TYPE_FLAGS = "exam_type"
 
 class BloodTestService:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
         self.collection = db.blood_tests
+        self.exam_types = exam_type_reference(db)
+        self.doctors = doctor_reference(db)
+        self.time_series = TimeSeriesService(db)
 
-    async def create_blood_test(self, blood_test: BloodTestCreate) -> BloodTestInDB:
-        # Validação: garantir que o patient_id existe
-        patient = await self.db.patients.find_one({"_id": ObjectId(blood_test.patient_id)})
-        if not patient:
-            raise ValueError("Patient not found for the provided patient_id.")
-        # Validação: garantir que todos os exam_types existem
+    async def _patient_profiles(self, ids) -> Dict[str, Dict]:
+        """Gender, date of birth and diseases of the given patients that exist, using one $in query"""
+        object_ids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+        if not object_ids:
+            return {}
+        cursor = self.db.patients.find({"_id": {"$in": object_ids}}, PATIENT_PROFILE)
+        return {str(doc["_id"]): doc async for doc in cursor}
+
+    async def _reference_values(self) -> Dict[str, Dict]:
+        return {str(exam_type["_id"]): exam_type.get("reference_values") or {} for exam_type in await self.exam_types.list_all()}
+
+    async def _resolve_references(self, known: Dict, patient_ids, exam_type_ids, doctor_ids) -> None:
+        """Add to `known` the referenced ids that exist, querying only ids not already known.
+
+        Patients are kept with the profile needed to flag results; exam types
+        and doctors are resolved from the reference-data cache.
+        """
+        patients, exam_types, doctors = await asyncio.gather(
+            self._patient_profiles(set(patient_ids).difference(known["patients"])),
+            self.exam_types.existing_ids(set(exam_type_ids) - known["exam_types"]),
+            self.doctors.existing_ids(set(doctor_ids) - known["doctors"]),
+        )
+        known["patients"].update(patients)
+        known["exam_types"].update(exam_types)
+        known["doctors"].update(doctors)
+
+    async def _find_patient(self, patient_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        if not ObjectId.is_valid(patient_id):
+            return None
+        return await self.db.patients.find_one({"_id": ObjectId(patient_id)}, projection)
+
+    @staticmethod
+    def _reference_errors(blood_test: BloodTestCreate, known: Dict) -> List[str]:
+        errors = []
+        if blood_test.patient_id not in known["patients"]:
+            errors.append("Patient not found for the provided patient_id.")
         for exam_type_id in blood_test.exam_types:
-            exam_type = await self.db.exam_types.find_one({"_id": ObjectId(exam_type_id)})
-            if not exam_type:
-                raise ValueError(f"ExamType not found for id: {exam_type_id}")
-        # Validação: garantir que o doctor_id existe (se informado)
-        if blood_test.doctor_id:
-            doctor = await self.db.doctors.find_one({"_id": ObjectId(blood_test.doctor_id)})
-            if not doctor:
-                raise ValueError(f"Doctor not found for id: {blood_test.doctor_id}")
-        # Validação: garantir que todos os exam_type_id em results existem
+            if exam_type_id not in known["exam_types"]:
+                errors.append(f"ExamType not found for id: {exam_type_id}")
+        if blood_test.doctor_id and blood_test.doctor_id not in known["doctors"]:
+            errors.append(f"Doctor not found for id: {blood_test.doctor_id}")
         for result in blood_test.results:
-            exam_type = await self.db.exam_types.find_one({"_id": ObjectId(result.exam_type_id)})
-            if not exam_type:
-                raise ValueError(f"ExamType not found for result exam_type_id: {result.exam_type_id}")
+            if result.exam_type_id not in known["exam_types"]:
+                errors.append(f"ExamType not found for result exam_type_id: {result.exam_type_id}")
+        return list(dict.fromkeys(errors))
+
+    async def create_blood_test(self, blood_test: BloodTestCreate) -> BloodTestInDB:
+        """Validate references, insert and return the test built from the written document (no re-read)"""
+        # Validação: todas as referências resolvidas com uma consulta $in por coleção, em paralelo
+        known = {"patients": {}, "exam_types": set(), "doctors": set()}
+        await self._resolve_references(
+            known,
+            [blood_test.patient_id],
+            set(blood_test.exam_types) | {r.exam_type_id for r in blood_test.results},
+            [blood_test.doctor_id] if blood_test.doctor_id else [],
+        )
+        errors = self._reference_errors(blood_test, known)
+        if errors:
+            raise ValueError("; ".join(errors))
         blood_test_dict = blood_test.dict()
         blood_test_dict["created_at"] = datetime.utcnow()
         blood_test_dict["updated_at"] = datetime.utcnow()
+        classify_results(
+            blood_test_dict["results"], known["patients"][blood_test.patient_id],
+            await self._reference_values(), blood_test.test_date
+        )
         
-        result = await self.collection.insert_one(blood_test_dict)
-        created_test = await self.collection.find_one({"_id": result.inserted_id})
+        result = await self.collection.insert_one(encode(blood_test_dict))
+        blood_test_dict["_id"] = result.inserted_id
+        await self.time_series.add_points([blood_test_dict], known["patients"])
+        await bump_versions(self.db, BLOOD_TESTS.format(patient_id=blood_test.patient_id))
         
-        return BloodTestInDB(**created_test)
+        return BloodTestInDB(**blood_test_dict)
+
+    async def bulk_create_blood_tests(
+        self,
+        records: AsyncIterable[Any],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        progress: Optional[Callable[[Dict], None]] = None
+    ) -> Dict:
+        """Validate and insert a stream of raw blood-test records in chunks.
+
+        References are checked with set-based queries per chunk (ids already
+        seen in earlier chunks are not queried again) and each chunk is written
+        with an unordered insert_many. Returns a per-record report; `progress`,
+        if given, is called with the running report after each chunk.
+
+        Chunks are committed as they go, so a stream that turns out to be
+        malformed or truncated does not raise: the records decoded before the
+        error are still ingested and the report gets a `stream_error`.
+        """
+        report = {"accepted": 0, "rejected": 0, "results": []}
+        known = {"patients": {}, "exam_types": set(), "doctors": set()}
+        chunk = []
+        index = 0
+        try:
+            async for record in records:
+                chunk.append((index, record))
+                index += 1
+                if len(chunk) >= chunk_size:
+                    await self._ingest_chunk(chunk, known, report)
+                    chunk = []
+                    if progress:
+                        progress(report)
+        except ValueError as e:
+            # Os chunks anteriores já foram gravados: o relatório diz o que entrou e onde o arquivo quebrou
+            report["stream_error"] = f"{e} (after {index} records)"
+        if chunk:
+            await self._ingest_chunk(chunk, known, report)
+        return report
+
+    async def _ingest_chunk(self, chunk: List[Tuple[int, Any]], known: Dict, report: Dict) -> None:
+        outcomes = {}
+        valid = []
+        for index, record in chunk:
+            if isinstance(record, MalformedRecord):
+                outcomes[index] = [record.error]
+                continue
+            try:
+                valid.append((index, BloodTestCreate.model_validate(record)))
+            except ValidationError as e:
+                outcomes[index] = [
+                    f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+                ]
+
+        await self._resolve_references(
+            known,
+            {bt.patient_id for _, bt in valid},
+            {i for _, bt in valid for i in bt.exam_types} | {r.exam_type_id for _, bt in valid for r in bt.results},
+            {bt.doctor_id for _, bt in valid if bt.doctor_id},
+        )
+
+        reference_values = await self._reference_values()
+        now = datetime.utcnow()
+        documents = []
+        document_indexes = []
+        for index, blood_test in valid:
+            errors = self._reference_errors(blood_test, known)
+            if errors:
+                outcomes[index] = errors
+                continue
+            document = blood_test.dict()
+            document["_id"] = ObjectId()
+            document["created_at"] = now
+            document["updated_at"] = now
+            classify_results(document["results"], known["patients"][blood_test.patient_id], reference_values, blood_test.test_date)
+            documents.append(document)
+            document_indexes.append(index)
+
+        if documents:
+            try:
+                await self.collection.insert_many([encode(document) for document in documents], ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    outcomes[document_indexes[error["index"]]] = [error.get("errmsg", "Write error")]
+            inserted = []
+            for index, document in zip(document_indexes, documents):
+                if index not in outcomes:
+                    outcomes[index] = document["_id"]
+                    inserted.append(document)
+            await self.time_series.add_points(inserted, known["patients"])
+            await bump_versions(self.db, *(BLOOD_TESTS.format(patient_id=d["patient_id"]) for d in inserted))
+
+        for index in sorted(outcomes):
+            outcome = outcomes[index]
+            if isinstance(outcome, ObjectId):
+                report["accepted"] += 1
+                report["results"].append({"index": index, "status": "accepted", "id": str(outcome)})
+            else:
+                report["rejected"] += 1
+                report["results"].append({"index": index, "status": "rejected", "errors": outcome})
 
     async def get_blood_test(self, test_id: str) -> Optional[BloodTestInDB]:
         if not ObjectId.is_valid(test_id):
             return None
             
-        test = await self.collection.find_one({"_id": ObjectId(test_id)})
-        return BloodTestInDB(**test) if test else None
+        test = decode(await self.collection.find_one({"_id": ObjectId(test_id)}))
+        return BloodTestInDB.model_construct(**test) if test else None
 
     async def get_patient_blood_tests(
         self,
         patient_id: str,
         skip: int = 0,
         limit: int = 10,
-        test_type: Optional[str] = None
-    ) -> List[BloodTestInDB]:
+        test_type: Optional[str] = None,
+        projection: Optional[Dict[str, int]] = None
+    ) -> List[Union[BloodTestInDB, Dict]]:
+        """With a projection the raw projected documents are returned instead of models"""
         query = {"patient_id": patient_id}
         if test_type:
             query["test_type"] = test_type
             
-        cursor = self.collection.find(query).sort("test_date", -1).skip(skip).limit(limit)
-        tests = await cursor.to_list(length=limit)
-        return [BloodTestInDB(**test) for test in tests]
+        cursor = self.collection.find(query, storage_projection(projection)).sort("test_date", -1).skip(skip).limit(limit)
+        tests = [decode(test, projection) for test in await cursor.to_list(length=limit)]
+        if projection:
+            return tests
+        return [BloodTestInDB.model_construct(**test) for test in tests]
+
+    async def get_patient_blood_tests_page(
+        self,
+        patient_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        projection: Optional[Dict[str, int]] = None
+    ) -> Page:
+        """Keyset pagination ordered by (test_date desc, _id desc); raises ValueError for an invalid cursor.
+
+        With a projection the page items are the raw projected documents.
+        """
+        query = {"patient_id": patient_id}
+        if cursor:
+            query.update(keyset_filter("test_date", cursor, descending=True))
+
+        fetch = storage_projection(with_fields(projection, ["test_date", "_id"])) if projection else None
+        docs = await self.collection.find(query, fetch).sort(keyset_sort("test_date", descending=True)).limit(limit + 1).to_list(length=limit + 1)
+        docs = [decode(doc) for doc in docs]
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["test_date"], docs[-1]["_id"])
+        if projection:
+            items = [apply_projection(doc, projection) for doc in docs]
+            return Page[Dict].model_construct(items=items, next_cursor=next_cursor)
+        return Page[BloodTestInDB].model_construct(items=[BloodTestInDB.model_construct(**doc) for doc in docs], next_cursor=next_cursor)
+
+    async def iter_blood_tests(
+        self,
+        patient_id: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        exam_type_id: Optional[str] = None,
+        lab_name: Optional[str] = None,
+        batch_size: int = EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[Dict]:
+        """Iterate blood-test documents matching the filters in test_date order, without materializing them in a list.
+
+        Every filter combination has an index that yields that order: by
+        patient (patient_test_date_id), by exam type (the result indexes of
+        both layouts, merged) or otherwise the test_date index.
+        """
+        query = {}
+        if patient_id:
+            query["patient_id"] = patient_id
+        if exam_type_id:
+            query.update(exam_type_filter(exam_type_id))
+        if lab_name:
+            query["lab_name"] = lab_name
+        if start or end:
+            query["test_date"] = {}
+            if start:
+                query["test_date"]["$gte"] = start
+            if end:
+                query["test_date"]["$lte"] = end
+
+        cursor = self.collection.find(query).sort("test_date", 1).batch_size(batch_size)
+        async for document in cursor:
+            yield decode(document)
 
     async def get_latest_blood_test(
         self,
@@ -69,30 +306,58 @@ class BloodTestService:
         if test_type:
             query["test_type"] = test_type
             
-        test = await self.collection.find_one(
+        test = decode(await self.collection.find_one(
             query,
             sort=[("test_date", -1)]
-        )
-        return BloodTestInDB(**test) if test else None
+        ))
+        return BloodTestInDB.model_construct(**test) if test else None
 
     async def update_blood_test(
         self,
         test_id: str,
         blood_test_update: BloodTestUpdate
     ) -> Optional[BloodTestInDB]:
+        """Apply a partial update and return the document as stored after it, in one round trip"""
         if not ObjectId.is_valid(test_id):
             return None
 
         update_data = blood_test_update.dict(exclude_unset=True)
         update_data["updated_at"] = datetime.utcnow()
+        changed = set(update_data)
+        update = {"$set": update_data}
+        previous = None
+        if {"patient_id", "test_date", "results", "exam_types"} & changed:
+            # As classificações dependem do paciente e da data; mudar de paciente
+            # também altera as listas do paciente anterior. Resultados e exam_types
+            # são gravados juntos, pois no layout compacto um deriva do outro
+            previous = decode(await self.collection.find_one(
+                {"_id": ObjectId(test_id)}, {"patient_id": 1, "test_date": 1, **RESULT_PROJECTION}
+            ))
+            if previous:
+                results = update_data.pop("results", None)
+                exam_types = update_data.pop("exam_types", None)
+                results = classify_results(
+                    results if results is not None else previous.get("results") or [],
+                    await self._find_patient(update_data.get("patient_id") or previous["patient_id"], PATIENT_PROFILE),
+                    await self._reference_values(),
+                    update_data.get("test_date") or previous["test_date"]
+                )
+                stored = results_update(results, exam_types if exam_types is not None else previous.get("exam_types") or [])
+                update_data.update(stored["$set"])
+                if "$unset" in stored:
+                    update["$unset"] = stored["$unset"]
 
-        result = await self.collection.update_one(
+        updated_test = decode(await self.collection.find_one_and_update(
             {"_id": ObjectId(test_id)},
-            {"$set": update_data}
-        )
+            update,
+            return_document=ReturnDocument.AFTER
+        ))
 
-        if result.modified_count:
-            updated_test = await self.collection.find_one({"_id": ObjectId(test_id)})
+        if updated_test:
+            if {"patient_id", "test_date", "results"} & changed:
+                await self.time_series.replace_points(updated_test)
+            patient_ids = {updated_test["patient_id"]} | ({previous["patient_id"]} if previous else set())
+            await bump_versions(self.db, *(BLOOD_TESTS.format(patient_id=p) for p in patient_ids))
             return BloodTestInDB(**updated_test)
         return None
 
@@ -100,32 +365,358 @@ class BloodTestService:
         if not ObjectId.is_valid(test_id):
             return False
             
-        result = await self.collection.delete_one({"_id": ObjectId(test_id)})
-        return result.deleted_count > 0
+        deleted = await self.collection.find_one_and_delete({"_id": ObjectId(test_id)}, {"patient_id": 1})
+        if not deleted:
+            return False
+        await self.time_series.delete_points(ObjectId(test_id))
+        await bump_versions(self.db, BLOOD_TESTS.format(patient_id=deleted["patient_id"]))
+        return True
+
+    async def recompute_flags(
+        self,
+        exam_type_id: Optional[str] = None,
+        patient_id: Optional[str] = None,
+        batch_size: int = RECOMPUTE_BATCH_SIZE
+    ) -> int:
+        """Reclassify stored results after reference ranges or a patient's profile change.
+
+        Reads the exam types from the database, not from the cache, so a change
+        made moments ago is seen. Only tests whose flags change are written
+        (tests and their time-series points); returns how many were updated.
+        With a patient_id the patient's points are also re-derived, to refresh
+        the gender/age/diseases copied onto them. Writes are conditional on the
+        updated_at that was read, so a concurrent update_blood_test is never
+        overwritten; the tests it changed are read again and reclassified.
+        """
+        query = exam_type_filter(exam_type_id) if exam_type_id else {}
+        if patient_id:
+            query["patient_id"] = patient_id
+        reference_values = {
+            str(exam_type["_id"]): exam_type.get("reference_values") or {}
+            async for exam_type in self.db.exam_types.find({}, {"reference_values": 1})
+        }
+        profiles = {}
+        updated = 0
+        batch = []
+        cursor = self.collection.find(query, RECOMPUTE_PROJECTION).batch_size(batch_size)
+        async for blood_test in cursor:
+            batch.append(decode(blood_test))
+            if len(batch) >= batch_size:
+                updated += await self._recompute_batch(batch, reference_values, profiles)
+                batch = []
+        if batch:
+            updated += await self._recompute_batch(batch, reference_values, profiles)
+        if patient_id:
+            await self.time_series.rebuild_patient(patient_id)
+        return updated
+
+    async def mark_flags_stale(self, exam_type_id: Optional[str] = None, patient_ids: Iterable[str] = ()) -> None:
+        """Record that the results of an exam type or of some patients need reclassifying.
+
+        Markers live in flag_recompute_dirty (like cohort_rollup_dirty), so a
+        reclassification asked for by a committed write survives a broker
+        outage: recompute_stale_flags, run after the write and by celery beat,
+        picks them up.
+        """
+        targets = [(EXAM_TYPE_FLAGS, exam_type_id)] if exam_type_id else []
+        targets += [(PATIENT_FLAGS, patient_id) for patient_id in dict.fromkeys(patient_ids)]
+        if not targets:
+            return
+        now = datetime.utcnow()
+        await self.db.flag_recompute_dirty.bulk_write([
+            UpdateOne(
+                {"_id": f"{kind}:{target_id}"},
+                {"$set": {"kind": kind, "target_id": target_id, "marked_at": now}},
+                upsert=True
+            )
+            for kind, target_id in targets
+        ], ordered=False)
+
+    async def recompute_stale_flags(self, progress: Optional[Callable[[int], None]] = None) -> int:
+        """Reclassify every exam type and patient marked stale; returns how many tests changed.
+
+        A marker is only removed if it was not marked again while its
+        reclassification ran, so a concurrent change is never lost.
+        """
+        updated = 0
+        markers = await self.db.flag_recompute_dirty.find().sort("marked_at", 1).to_list(length=None)
+        for done, marker in enumerate(markers, 1):
+            if marker["kind"] == EXAM_TYPE_FLAGS:
+                updated += await self.recompute_flags(exam_type_id=marker["target_id"])
+            else:
+                updated += await self.recompute_flags(patient_id=marker["target_id"])
+            await self.db.flag_recompute_dirty.delete_one({"_id": marker["_id"], "marked_at": marker["marked_at"]})
+            if progress:
+                progress(done)
+        return updated
+
+    async def _recompute_batch(
+        self, batch: List[Dict], reference_values: Dict[str, Dict], profiles: Dict[str, Dict], attempt: int = 0
+    ) -> int:
+        profiles.update(await self._patient_profiles({bt["patient_id"] for bt in batch} - profiles.keys()))
+        # O BSON guarda milissegundos: truncado, o valor relido é igual ao gravado
+        now = datetime.utcnow()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        test_ops, changed = [], []
+        for blood_test in batch:
+            results = blood_test.get("results") or []
+            before = [result.get("flag") for result in results]
+            classify_results(results, profiles.get(blood_test["patient_id"]), reference_values, blood_test["test_date"])
+            if before == [result["flag"] for result in results]:
+                continue
+            update = results_update(results, blood_test.get("exam_types") or [])
+            update["$set"]["updated_at"] = now
+            test_ops.append(UpdateOne({"_id": blood_test["_id"], "updated_at": blood_test.get("updated_at")}, update))
+            changed.append(blood_test)
+        if not test_ops:
+            return 0
+        result = await self.collection.bulk_write(test_ops, ordered=False)
+        missed = []
+        if result.matched_count < len(test_ops):
+            # Alterados depois da leitura: não tocam nos pontos (já refeitos pela atualização) e são relidos
+            missed = await self.collection.find(
+                {"_id": {"$in": [bt["_id"] for bt in changed]}, "updated_at": {"$ne": now}}, RECOMPUTE_PROJECTION
+            ).to_list(length=None)
+            missed_ids = {bt["_id"] for bt in missed}
+            changed = [bt for bt in changed if bt["_id"] not in missed_ids]
+        updated = await self._apply_recomputed(changed)
+        if missed and attempt < RECOMPUTE_RETRIES:
+            updated += await self._recompute_batch([decode(bt) for bt in missed], reference_values, profiles, attempt + 1)
+        return updated
+
+    async def _apply_recomputed(self, changed: List[Dict]) -> int:
+        """Copy the new flags of reclassified tests to their time-series points"""
+        if not changed:
+            return 0
+        point_ops = [
+            UpdateMany(
+                {"blood_test_id": blood_test["_id"], "exam_type_id": result["exam_type_id"]},
+                {"$set": {"flag": result["flag"]}}
+            )
+            for blood_test in changed for result in blood_test["results"]
+        ]
+        patient_ids = {blood_test["patient_id"] for blood_test in changed}
+        await self.time_series.collection.bulk_write(point_ops, ordered=False)
+        await self.time_series.mark_dirty(
+            {"exam_type_id": result["exam_type_id"], "test_date": blood_test["test_date"]}
+            for blood_test in changed for result in blood_test["results"]
+        )
+        await bump_versions(self.db, *(BLOOD_TESTS.format(patient_id=p) for p in patient_ids))
+        return len(changed)
+
+    async def migrate_layout(
+        self,
+        layout: Optional[str] = None,
+        batch_size: int = MIGRATE_BATCH_SIZE,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """Rewrite the tests stored in another layout into `layout` (default BLOOD_TEST_LAYOUT); returns how many.
+
+        Walks the collection in _id order in batches, so it can be interrupted
+        and run again. A test updated between the read and the write is
+        skipped (the replace is conditional on its updated_at); that update
+        already stored it in the configured layout, or the next run converts it.
+        Content and updated_at are unchanged, so cached responses stay valid.
+        """
+        layout = resolve_layout(layout)
+        pending = {RESULT_VALUES: {"$exists": layout != COMPACT}}
+        migrated = 0
+        last_id = None
+        while True:
+            query = {**pending, "_id": {"$gt": last_id}} if last_id else pending
+            batch = await self.collection.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            ops = [
+                ReplaceOne({"_id": test["_id"], "updated_at": test.get("updated_at")}, encode(decode(test), layout))
+                for test in batch
+            ]
+            migrated += (await self.collection.bulk_write(ops, ordered=False)).modified_count
+            if progress:
+                progress(migrated)
+        return migrated
+
+    async def layout_stats(self) -> Dict[str, Dict]:
+        """Number of tests and average BSON size per stored layout"""
+        cursor = self.collection.aggregate([
+            {"$group": {"_id": STORED_LAYOUT, "count": {"$sum": 1}, "avg_size": {"$avg": {"$bsonSize": "$$ROOT"}}}}
+        ])
+        return {doc["_id"]: {"count": doc["count"], "avg_size": round(doc["avg_size"], 1)} async for doc in cursor}
+
+    async def get_abnormal_results(
+        self,
+        exam_type_id: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        flags: Optional[List[str]] = None,
+        limit: int = 100
+    ) -> List[Dict]:
+        """Patients with flagged results of one exam type in a date window, with their name and latest flagged value"""
+        matches = await self.time_series.find_abnormal(exam_type_id, flags or ABNORMAL_FLAGS, start, end, limit)
+        names = {
+            str(doc["_id"]): doc.get("name")
+            async for doc in self.db.patients.find(
+                {"_id": {"$in": [ObjectId(m["patient_id"]) for m in matches if ObjectId.is_valid(m["patient_id"])]}},
+                {"name": 1}
+            )
+        }
+        return [{**match, "patient_name": names.get(match["patient_id"])} for match in matches]
 
     async def get_test_statistics(
         self,
         patient_id: str,
-        test_type: str,
-        metric: str
+        exam_type_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
     ) -> Dict:
-        """Get statistics for a specific test metric over time"""
+        """Series and statistics of one exam type for a patient, computed server-side.
+
+        The exam type comes from the reference cache and the patient lookup runs
+        concurrently with the aggregation, so this costs one round trip of latency.
+        Out-of-range counts are computed for every reference range of the exam
+        type and the one matching the patient's gender/age is reported.
+        Percentiles use the nearest lower rank. Raises ValueError if the exam
+        type does not exist.
+        """
+        exam_type = await self.exam_types.get(exam_type_id)
+        if not exam_type:
+            raise ValueError(f"ExamType not found for id: {exam_type_id}")
+        ranges = list((exam_type.get("reference_values") or {}).items())
+
+        match = {"patient_id": patient_id, **exam_type_filter(exam_type_id)}
+        if start or end:
+            match["test_date"] = {}
+            if start:
+                match["test_date"]["$gte"] = start
+            if end:
+                match["test_date"]["$lte"] = end
+        day = {"$divide": [{"$toLong": "$$this.date"}, 86400000]}
+        group = {
+            "_id": None,
+            "series": {"$push": {"date": "$date", "value": "$value"}},
+            "count": {"$sum": 1},
+            "mean": {"$avg": "$value"},
+            "min": {"$min": "$value"},
+            "max": {"$max": "$value"},
+            "stddev": {"$stdDevSamp": "$value"},
+            "mean_day": {"$avg": {"$divide": [{"$toLong": "$date"}, 86400000]}}
+        }
+        for i, (_, rng) in enumerate(ranges):
+            group[f"below_{i}"] = {"$sum": {"$cond": [{"$lt": ["$value", rng["min"]]}, 1, 0]}}
+            group[f"above_{i}"] = {"$sum": {"$cond": [{"$gt": ["$value", rng["max"]]}, 1, 0]}}
+
         pipeline = [
-            {"$match": {
-                "patient_id": patient_id,
-                "test_type": test_type
-            }},
+            {"$match": match},
             {"$sort": {"test_date": 1}},
-            {"$project": {
-                "date": "$test_date",
-                "value": f"$results.{metric}"
-            }}
+            # O valor é lido por posição (sem $unwind), em qualquer layout
+            {"$project": {"_id": 0, "date": "$test_date", "value": result_value(exam_type_id)}},
+            {"$group": group},
+            {"$set": {
+                "sorted": {"$sortArray": {"input": "$series.value", "sortBy": 1}},
+                "regression": {"$reduce": {
+                    "input": "$series",
+                    "initialValue": {"sxy": 0, "sxx": 0},
+                    "in": {
+                        "sxy": {"$add": ["$$value.sxy", {"$multiply": [
+                            {"$subtract": [day, "$mean_day"]},
+                            {"$subtract": ["$$this.value", "$mean"]}
+                        ]}]},
+                        "sxx": {"$add": ["$$value.sxx", {"$pow": [{"$subtract": [day, "$mean_day"]}, 2]}]}
+                    }
+                }}
+            }},
+            {"$set": {
+                "percentiles": {
+                    name: {"$arrayElemAt": ["$sorted", {"$toInt": {"$floor": {"$multiply": [p, {"$subtract": ["$count", 1]}]}}}]}
+                    for name, p in (("p25", 0.25), ("p50", 0.5), ("p75", 0.75), ("p90", 0.9))
+                },
+                "slope_per_day": {"$cond": [
+                    {"$gt": ["$regression.sxx", 0]},
+                    {"$divide": ["$regression.sxy", "$regression.sxx"]},
+                    None
+                ]}
+            }},
+            {"$project": {"_id": 0, "sorted": 0, "regression": 0, "mean_day": 0}}
         ]
-        
-        cursor = self.collection.aggregate(pipeline)
-        results = await cursor.to_list(length=None)
-        
+
+        docs, patient = await asyncio.gather(
+            self.collection.aggregate(pipeline).to_list(length=1),
+            self._find_patient(patient_id, {"gender": 1, "date_of_birth": 1})
+        )
+        stats = docs[0] if docs else {"series": [], "count": 0, "mean": None, "min": None, "max": None,
+                                       "stddev": None, "percentiles": None, "slope_per_day": None}
+
+        range_key = reference_range_key(patient, dict(ranges))
+        reference_range = None
+        below = above = None
+        for i, (key, rng) in enumerate(ranges):
+            below_count = stats.pop(f"below_{i}", 0)
+            above_count = stats.pop(f"above_{i}", 0)
+            if key == range_key:
+                reference_range = {"key": key, "min": rng["min"], "max": rng["max"]}
+                below, above = below_count, above_count
+
+        return {
+            "patient_id": patient_id,
+            "exam_type_id": exam_type_id,
+            "exam_type_name": exam_type.get("name"),
+            "reference_range": reference_range,
+            "count": stats["count"],
+            "mean": stats["mean"],
+            "min": stats["min"],
+            "max": stats["max"],
+            "stddev": stats["stddev"],
+            "percentiles": stats["percentiles"],
+            "slope_per_day": stats["slope_per_day"],
+            "below_range": below,
+            "above_range": above,
+            "out_of_range": below + above if reference_range else None,
+            "values": stats["series"]
+        }
+
+    async def get_patient_summary(
+        self,
+        patient_id: str,
+        exam_type_id: Optional[str] = None
+    ) -> Dict:
+        """Summarize a patient's blood tests in a single aggregation"""
+        facets = {
+            "total": [{"$count": "count"}],
+            "by_type": [
+                {"$project": {"exam_type_id": RESULT_EXAM_TYPE_IDS}},
+                {"$unwind": "$exam_type_id"},
+                {"$group": {"_id": "$exam_type_id", "count": {"$sum": 1}}}
+            ]
+        }
+        if exam_type_id:
+            facets["metric"] = [
+                {"$match": exam_type_filter(exam_type_id)},
+                {"$project": {"value": result_value(exam_type_id)}},
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "avg": {"$avg": "$value"},
+                    "min": {"$min": "$value"},
+                    "max": {"$max": "$value"},
+                    "stddev": {"$stdDevSamp": "$value"}
+                }}
+            ]
+        pipeline = [
+            {"$match": {"patient_id": patient_id}},
+            {"$facet": facets}
+        ]
+
+        docs = await self.collection.aggregate(pipeline).to_list(length=1)
+        facet = docs[0] if docs else {}
+        total = facet.get("total") or [{"count": 0}]
+        metric = (facet.get("metric") or [None])[0]
+        if metric:
+            metric.pop("_id", None)
         return {
+            "total_tests": total[0]["count"],
+            "count_by_type": {item["_id"]: item["count"] for item in facet.get("by_type", [])},
+            "exam_type_id": exam_type_id,
             "metric": metric,
-            "values": results
-        } 
\ No newline at end of file
+            "metric_avg": metric["avg"] if metric else None
+        }
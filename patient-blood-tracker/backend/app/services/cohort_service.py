@@ -0,0 +1,228 @@
+from datetime import datetime
+from math import sqrt
+from typing import Dict, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from ..core.config import settings
+from .reference_ranges import FLAG_CRITICAL, FLAG_HIGH, FLAG_LOW, FLAG_NORMAL
+from .time_series_service import month_of
+
+FLAGS = [FLAG_LOW, FLAG_NORMAL, FLAG_HIGH, FLAG_CRITICAL]
+PERCENTILES = (("p5", 0.05), ("p25", 0.25), ("p50", 0.5), ("p75", 0.75), ("p95", 0.95))
+REFRESH_CHUNK_SIZE = 100
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+class CohortService:
+    """Cross-patient analytics of one analyte over blood_test_points.
+
+    Points carry the patient's gender, age band and diseases, so filtering
+    needs no $lookup. Distributions are computed live (allowDiskUse, bounded
+    by COHORT_MAX_TIME_MS); monthly trends are read from cohort_rollups, one
+    document per (exam type, month, gender, age band), which refresh_rollups()
+    keeps up to date by re-aggregating only the months marked dirty by writes.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.points = db.blood_test_points
+        self.rollups = db.cohort_rollups
+        self.dirty = db.cohort_rollup_dirty
+
+    @staticmethod
+    def _match(
+        exam_type_id: str,
+        gender: Optional[str] = None,
+        age_bands: Optional[List[str]] = None,
+        disease: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Dict:
+        match = {"exam_type_id": exam_type_id}
+        if start or end:
+            match["test_date"] = {}
+            if start:
+                match["test_date"]["$gte"] = start
+            if end:
+                match["test_date"]["$lte"] = end
+        if gender:
+            match["gender"] = gender
+        if age_bands:
+            match["age_band"] = {"$in": age_bands}
+        if disease:
+            match["diseases"] = disease
+        return match
+
+    async def get_distribution(
+        self,
+        exam_type_id: str,
+        gender: Optional[str] = None,
+        age_bands: Optional[List[str]] = None,
+        disease: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        bins: int = 20
+    ) -> Dict:
+        """Count, mean, spread, approximate percentiles, histogram and flag counts of an analyte across patients.
+
+        Raises pymongo ExecutionTimeout when the aggregation exceeds COHORT_MAX_TIME_MS.
+        """
+        pipeline = [
+            {"$match": self._match(exam_type_id, gender, age_bands, disease, start, end)},
+            {"$project": {"_id": 0, "patient_id": 1, "value": 1, "flag": 1}},
+            {"$facet": {
+                "stats": [{"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "mean": {"$avg": "$value"},
+                    "stddev": {"$stdDevSamp": "$value"},
+                    "min": {"$min": "$value"},
+                    "max": {"$max": "$value"},
+                    "percentiles": {"$percentile": {
+                        "input": "$value", "p": [p for _, p in PERCENTILES], "method": "approximate"
+                    }}
+                }}],
+                "histogram": [{"$bucketAuto": {"groupBy": "$value", "buckets": bins}}],
+                "flags": [{"$group": {"_id": "$flag", "count": {"$sum": 1}}}],
+                "patients": [{"$group": {"_id": "$patient_id"}}, {"$count": "count"}]
+            }}
+        ]
+        docs = await self.points.aggregate(
+            pipeline, allowDiskUse=True, maxTimeMS=settings.COHORT_MAX_TIME_MS
+        ).to_list(length=1)
+        facet = docs[0] if docs else {}
+        stats = (facet.get("stats") or [None])[0]
+        patients = facet.get("patients") or [{"count": 0}]
+        return {
+            "exam_type_id": exam_type_id,
+            "count": stats["count"] if stats else 0,
+            "patients": patients[0]["count"],
+            "mean": stats["mean"] if stats else None,
+            "stddev": stats["stddev"] if stats else None,
+            "min": stats["min"] if stats else None,
+            "max": stats["max"] if stats else None,
+            "percentiles": dict(zip((name for name, _ in PERCENTILES), stats["percentiles"])) if stats else None,
+            "histogram": [
+                {"min": b["_id"]["min"], "max": b["_id"]["max"], "count": b["count"]}
+                for b in facet.get("histogram", [])
+            ],
+            "flags": {item["_id"]: item["count"] for item in facet.get("flags", []) if item["_id"]}
+        }
+
+    async def get_trend(
+        self,
+        exam_type_id: str,
+        gender: Optional[str] = None,
+        age_bands: Optional[List[str]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Dict:
+        """Monthly count, mean, spread and flag counts from the rollups (months overlapping start..end)"""
+        match = {"_id.exam_type_id": exam_type_id}
+        if start or end:
+            match["_id.month"] = {}
+            if start:
+                match["_id.month"]["$gte"] = month_of(start)
+            if end:
+                match["_id.month"]["$lte"] = end
+        if gender:
+            match["_id.gender"] = gender
+        if age_bands:
+            match["_id.age_band"] = {"$in": age_bands}
+        group = {
+            "_id": "$_id.month",
+            "count": {"$sum": "$count"},
+            "sum": {"$sum": "$sum"},
+            "sum_sq": {"$sum": "$sum_sq"},
+            "min": {"$min": "$min"},
+            "max": {"$max": "$max"},
+            **{f"flag_{flag}": {"$sum": f"$flags.{flag}"} for flag in FLAGS}
+        }
+        months = await self.rollups.aggregate(
+            [{"$match": match}, {"$group": group}, {"$sort": {"_id": 1}}]
+        ).to_list(length=None)
+
+        total = {"count": 0, "sum": 0, "sum_sq": 0, "min": None, "max": None, **{f"flag_{flag}": 0 for flag in FLAGS}}
+        for month in months:
+            for key in ["count", "sum", "sum_sq"] + [f"flag_{flag}" for flag in FLAGS]:
+                total[key] += month[key]
+            total["min"] = month["min"] if total["min"] is None else min(total["min"], month["min"])
+            total["max"] = month["max"] if total["max"] is None else max(total["max"], month["max"])
+        return {
+            "exam_type_id": exam_type_id,
+            "total": self._summarize(total),
+            "months": [{"month": month["_id"], **self._summarize(month)} for month in months]
+        }
+
+    @staticmethod
+    def _summarize(group: Dict) -> Dict:
+        count = group["count"]
+        variance = (group["sum_sq"] - group["sum"] ** 2 / count) / (count - 1) if count > 1 else None
+        return {
+            "count": count,
+            "mean": group["sum"] / count if count else None,
+            "stddev": sqrt(max(variance, 0.0)) if variance is not None else None,
+            "min": group["min"],
+            "max": group["max"],
+            "flags": {flag: group[f"flag_{flag}"] for flag in FLAGS}
+        }
+
+    async def _aggregate_into_rollups(self, match: Dict, refresh_id: ObjectId) -> None:
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "exam_type_id": "$exam_type_id",
+                    "month": {"$dateTrunc": {"date": "$test_date", "unit": "month"}},
+                    "gender": "$gender",
+                    "age_band": "$age_band"
+                },
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$value"},
+                "sum_sq": {"$sum": {"$multiply": ["$value", "$value"]}},
+                "min": {"$min": "$value"},
+                "max": {"$max": "$value"},
+                **{f"flag_{flag}": {"$sum": {"$cond": [{"$eq": ["$flag", flag]}, 1, 0]}} for flag in FLAGS}
+            }},
+            {"$set": {"flags": {flag: f"$flag_{flag}" for flag in FLAGS}}},
+            {"$unset": [f"flag_{flag}" for flag in FLAGS]},
+            {"$set": {"refresh_id": refresh_id}},
+            {"$merge": {"into": self.rollups.name, "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ]
+        await self.points.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+    async def refresh_rollups(self, full: bool = False) -> int:
+        """Re-aggregate the (exam type, month) groups changed since the last refresh, or all of them.
+
+        Returns the number of groups refreshed (0 for a full rebuild, which does
+        not track groups). Marks made while the refresh runs are kept for the next one.
+
+        Groups are rewritten in place by $merge, stamped with this refresh's
+        id; only then are the groups of the refreshed months that were not
+        rewritten (they have no points left) deleted, so trend reads never
+        see a month missing while it is refreshed.
+        """
+        started = datetime.utcnow()
+        refresh_id = ObjectId()
+        if full:
+            await self._aggregate_into_rollups({}, refresh_id)
+            await self.rollups.delete_many({"refresh_id": {"$ne": refresh_id}})
+            await self.dirty.delete_many({"marked_at": {"$lte": started}})
+            return 0
+
+        dirty = await self.dirty.find({"marked_at": {"$lte": started}}, {"_id": 1}).to_list(length=None)
+        keys = [doc["_id"] for doc in dirty]
+        for i in range(0, len(keys), REFRESH_CHUNK_SIZE):
+            chunk = keys[i:i + REFRESH_CHUNK_SIZE]
+            await self._aggregate_into_rollups({"$or": [
+                {"exam_type_id": key["exam_type_id"], "test_date": {"$gte": key["month"], "$lt": _next_month(key["month"])}}
+                for key in chunk
+            ]}, refresh_id)
+            # Grupos que ficaram vazios não foram reescritos pelo $merge
+            await self.rollups.delete_many({
+                "$or": [{"_id.exam_type_id": key["exam_type_id"], "_id.month": key["month"]} for key in chunk],
+                "refresh_id": {"$ne": refresh_id}
+            })
+            await self.dirty.delete_many({"_id": {"$in": chunk}, "marked_at": {"$lte": started}})
+        return len(keys)
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from .blood_test_service import BloodTestService
+from .patient_service import PatientService
+from .reference_data import exam_type_reference
+from .time_series_service import TimeSeriesService
+
+RECENT_TESTS = 5
+TREND_POINTS = 20
+
+class DashboardService:
+    """Composes everything the patient page needs from concurrent queries on the shared client"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.patients = PatientService(db)
+        self.blood_tests = BloodTestService(db)
+        self.time_series = TimeSeriesService(db)
+        self.exam_types = exam_type_reference(db)
+
+    async def get_patient_dashboard(self, patient_id: str) -> Optional[Dict]:
+        patient, recent, summary, trends, exam_types = await asyncio.gather(
+            self.patients.get_patient(patient_id),
+            self.blood_tests.get_patient_blood_tests(patient_id, skip=0, limit=RECENT_TESTS),
+            self.blood_tests.get_patient_summary(patient_id),
+            self.time_series.get_recent_trends(patient_id, TREND_POINTS),
+            self.exam_types.list_all()
+        )
+        if not patient:
+            return None
+        names = {str(exam_type["_id"]): exam_type.get("name") for exam_type in exam_types}
+        return {
+            "patient": patient,
+            "latest_test": recent[0] if recent else None,
+            "recent_tests": recent,
+            "summary": summary,
+            "exam_type_names": {
+                exam_type_id: names.get(exam_type_id)
+                for exam_type_id in set(summary["count_by_type"]) | set(trends)
+            },
+            "trends": [
+                {"exam_type_id": exam_type_id, "exam_type_name": names.get(exam_type_id), "points": points}
+                for exam_type_id, points in trends.items()
+            ]
+        }
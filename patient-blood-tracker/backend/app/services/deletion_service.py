@@ -0,0 +1,180 @@
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from ..db.mongodb import is_replicated
+from ..db.versions import BLOOD_TESTS, PATIENT, PATIENTS, bump_versions
+from .blood_test_layout import RESULT_PROJECTION, decode, exam_type_filter, results_update
+from .reference_data import doctor_reference, exam_type_reference
+from .time_series_service import TimeSeriesService
+
+CASCADE_CHUNK_SIZE = 500
+
+PATIENT_KIND = "patient"
+EXAM_TYPE_KIND = "exam_type"
+DOCTOR_KIND = "doctor"
+KIND_COLLECTIONS = {PATIENT_KIND: "patients", EXAM_TYPE_KIND: "exam_types", DOCTOR_KIND: "doctors"}
+
+PENDING = "pending"
+DONE = "done"
+
+class DeletionService:
+    """Deletes patients, exam types and doctors together with what references them in blood_tests.
+
+    The document itself is deleted right away, after recording a tombstone in
+    `deletions`; the dependent blood tests are then processed in chunks by a
+    background job (process), each chunk in a transaction when the deployment
+    supports them (replica set or sharded cluster):
+
+    - patient: its blood tests and their time-series points are deleted
+    - exam type: its results are pulled from the blood tests and its points deleted
+    - doctor: doctor_id is unset on its blood tests
+
+    Chunks are selected by what still references the target, so processing is
+    idempotent: an interrupted run is resumed by running it again, and the
+    scheduled sweep finishes deletions whose job was lost. Without transactions
+    points are deleted before their tests, so a partial chunk never leaves
+    points without a test.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db.deletions
+        self.time_series = TimeSeriesService(db)
+        self._transactions: Optional[bool] = None
+
+    @staticmethod
+    def deletion_id(kind: str, target_id: str) -> str:
+        return f"{kind}:{target_id}"
+
+    async def delete(self, kind: str, target_id: str) -> Optional[Dict]:
+        """Delete the document and record its pending cascade; returns the tombstone, or None when not found.
+
+        Repeating the delete of a document whose cascade has not finished
+        returns the existing tombstone, so clients can safely retry; once the
+        cascade is done the document is simply gone (None).
+        """
+        if not ObjectId.is_valid(target_id):
+            return None
+        now = datetime.utcnow()
+        deletion_id = self.deletion_id(kind, target_id)
+        # O tombstone vem antes do delete: se o processo cair entre os dois, a varredura conclui o cascade
+        previous = await self.collection.find_one_and_update(
+            {"_id": deletion_id},
+            {"$setOnInsert": {
+                "kind": kind, "target_id": target_id, "status": PENDING,
+                "processed": 0, "created_at": now, "updated_at": now, "completed_at": None,
+            }},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        result = await self.db[KIND_COLLECTIONS[kind]].delete_one({"_id": ObjectId(target_id)})
+        if not result.deleted_count and previous is None:
+            await self.collection.delete_one({"_id": deletion_id})
+            return None
+        if not result.deleted_count and previous["status"] == DONE:
+            return None
+        if result.deleted_count:
+            await self._invalidate(kind, target_id)
+        return await self.collection.find_one({"_id": deletion_id})
+
+    async def _invalidate(self, kind: str, target_id: str) -> None:
+        if kind == PATIENT_KIND:
+            await bump_versions(self.db, PATIENTS, PATIENT.format(patient_id=target_id))
+        elif kind == EXAM_TYPE_KIND:
+            await exam_type_reference(self.db).invalidate(target_id)
+        else:
+            await doctor_reference(self.db).invalidate(target_id)
+
+    async def get_deletion(self, kind: str, target_id: str) -> Optional[Dict]:
+        return await self.collection.find_one({"_id": self.deletion_id(kind, target_id)})
+
+    async def process(
+        self,
+        deletion_id: Optional[str] = None,
+        chunk_size: int = CASCADE_CHUNK_SIZE,
+        progress: Optional[Callable[[Dict], None]] = None
+    ) -> List[Dict]:
+        """Run the cascade of one deletion, or of every pending one; returns the finished tombstones"""
+        query = {"_id": deletion_id} if deletion_id else {"status": PENDING}
+        finished = []
+        # Lê a lista antes: um cascade longo deixaria o cursor ocioso até expirar
+        for deletion in await self.collection.find(query).sort("created_at", 1).to_list(length=None):
+            if deletion["status"] == PENDING:
+                deletion = await self._cascade(deletion, chunk_size, progress)
+            finished.append(deletion)
+        return finished
+
+    async def _cascade(self, deletion: Dict, chunk_size: int, progress: Optional[Callable[[Dict], None]]) -> Dict:
+        kind, target_id = deletion["kind"], deletion["target_id"]
+        query, apply = {
+            PATIENT_KIND: ({"patient_id": target_id}, self._delete_tests),
+            EXAM_TYPE_KIND: (exam_type_filter(target_id), self._pull_results),
+            DOCTOR_KIND: ({"doctor_id": target_id}, self._unset_doctor),
+        }[kind]
+        while True:
+            tests = await self.db.blood_tests.find(query, {"patient_id": 1}).limit(chunk_size).to_list(length=None)
+            if not tests:
+                break
+            await self._in_transaction(apply, target_id, [test["_id"] for test in tests])
+            await bump_versions(self.db, *{BLOOD_TESTS.format(patient_id=test["patient_id"]) for test in tests})
+            deletion = await self.collection.find_one_and_update(
+                {"_id": deletion["_id"]},
+                {"$inc": {"processed": len(tests)}, "$set": {"updated_at": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+            if progress:
+                progress(deletion)
+
+        if kind == EXAM_TYPE_KIND:
+            # Testes que listam o tipo de exame sem ter resultado dele (não cobertos pelos índices de resultados)
+            await self.db.blood_tests.update_many({"exam_types": target_id}, {"$pull": {"exam_types": target_id}})
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"_id": deletion["_id"]},
+            {"$set": {"status": DONE, "updated_at": now, "completed_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _supports_transactions(self) -> bool:
+        if self._transactions is None:
+            self._transactions = await is_replicated(self.db.client)
+        return self._transactions
+
+    async def _in_transaction(self, apply, target_id: str, test_ids: List[ObjectId]) -> None:
+        if not await self._supports_transactions():
+            await apply(target_id, test_ids, None)
+            return
+        async with await self.db.client.start_session() as session:
+            # with_transaction repete o chunk em erros transitórios; cada passo é idempotente
+            await session.with_transaction(lambda s: apply(target_id, test_ids, s))
+
+    async def _delete_tests(self, patient_id: str, test_ids: List[ObjectId], session) -> None:
+        await self.time_series.delete_points_of(test_ids, session=session)
+        await self.db.blood_tests.delete_many({"_id": {"$in": test_ids}}, session=session)
+
+    async def _pull_results(self, exam_type_id: str, test_ids: List[ObjectId], session) -> None:
+        await self.time_series.delete_points_of(test_ids, exam_type_id, session=session)
+        # Reescreve os resultados no layout configurado (no compacto são arrays paralelos, sem $pull)
+        now = datetime.utcnow()
+        ops = []
+        async for test in self.db.blood_tests.find({"_id": {"$in": test_ids}}, RESULT_PROJECTION, session=session):
+            test = decode(test)
+            results = [r for r in test.get("results") or [] if r["exam_type_id"] != exam_type_id]
+            if not results:
+                # Um teste que só tinha esse exame fica vazio
+                ops.append(DeleteOne({"_id": test["_id"]}))
+                continue
+            update = results_update(results, [e for e in test.get("exam_types") or [] if e != exam_type_id])
+            update["$set"]["updated_at"] = now
+            ops.append(UpdateOne({"_id": test["_id"]}, update))
+        if ops:
+            await self.db.blood_tests.bulk_write(ops, ordered=False, session=session)
+
+    async def _unset_doctor(self, doctor_id: str, test_ids: List[ObjectId], session) -> None:
+        await self.db.blood_tests.update_many(
+            {"_id": {"$in": test_ids}},
+            {"$set": {"doctor_id": None, "updated_at": datetime.utcnow()}},
+            session=session
+        )
@@ -0,0 +1,161 @@
+"""Per-patient live updates, pushed to dashboards as Server-Sent Events.
+
+The change feed (db/change_feed.py) hands every write to patients and
+blood_tests to the broker, which forwards it to the subscribers of the
+patient it belongs to. Events are:
+
+- patient: the patient after an insert or update, as GET /patients/{id} sends it
+- patient_deleted: {"_id"} of a deleted patient
+- blood_test: a blood test (documents layout) after an insert or update
+- blood_test_deleted: {"_id"} of a deleted blood test
+- reset: events were lost (slow client, change stream restarted); refetch
+
+The change stream carries no document for updates and deletes, so the
+broker keeps the ids of the blood tests of subscribed patients to route
+them, and fetches a document only when its patient has subscribers.
+Events are not replayed: a client that reconnects should refetch the
+dashboard, then apply the events it receives.
+"""
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from bson import ObjectId
+
+from ..core.config import settings
+from ..core.responses import dump_json
+from ..db.change_feed import RESET, ChangeEvent, change_feed
+from ..db.mongodb import get_database
+from ..models.patient import PatientInDB
+from .blood_test_layout import decode
+
+RETRY_MS = 3000
+
+
+class PatientEventBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # Testes dos pacientes assinados: updates e deletes chegam só com o _id
+        self._tests: Dict[str, Set[ObjectId]] = {}
+        self._patient_of_test: Dict[ObjectId, str] = {}
+        self._ids = itertools.count(1)
+
+    async def subscribe(self, patient_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.LIVE_UPDATES_QUEUE_SIZE)
+        first = patient_id not in self._subscribers
+        self._subscribers.setdefault(patient_id, set()).add(queue)
+        if first:
+            await self._load_tests(patient_id)
+        return queue
+
+    def unsubscribe(self, patient_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(patient_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[patient_id]
+            for test_id in self._tests.pop(patient_id, ()):
+                self._patient_of_test.pop(test_id, None)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def _load_tests(self, patient_id: str) -> None:
+        db = await get_database()
+        cursor = db.blood_tests.find({"patient_id": patient_id}, {"_id": 1})
+        test_ids = {doc["_id"] async for doc in cursor}
+        if patient_id not in self._subscribers:
+            return  # Desconectou durante a leitura
+        # Inserções vistas durante a leitura já estão no conjunto
+        self._tests.setdefault(patient_id, set()).update(test_ids)
+        self._patient_of_test.update(dict.fromkeys(test_ids, patient_id))
+
+    def _track(self, patient_id: str, test_id: ObjectId) -> None:
+        self._tests.setdefault(patient_id, set()).add(test_id)
+        self._patient_of_test[test_id] = patient_id
+
+    def _untrack(self, test_id: ObjectId) -> None:
+        patient_id = self._patient_of_test.pop(test_id, None)
+        if patient_id is not None:
+            self._tests.get(patient_id, set()).discard(test_id)
+
+    def publish(self, patient_id: str, event: str, data: Any = None) -> None:
+        for queue in self._subscribers.get(patient_id, ()):
+            self._put(queue, event, data)
+
+    def _put(self, queue: asyncio.Queue, event: str, data: Any) -> None:
+        message = {"id": next(self._ids), "event": event, "data": data or {}}
+        if queue.full():
+            # Cliente lento: descarta o que está na fila e pede que recarregue
+            while not queue.empty():
+                queue.get_nowait()
+            message = {"id": message["id"], "event": RESET, "data": {}}
+        queue.put_nowait(message)
+
+    async def on_change(self, change: ChangeEvent) -> None:
+        if change.operation == RESET:
+            for patient_id, queues in list(self._subscribers.items()):
+                for queue in queues:
+                    self._put(queue, RESET, None)
+                # Eventos perdidos: o conjunto de testes pode estar desatualizado
+                await self._load_tests(patient_id)
+            return
+        if change.collection == "patients":
+            await self._on_patient_change(change)
+        else:
+            await self._on_blood_test_change(change)
+
+    async def _on_patient_change(self, change: ChangeEvent) -> None:
+        patient_id = str(change.document_id)
+        if patient_id not in self._subscribers:
+            return
+        if change.operation == "delete":
+            self.publish(patient_id, "patient_deleted", {"_id": change.document_id})
+            return
+        patient = await (await get_database()).patients.find_one({"_id": change.document_id})
+        if patient is not None:
+            # Mesmos campos da API REST: sem search_keys/search_name
+            self.publish(patient_id, "patient", PatientInDB.model_construct(**patient))
+
+    async def _on_blood_test_change(self, change: ChangeEvent) -> None:
+        test_id = change.document_id
+        if change.operation == "delete":
+            patient_id = self._patient_of_test.get(test_id)
+            self._untrack(test_id)
+            if patient_id is not None:
+                self.publish(patient_id, "blood_test_deleted", {"_id": test_id})
+            return
+        patient_id = change.patient_id or self._patient_of_test.get(test_id)
+        if patient_id not in self._subscribers:
+            return
+        self._track(patient_id, test_id)
+        blood_test = await (await get_database()).blood_tests.find_one({"_id": test_id})
+        if blood_test is not None:
+            # Ausente: foi apagado depois do evento, o delete vem a seguir
+            self.publish(patient_id, "blood_test", decode(blood_test))
+
+
+patient_events = PatientEventBroker()
+change_feed.add_hook(["patients", "blood_tests"], patient_events.on_change)
+
+
+def sse_message(message: Dict) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (message["id"], message["event"].encode(), dump_json(message["data"]))
+
+
+async def patient_event_stream(patient_id: str) -> AsyncIterator[bytes]:
+    """SSE body for one patient: events as they arrive, with a keepalive comment when idle"""
+    queue = await patient_events.subscribe(patient_id)
+    try:
+        yield b"retry: %d\n\n" % RETRY_MS
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), settings.LIVE_UPDATES_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Mantém proxies e balanceadores sem fechar a conexão ociosa
+                yield b": keepalive\n\n"
+                continue
+            yield sse_message(message)
+    finally:
+        patient_events.unsubscribe(patient_id, queue)
@@ -1,8 +1,31 @@
-from datetime import datetime
-from typing import List, Optional
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, Callable, Dict, List, Optional, Tuple, Union
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from ..core.config import settings
+from ..core.pagination import encode_cursor, keyset_filter, keyset_sort
+from ..core.projection import apply_projection, with_fields
+from ..core.streaming import MalformedRecord
+from ..core.text import build_search_keys, normalize_email, normalize_search_text, prefix_pattern
+from ..db.versions import PATIENT, PATIENTS, bump_versions
+from ..models.pagination import Page
 from ..models.patient import PatientCreate, PatientUpdate, PatientInDB
+from .deletion_service import PATIENT_KIND, DeletionService
+
+BULK_CHUNK_SIZE = 1000
+PROFILE_FIELDS = ("gender", "date_of_birth", "diseases")
+
+def _as_stored(value: Any) -> Any:
+    """A value as MongoDB returns it once saved: datetimes naive UTC, to the millisecond"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
 
 class PatientService:
     def __init__(self, db: AsyncIOMotorDatabase):
@@ -10,65 +33,330 @@ class PatientService:
         self.collection = db.patients
 
     async def create_patient(self, patient: PatientCreate) -> PatientInDB:
+        """Insert a patient and return it built from the written document (no re-read)"""
         patient_dict = patient.dict()
+        patient_dict["email"] = normalize_email(patient.email)
         patient_dict["created_at"] = datetime.utcnow()
         patient_dict["updated_at"] = datetime.utcnow()
+        patient_dict["search_name"] = normalize_search_text(patient.name)
+        patient_dict["search_keys"] = build_search_keys(patient.name, patient.email)
         
-        result = await self.collection.insert_one(patient_dict)
-        created_patient = await self.collection.find_one({"_id": result.inserted_id})
+        try:
+            result = await self.collection.insert_one(patient_dict)
+        except DuplicateKeyError:
+            raise ValueError("A patient with this email already exists.")
+        patient_dict["_id"] = result.inserted_id
+        await bump_versions(self.db, PATIENTS)
         
-        return PatientInDB(**created_patient)
+        return PatientInDB(**patient_dict)
 
     async def get_patient(self, patient_id: str) -> Optional[PatientInDB]:
         if not ObjectId.is_valid(patient_id):
             return None
             
         patient = await self.collection.find_one({"_id": ObjectId(patient_id)})
-        return PatientInDB(**patient) if patient else None
+        return PatientInDB.model_construct(**patient) if patient else None
 
     async def get_patients(
         self, 
         skip: int = 0, 
         limit: int = 10,
-        search: Optional[str] = None
-    ) -> List[PatientInDB]:
-        query = {}
-        if search:
-            query = {
-                "$or": [
-                    {"name": {"$regex": search, "$options": "i"}},
-                    {"email": {"$regex": search, "$options": "i"}}
-                ]
-            }
-            
-        cursor = self.collection.find(query).skip(skip).limit(limit)
+        search: Optional[str] = None,
+        search_mode: str = "prefix",
+        projection: Optional[Dict[str, int]] = None
+    ) -> List[Union[PatientInDB, Dict]]:
+        """List patients; with a search term results are ranked by relevance.
+
+        With a projection the raw projected documents are returned instead of models.
+
+        search_mode "prefix" matches the start of the name, of any name word or
+        of the email through the search_keys index; "text" uses the text index
+        for word search. Raises pymongo ExecutionTimeout when the search exceeds
+        SEARCH_MAX_TIME_MS.
+        """
+        if not search:
+            cursor = self.collection.find({}, projection).skip(skip).limit(limit)
+        elif search_mode == "text":
+            cursor = self.collection.find(
+                {"$text": {"$search": search}},
+                {**(projection or {}), "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"}), ("name", 1)]).skip(skip).limit(limit)
+            cursor = cursor.max_time_ms(settings.SEARCH_MAX_TIME_MS)
+        else:
+            key = normalize_search_text(search)
+            pattern = prefix_pattern(search)
+            cursor = self.collection.aggregate([
+                {"$match": {"search_keys": {"$regex": pattern}}},
+                {"$addFields": {"_relevance": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$search_name", key]}, "then": 3},
+                        {"case": {"$regexMatch": {"input": "$search_name", "regex": pattern}}, "then": 2}
+                    ],
+                    "default": 1
+                }}}},
+                {"$sort": {"_relevance": -1, "name": 1, "_id": 1}},
+                {"$skip": skip},
+                {"$limit": limit},
+                *([{"$project": projection}] if projection else [])
+            ], maxTimeMS=settings.SEARCH_MAX_TIME_MS)
+
         patients = await cursor.to_list(length=limit)
-        return [PatientInDB(**patient) for patient in patients]
+        if projection:
+            for patient in patients:
+                patient.pop("score", None)
+            return patients
+        return [PatientInDB.model_construct(**patient) for patient in patients]
+
+    async def get_patients_page(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        search: Optional[str] = None,
+        projection: Optional[Dict[str, int]] = None
+    ) -> Page:
+        """Keyset pagination ordered by (name, _id); raises ValueError for an invalid cursor.
+
+        With a projection the page items are the raw projected documents.
+        """
+        query = {"search_keys": {"$regex": prefix_pattern(search)}} if search else {}
+        if cursor:
+            after = keyset_filter("name", cursor)
+            query = {"$and": [query, after]} if query else after
+
+        fetch = with_fields(projection, ["name", "_id"]) if projection else None
+        find = self.collection.find(query, fetch).sort(keyset_sort("name")).limit(limit + 1)
+        if search:
+            find = find.max_time_ms(settings.SEARCH_MAX_TIME_MS)
+        docs = await find.to_list(length=limit + 1)
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["name"], docs[-1]["_id"])
+        if projection:
+            items = [apply_projection(doc, projection) for doc in docs]
+            return Page[Dict].model_construct(items=items, next_cursor=next_cursor)
+        return Page[PatientInDB].model_construct(items=[PatientInDB.model_construct(**doc) for doc in docs], next_cursor=next_cursor)
+
+    async def bulk_upsert_patients(
+        self,
+        records: AsyncIterable[Any],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        progress: Optional[Callable[[Dict], None]] = None
+    ) -> Dict:
+        """Validate a stream of raw patient records and upsert them by normalized email, in chunks.
+
+        Each chunk costs one $in read of the emails already stored (to tell
+        creates from updates) and one unordered bulk_write of upserts; the
+        next chunk is validated while the previous one is written. A repeated
+        email within a chunk keeps its last row and the earlier ones count as
+        updates, as in a row-by-row import, so re-running an import updates
+        instead of duplicating. Returns created/updated/failed counts, the
+        failed rows with their errors and the ids of existing patients whose
+        gender, date of birth or diseases changed (their results need
+        reclassifying). Only the fields present in a row are written to an
+        existing patient; model defaults apply to new ones. A malformed or
+        truncated stream does not raise: the rows read before the error are
+        imported and the report gets a `stream_error`.
+        """
+        report = {"created": 0, "updated": 0, "failed": 0, "failures": [], "profile_changed": []}
+        chunk = []
+        index = 0
+        writing = None
+        try:
+            async for record in records:
+                chunk.append((index, record))
+                index += 1
+                if len(chunk) >= chunk_size:
+                    rows = self._validate_rows(chunk, report)
+                    if writing:
+                        await writing
+                        if progress:
+                            progress(report)
+                    writing = asyncio.ensure_future(self._upsert_rows(rows, report))
+                    chunk = []
+        except ValueError as e:
+            # Como no bulk de exames: o que já foi lido é gravado e o relatório aponta onde o arquivo quebrou
+            report["stream_error"] = f"{e} (after {index} records)"
+        if chunk:
+            rows = self._validate_rows(chunk, report)
+            if writing:
+                await writing
+            writing = asyncio.ensure_future(self._upsert_rows(rows, report))
+        if writing:
+            await writing
+        report["failures"].sort(key=lambda failure: failure["index"])
+        return report
+
+    @staticmethod
+    def _validate_rows(chunk: List[Tuple[int, Any]], report: Dict) -> Dict[str, Tuple[int, PatientCreate, List[int]]]:
+        """Valid rows by normalized email, as (index, patient, indexes of earlier rows with the same email)"""
+        rows = {}
+        for index, record in chunk:
+            errors = None
+            if isinstance(record, MalformedRecord):
+                errors = [record.error]
+            else:
+                try:
+                    patient = PatientCreate.model_validate(record)
+                except ValidationError as e:
+                    errors = [f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()]
+            if errors:
+                report["failed"] += 1
+                report["failures"].append({"index": index, "errors": errors})
+                continue
+            email = normalize_email(patient.email)
+            earlier = rows.pop(email, None)
+            superseded = earlier[2] + [earlier[0]] if earlier else []
+            rows[email] = (index, patient, superseded)
+        return rows
+
+    async def _upsert_rows(self, rows: Dict[str, Tuple[int, PatientCreate, List[int]]], report: Dict) -> None:
+        if not rows:
+            return
+        existing = {
+            doc["email"]: doc
+            async for doc in self.collection.find({"email": {"$in": list(rows)}}, {"email": 1, **{f: 1 for f in PROFILE_FIELDS}})
+        }
+        now = datetime.utcnow()
+        operations = []
+        for email, (_, patient, _) in rows.items():
+            # Só as colunas presentes na linha: uma coluna ausente não apaga o valor já gravado
+            fields = patient.dict(exclude_unset=True)
+            fields["email"] = email
+            fields["search_name"] = normalize_search_text(patient.name)
+            fields["search_keys"] = build_search_keys(patient.name, email)
+            fields["updated_at"] = now
+            defaults = {key: value for key, value in patient.dict().items() if key not in fields}
+            operations.append(UpdateOne(
+                {"email": email}, {"$set": fields, "$setOnInsert": {**defaults, "created_at": now}}, upsert=True
+            ))
+
+        write_errors = {}
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                write_errors[error["index"]] = error.get("errmsg", "Write error")
+
+        updated_ids = []
+        for position, (email, (index, patient, superseded)) in enumerate(rows.items()):
+            if position in write_errors:
+                report["failed"] += 1 + len(superseded)
+                report["failures"].extend({"index": i, "errors": [write_errors[position]]} for i in superseded + [index])
+                continue
+            report["updated"] += len(superseded)
+            current = existing.get(email)
+            if current is None:
+                report["created"] += 1
+                continue
+            report["updated"] += 1
+            patient_id = str(current["_id"])
+            updated_ids.append(patient_id)
+            if any(
+                field in patient.model_fields_set and _as_stored(current.get(field)) != _as_stored(getattr(patient, field))
+                for field in PROFILE_FIELDS
+            ):
+                report["profile_changed"].append(patient_id)
+        await bump_versions(self.db, PATIENTS, *(PATIENT.format(patient_id=p) for p in updated_ids))
+
+    async def backfill_search_keys(self, batch_size: int = 1000) -> int:
+        """Compute search_name/search_keys for patients stored before search keys existed"""
+        updated = 0
+        batch = []
+        cursor = self.collection.find({"search_keys": {"$exists": False}}, {"name": 1, "email": 1})
+        async for doc in cursor:
+            batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "search_name": normalize_search_text(doc.get("name") or ""),
+                "search_keys": build_search_keys(doc.get("name"), doc.get("email"))
+            }}))
+            if len(batch) >= batch_size:
+                updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+        return updated
+
+    async def normalize_stored_emails(self) -> Dict:
+        """Trim and lowercase the emails stored before emails were normalized on write.
+
+        Imports upsert by normalized email, so a legacy mixed-case email would
+        not be matched and the (case-sensitive) unique index would let the
+        import create a duplicate patient. A patient whose normalized email
+        already belongs to another patient is left as is and reported in
+        `collisions`, to be merged by hand. Returns the number normalized too.
+        """
+        normalized = 0
+        collisions = []
+        patient_ids = []
+        now = datetime.utcnow()
+        # Lista antes de atualizar: cada update muda o e-mail que o cursor percorre
+        legacy = await self.collection.find(
+            {"email": {"$regex": r"[A-Z]|^\s|\s$"}}, {"name": 1, "email": 1}
+        ).to_list(length=None)
+        for doc in legacy:
+            email = normalize_email(doc["email"])
+            try:
+                result = await self.collection.update_one(
+                    {"_id": doc["_id"], "email": doc["email"]},
+                    {"$set": {"email": email, "search_keys": build_search_keys(doc.get("name"), email), "updated_at": now}}
+                )
+            except DuplicateKeyError:
+                other = await self.collection.find_one({"email": email}, {"_id": 1})
+                collisions.append({
+                    "patient_id": str(doc["_id"]),
+                    "email": doc["email"],
+                    "conflicts_with": str(other["_id"]) if other else None,
+                })
+                continue
+            if result.modified_count:
+                normalized += 1
+                patient_ids.append(str(doc["_id"]))
+        if patient_ids:
+            await bump_versions(self.db, PATIENTS, *(PATIENT.format(patient_id=p) for p in patient_ids))
+        return {"normalized": normalized, "collisions": collisions}
 
     async def update_patient(
         self, 
         patient_id: str, 
         patient_update: PatientUpdate
     ) -> Optional[PatientInDB]:
+        """Apply a partial update and return the document as stored after it, in one round trip.
+
+        A fresh read is only needed when name or email change, because the
+        search keys are derived from both and only one may be in the update.
+        """
         if not ObjectId.is_valid(patient_id):
             return None
 
         update_data = patient_update.dict(exclude_unset=True)
         update_data["updated_at"] = datetime.utcnow()
+        if update_data.get("email"):
+            update_data["email"] = normalize_email(update_data["email"])
+        if "name" in update_data or "email" in update_data:
+            # As chaves de busca dependem de nome e e-mail; busca o valor que não mudou
+            current = await self.collection.find_one({"_id": ObjectId(patient_id)}, {"name": 1, "email": 1}) or {}
+            name = update_data.get("name", current.get("name"))
+            email = update_data.get("email", current.get("email"))
+            update_data["search_name"] = normalize_search_text(name or "")
+            update_data["search_keys"] = build_search_keys(name, email)
+
+        try:
+            updated_patient = await self.collection.find_one_and_update(
+                {"_id": ObjectId(patient_id)},
+                {"$set": update_data},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            raise ValueError("A patient with this email already exists.")
 
-        result = await self.collection.update_one(
-            {"_id": ObjectId(patient_id)},
-            {"$set": update_data}
-        )
+        if not updated_patient:
+            return None
+        await bump_versions(self.db, PATIENTS, PATIENT.format(patient_id=patient_id))
+        return PatientInDB(**updated_patient)
 
-        if result.modified_count:
-            updated_patient = await self.collection.find_one({"_id": ObjectId(patient_id)})
-            return PatientInDB(**updated_patient)
-        return None
+    async def delete_patient(self, patient_id: str) -> Optional[Dict]:
+        """Delete a patient and record the cascade of its blood tests; returns the deletion tombstone or None.
 
-    async def delete_patient(self, patient_id: str) -> bool:
-        if not ObjectId.is_valid(patient_id):
-            return False
-            
-        result = await self.collection.delete_one({"_id": ObjectId(patient_id)})
-        return result.deleted_count > 0 
\ No newline at end of file
+        The blood tests are removed afterwards by DeletionService.process (jobs.process_deletions).
+        """
+        return await DeletionService(self.db).delete(PATIENT_KIND, patient_id) 
\ No newline at end of file
@@ -0,0 +1,98 @@
+from copy import deepcopy
+from typing import Dict, Iterable, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from ..core.cache import MISSING, TieredCache
+from ..db.change_feed import RESET, ChangeEvent, change_feed
+from ..db.versions import bump_versions, get_versions
+
+ALL_KEY = "__all__"
+VERSION_KEY = "__version__"
+
+exam_type_cache = TieredCache("exam_types")
+doctor_cache = TieredCache("doctors")
+
+class ReferenceDataService:
+    """Read-through cache over a small, read-mostly collection (exam types, doctors).
+
+    The full collection is cached under one key and each document under its
+    id, together with the collection's change counter used as HTTP validator.
+    Write handlers must call invalidate() after changing a document; writes
+    made elsewhere reach the cache through the change feed (db/change_feed.py).
+    The local tier holds the objects themselves, so callers get copies they
+    are free to modify.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, collection_name: str, cache: TieredCache):
+        self.collection = db[collection_name]
+        self.cache = cache
+
+    async def list_all(self) -> List[Dict]:
+        items = await self.cache.get(ALL_KEY)
+        if items is MISSING:
+            items = await self.collection.find().to_list(length=None)
+            await self.cache.set(ALL_KEY, items)
+        return deepcopy(items)
+
+    async def version(self) -> Dict:
+        """Change counter of the collection ({"version", "updated_at"}), cached like the data"""
+        state = await self.cache.get(VERSION_KEY)
+        if state is MISSING:
+            state = (await get_versions(self.collection.database, self.collection.name))[self.collection.name]
+            await self.cache.set(VERSION_KEY, state)
+        return dict(state)
+
+    async def get(self, item_id: str) -> Optional[Dict]:
+        if not ObjectId.is_valid(item_id):
+            return None
+        item = await self.cache.get(item_id)
+        if item is MISSING:
+            item = await self.collection.find_one({"_id": ObjectId(item_id)})
+            if item is None:
+                return None
+            await self.cache.set(item_id, item)
+        return deepcopy(item)
+
+    async def existing_ids(self, ids: Iterable[str]) -> set:
+        """Return which of the ids exist; only ids absent from the cached list hit the database"""
+        ids = set(ids)
+        if not ids:
+            return set()
+        known = {str(item["_id"]) for item in await self.list_all()}
+        found = ids & known
+        unknown = [ObjectId(i) for i in ids - known if ObjectId.is_valid(i)]
+        if unknown:
+            # Pode ter sido criado por outra réplica depois que a lista foi carregada
+            cursor = self.collection.find({"_id": {"$in": unknown}}, {"_id": 1})
+            fresh = {str(doc["_id"]) async for doc in cursor}
+            if fresh:
+                await self.cache.delete(ALL_KEY, VERSION_KEY)
+            found |= fresh
+        return found
+
+    async def invalidate(self, item_id: Optional[str] = None) -> None:
+        await bump_versions(self.collection.database, self.collection.name)
+        keys = [ALL_KEY, VERSION_KEY] + ([item_id] if item_id else [])
+        await self.cache.delete(*keys)
+
+def exam_type_reference(db: AsyncIOMotorDatabase) -> ReferenceDataService:
+    return ReferenceDataService(db, "exam_types", exam_type_cache)
+
+def doctor_reference(db: AsyncIOMotorDatabase) -> ReferenceDataService:
+    return ReferenceDataService(db, "doctors", doctor_cache)
+
+def _invalidation_hook(cache: TieredCache):
+    # Escritas de outras réplicas (ou fora da API) chegam pelo change stream e limpam o cache local
+    async def invalidate_on_change(event: ChangeEvent) -> None:
+        if event.operation == RESET:
+            cache.local.clear()
+            return
+        keys = [ALL_KEY, VERSION_KEY] + ([str(event.document_id)] if event.document_id else [])
+        await cache.delete(*keys)
+    return invalidate_on_change
+
+change_feed.add_hook(["exam_types"], _invalidation_hook(exam_type_cache))
+change_feed.add_hook(["doctors"], _invalidation_hook(doctor_cache))
+
+def cache_stats() -> Dict:
+    return {"exam_types": exam_type_cache.stats(), "doctors": doctor_cache.stats()}
@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+CHILD_MAX_AGE = 18
+
+FLAG_LOW = "low"
+FLAG_NORMAL = "normal"
+FLAG_HIGH = "high"
+FLAG_CRITICAL = "critical"
+ABNORMAL_FLAGS = [FLAG_LOW, FLAG_HIGH, FLAG_CRITICAL]
+
+GENDER_KEYS = {
+    "male": "male", "m": "male", "masculino": "male",
+    "female": "female", "f": "female", "feminino": "female",
+}
+
+# Faixas etárias usadas nas análises de coorte: (idade mínima, idade máxima ou None, rótulo)
+AGE_BANDS = [
+    (0, 17, "0-17"), (18, 29, "18-29"), (30, 39, "30-39"), (40, 49, "40-49"),
+    (50, 59, "50-59"), (60, 69, "60-69"), (70, 79, "70-79"), (80, None, "80+"),
+]
+AGE_BAND_LABELS = [label for _, _, label in AGE_BANDS]
+
+def normalize_gender(gender: Optional[str]) -> Optional[str]:
+    return GENDER_KEYS.get((gender or "").strip().lower())
+
+def age_band(age: Optional[int]) -> Optional[str]:
+    if age is None:
+        return None
+    for low, high, label in AGE_BANDS:
+        if age >= low and (high is None or age <= high):
+            return label
+    return None
+
+def age_on(date_of_birth: Optional[datetime], when: Optional[datetime] = None) -> Optional[int]:
+    if not date_of_birth:
+        return None
+    when = when or datetime.utcnow()
+    return when.year - date_of_birth.year - ((when.month, when.day) < (date_of_birth.month, date_of_birth.day))
+
+def reference_range_key(patient: Optional[Dict], reference_values: Dict, when: Optional[datetime] = None) -> Optional[str]:
+    """Choose which ExamType.reference_values entry ('male', 'female', 'child') applies to a patient"""
+    if not patient or not reference_values:
+        return None
+    age = age_on(patient.get("date_of_birth"), when)
+    if age is not None and age < CHILD_MAX_AGE and "child" in reference_values:
+        return "child"
+    gender = normalize_gender(patient.get("gender"))
+    return gender if gender in reference_values else None
+
+def classify_value(value: float, reference_range: Dict) -> str:
+    """low/normal/high against [min, max]; critical beyond the optional critical_min/critical_max"""
+    critical_min = reference_range.get("critical_min")
+    critical_max = reference_range.get("critical_max")
+    if (critical_min is not None and value < critical_min) or (critical_max is not None and value > critical_max):
+        return FLAG_CRITICAL
+    if value < reference_range["min"]:
+        return FLAG_LOW
+    if value > reference_range["max"]:
+        return FLAG_HIGH
+    return FLAG_NORMAL
+
+def classify_results(
+    results: List[Dict],
+    patient: Optional[Dict],
+    reference_values_by_exam_type: Dict[str, Dict],
+    when: Optional[datetime] = None
+) -> List[Dict]:
+    """Set each result's flag against the range that applies to the patient on `when` (None when no range applies)"""
+    for result in results:
+        reference_values = reference_values_by_exam_type.get(result["exam_type_id"]) or {}
+        key = reference_range_key(patient, reference_values, when)
+        result["flag"] = classify_value(result["value"], reference_values[key]) if key else None
+    return results
@@ -0,0 +1,246 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from .blood_test_layout import RESULT_PROJECTION, decode
+from .reference_ranges import age_band, age_on, normalize_gender
+
+BUCKET_UNITS = {"day": "day", "month": "month"}
+PATIENT_PROFILE = {"gender": 1, "date_of_birth": 1, "diseases": 1}
+# Points older than the backfill start minus this margin were not rewritten by it (clock skew between writers)
+BACKFILL_CLOCK_MARGIN = timedelta(minutes=5)
+
+def month_of(when: datetime) -> datetime:
+    return datetime(when.year, when.month, 1)
+
+class TimeSeriesService:
+    """Derived per-patient, per-analyte series kept in the blood_test_points collection.
+
+    Each point is (patient_id, exam_type_id, test_date, value, flag) plus the
+    id of the blood test it came from, so it can be rebuilt when that test
+    changes. The patient's gender, age at the test, age band and diseases are
+    copied onto each point so cohort analytics never need a $lookup.
+    The (patient_id, exam_type_id, test_date) index turns a series read into a
+    single index range scan.
+
+    Every write marks the (exam_type_id, month) pairs it touched in
+    cohort_rollup_dirty, so the cohort rollups can be refreshed incrementally.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db.blood_test_points
+        self.dirty = db.cohort_rollup_dirty
+
+    @staticmethod
+    def points_for(blood_test: Dict, patient: Optional[Dict] = None) -> List[Dict]:
+        patient = patient or {}
+        age = age_on(patient.get("date_of_birth"), blood_test["test_date"])
+        return [
+            {
+                "patient_id": blood_test["patient_id"],
+                "exam_type_id": result["exam_type_id"],
+                "test_date": blood_test["test_date"],
+                "value": result["value"],
+                "flag": result.get("flag"),
+                "gender": normalize_gender(patient.get("gender")),
+                "age": age,
+                "age_band": age_band(age),
+                "diseases": patient.get("diseases") or [],
+                "blood_test_id": blood_test["_id"],
+            }
+            for result in blood_test.get("results") or []
+        ]
+
+    async def _patient_profiles(self, patient_ids: Iterable[str]) -> Dict[str, Dict]:
+        object_ids = [ObjectId(i) for i in set(patient_ids) if ObjectId.is_valid(i)]
+        if not object_ids:
+            return {}
+        cursor = self.db.patients.find({"_id": {"$in": object_ids}}, PATIENT_PROFILE)
+        return {str(doc["_id"]): doc async for doc in cursor}
+
+    async def mark_dirty(self, points: Iterable[Dict], session=None) -> None:
+        """Record the (exam_type_id, month) rollup groups changed by these points"""
+        keys = {(point["exam_type_id"], month_of(point["test_date"])) for point in points}
+        if not keys:
+            return
+        now = datetime.utcnow()
+        await self.dirty.bulk_write([
+            UpdateOne(
+                {"_id": {"exam_type_id": exam_type_id, "month": month}},
+                {"$set": {"marked_at": now}},
+                upsert=True
+            )
+            for exam_type_id, month in keys
+        ], ordered=False, session=session)
+
+    async def add_points(self, blood_tests: Iterable[Dict], profiles: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """Insert the points of the tests and return them (with their _id); patient profiles not given are fetched with one $in query"""
+        blood_tests = list(blood_tests)
+        profiles = dict(profiles or {})
+        profiles.update(await self._patient_profiles({bt["patient_id"] for bt in blood_tests} - profiles.keys()))
+        points = [
+            point
+            for blood_test in blood_tests
+            for point in self.points_for(blood_test, profiles.get(blood_test["patient_id"]))
+        ]
+        if points:
+            await self.collection.insert_many(points, ordered=False)
+            await self.mark_dirty(points)
+        return points
+
+    async def replace_points(self, blood_test: Dict, profiles: Optional[Dict[str, Dict]] = None) -> None:
+        await self.delete_points(blood_test["_id"])
+        await self.add_points([blood_test], profiles)
+
+    async def delete_points(self, blood_test_id: ObjectId) -> None:
+        await self._delete({"blood_test_id": blood_test_id})
+
+    async def delete_points_of(
+        self, blood_test_ids: List[ObjectId], exam_type_id: Optional[str] = None, session=None
+    ) -> None:
+        """Delete the points of several tests (only those of one exam type, if given)"""
+        query = {"blood_test_id": {"$in": blood_test_ids}}
+        if exam_type_id:
+            query["exam_type_id"] = exam_type_id
+        await self._delete(query, session)
+
+    async def _delete(self, query: Dict, session=None) -> None:
+        points = await self.collection.find(
+            query, {"exam_type_id": 1, "test_date": 1}, session=session
+        ).to_list(length=None)
+        if points:
+            await self.collection.delete_many(query, session=session)
+            await self.mark_dirty(points, session)
+
+    async def rebuild_patient(self, patient_id: str) -> None:
+        """Re-derive a patient's points, after the denormalized profile (gender, birth date, diseases) changed"""
+        await self._delete({"patient_id": patient_id})
+        cursor = self.db.blood_tests.find({"patient_id": patient_id}, {"patient_id": 1, "test_date": 1, **RESULT_PROJECTION})
+        await self.add_points([decode(blood_test) for blood_test in await cursor.to_list(length=None)])
+
+    async def backfill(self, batch_size: int = 1000) -> int:
+        """Rebuild the whole series collection from blood_tests; returns the number of tests processed.
+
+        Points are replaced one batch of tests at a time, the new ones inserted
+        before the old ones are deleted, so reads keep seeing every series
+        while it runs (a test of the current batch may briefly count twice)
+        and an interrupted run leaves each test with its old points, its new
+        points or both (run it again to finish). Points
+        left over from tests that no longer exist are deleted at the end: every
+        live test's points were re-inserted, with newer ObjectIds. The changed
+        rollup groups are marked dirty and refreshed incrementally.
+        """
+        started = ObjectId.from_datetime(datetime.utcnow() - BACKFILL_CLOCK_MARGIN)
+        processed = 0
+        batch = []
+        cursor = self.db.blood_tests.find(
+            {}, {"patient_id": 1, "test_date": 1, **RESULT_PROJECTION}
+        ).sort("_id", 1).batch_size(batch_size)
+        async for blood_test in cursor:
+            batch.append(decode(blood_test))
+            if len(batch) >= batch_size:
+                await self._replace_batch(batch)
+                processed += len(batch)
+                batch = []
+        if batch:
+            await self._replace_batch(batch)
+            processed += len(batch)
+        await self._delete({"_id": {"$lt": started}})
+        return processed
+
+    async def _replace_batch(self, blood_tests: List[Dict]) -> None:
+        # Insere antes de apagar: a série nunca fica sem os pontos do lote
+        points = await self.add_points(blood_tests)
+        await self._delete({
+            "blood_test_id": {"$in": [blood_test["_id"] for blood_test in blood_tests]},
+            "_id": {"$nin": [point["_id"] for point in points]},
+        })
+
+    async def get_series(
+        self,
+        patient_id: str,
+        exam_type_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        bucket: Optional[str] = None
+    ) -> List[Dict]:
+        """Return the points in date order, or per-bucket aggregates when bucket is "day" or "month" """
+        query = {"patient_id": patient_id, "exam_type_id": exam_type_id}
+        if start or end:
+            query["test_date"] = {}
+            if start:
+                query["test_date"]["$gte"] = start
+            if end:
+                query["test_date"]["$lte"] = end
+
+        if not bucket:
+            cursor = self.collection.find(
+                query, {"_id": 0, "test_date": 1, "value": 1}
+            ).sort("test_date", 1)
+            return [{"date": p["test_date"], "value": p["value"]} async for p in cursor]
+
+        pipeline = [
+            {"$match": query},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$test_date", "unit": BUCKET_UNITS[bucket]}},
+                "count": {"$sum": 1},
+                "avg": {"$avg": "$value"},
+                "min": {"$min": "$value"},
+                "max": {"$max": "$value"}
+            }},
+            {"$sort": {"_id": 1}}
+        ]
+        cursor = self.collection.aggregate(pipeline)
+        return [
+            {"date": b["_id"], "count": b["count"], "avg": b["avg"], "min": b["min"], "max": b["max"]}
+            async for b in cursor
+        ]
+
+    async def get_recent_trends(self, patient_id: str, points_per_analyte: int = 20) -> Dict[str, List[Dict]]:
+        """Latest points of every analyte of a patient, in date order, keyed by exam_type_id"""
+        pipeline = [
+            {"$match": {"patient_id": patient_id}},
+            {"$sort": {"test_date": -1}},
+            {"$group": {
+                "_id": "$exam_type_id",
+                "points": {"$firstN": {"input": {"date": "$test_date", "value": "$value"}, "n": points_per_analyte}}
+            }},
+            {"$project": {"points": {"$reverseArray": "$points"}}}
+        ]
+        cursor = self.collection.aggregate(pipeline)
+        return {doc["_id"]: doc["points"] async for doc in cursor}
+
+    async def find_abnormal(
+        self,
+        exam_type_id: str,
+        flags: List[str],
+        start: datetime,
+        end: Optional[datetime] = None,
+        limit: int = 100
+    ) -> List[Dict]:
+        """Patients with results of one exam type flagged in `flags` within the window, most recent first.
+
+        Served by the (exam_type_id, flag, test_date) index; only matching points are read.
+        """
+        match = {"exam_type_id": exam_type_id, "flag": {"$in": flags}, "test_date": {"$gte": start}}
+        if end:
+            match["test_date"]["$lte"] = end
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"test_date": -1}},
+            {"$group": {
+                "_id": "$patient_id",
+                "count": {"$sum": 1},
+                "flags": {"$addToSet": "$flag"},
+                "last_date": {"$first": "$test_date"},
+                "last_value": {"$first": "$value"},
+                "last_flag": {"$first": "$flag"},
+                "last_blood_test_id": {"$first": "$blood_test_id"}
+            }},
+            {"$sort": {"last_date": -1}},
+            {"$limit": limit}
+        ]
+        cursor = self.collection.aggregate(pipeline)
+        return [{"patient_id": doc.pop("_id"), **doc} async for doc in cursor]
@@ -0,0 +1,61 @@
+"""Celery application for background jobs.
+
+Start a worker per queue so each queue gets its own concurrency limit, e.g.:
+
+    celery -A app.worker worker -Q imports,exports -c 4
+    celery -A app.worker worker -Q maintenance -c 1
+
+`celery -A app.worker beat` schedules the periodic jobs (cohort rollup refresh,
+sweep of unfinished cascade deletes, cleanup of expired job files).
+
+With CELERY_TASK_ALWAYS_EAGER=true jobs run inline and no broker is needed.
+"""
+from celery import Celery
+from .core.config import settings
+
+# Job results (and the export files they point to) are kept for a day
+RESULT_EXPIRES_SECONDS = 60 * 60 * 24
+
+celery_app = Celery(
+    "people_health_tracker",
+    broker=settings.CELERY_BROKER_URL,
+    backend="cache+memory://" if settings.CELERY_TASK_ALWAYS_EAGER else settings.CELERY_RESULT_BACKEND,
+    include=["app.jobs"],
+)
+
+celery_app.conf.update(
+    task_default_queue="maintenance",
+    task_routes={
+        "jobs.import_*": {"queue": "imports"},
+        "jobs.export_*": {"queue": "exports"},
+        "jobs.*": {"queue": "maintenance"},
+    },
+    task_track_started=True,
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    result_extended=True,
+    result_expires=RESULT_EXPIRES_SECONDS,
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+    task_store_eager_result=True,
+    beat_schedule={
+        "refresh-cohort-rollups": {
+            "task": "jobs.refresh_cohort_rollups",
+            "schedule": settings.COHORT_ROLLUP_REFRESH_SECONDS,
+        },
+        "process-deletions": {
+            "task": "jobs.process_deletions",
+            "schedule": settings.DELETION_SWEEP_SECONDS,
+        },
+        "recompute-stale-flags": {
+            "task": "jobs.recompute_stale_flags",
+            "schedule": settings.FLAG_RECOMPUTE_SWEEP_SECONDS,
+        },
+        "cleanup-job-files": {
+            "task": "jobs.cleanup_job_files",
+            "schedule": settings.JOB_FILES_SWEEP_SECONDS,
+        },
+    },
+)
+
+# `celery -A app.worker` procura um atributo chamado `celery` ou `app`
+celery = celery_app
@@ -0,0 +1,122 @@
+"""Shared helpers for the benchmark suites: database selection, latency summaries and JSON results.
+
+Every suite accepts --mongo-url (default: MONGODB_URL) or --in-memory, which
+starts a throwaway mongod through pymongo_inmemory (see requirements.txt in
+this directory), and --db-name (default: health_tracker_bench, so a real
+database is never touched by accident).
+"""
+import argparse
+import json
+import math
+import platform
+import statistics
+import subprocess
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.core.config import settings
+from app.db.mongodb import close_mongo_connection, connect_to_mongo
+
+DEFAULT_DB_NAME = "health_tracker_bench"
+
+
+def add_database_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--mongo-url", default=settings.MONGODB_URL, help="MongoDB to run against (default: MONGODB_URL)")
+    group.add_argument("--in-memory", action="store_true", help="Start a temporary mongod with pymongo_inmemory")
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME, help=f"Database name (default: {DEFAULT_DB_NAME})")
+
+
+@contextmanager
+def _mongo_url(args: argparse.Namespace) -> Iterator[str]:
+    if not args.in_memory:
+        yield args.mongo_url
+        return
+    try:
+        from pymongo_inmemory import Mongod
+    except ImportError:
+        raise SystemExit("--in-memory needs pymongo_inmemory: pip install -r benchmarks/requirements.txt")
+    with Mongod() as mongod:
+        yield mongod.connection_string
+
+
+@asynccontextmanager
+async def open_database(args: argparse.Namespace) -> AsyncIterator[AsyncIOMotorDatabase]:
+    """Point the app settings at the benchmark database and open the shared client.
+
+    The API (in-process load tests) and the services then use the same pool
+    configuration as in production.
+    """
+    with _mongo_url(args) as url:
+        settings.MONGODB_URL = url
+        settings.MONGODB_DB_NAME = args.db_name
+        client = await connect_to_mongo()
+        try:
+            yield client[args.db_name]
+        finally:
+            await close_mongo_connection()
+
+
+def latency_summary(samples: List[float], elapsed: Optional[float] = None, errors: int = 0) -> Dict:
+    """Percentiles (nearest rank) in milliseconds of latencies given in seconds, plus throughput"""
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def percentile(p: float) -> Optional[float]:
+        if not ordered:
+            return None
+        return round(ordered[max(0, math.ceil(p * count) - 1)] * 1000, 3)
+
+    elapsed = elapsed if elapsed is not None else sum(ordered)
+    return {
+        "count": count,
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3) if ordered else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else None,
+        "throughput_per_s": round(count / elapsed, 1) if elapsed else None,
+    }
+
+
+def print_summary(name: str, summary: Dict) -> None:
+    print(f"{name:>28}: p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, "
+          f"{summary['throughput_per_s']} ops/s ({summary['count']} ops, {summary['errors']} errors)")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def save_results(path: Optional[str], suite: str, db: AsyncIOMotorDatabase, params: Dict, results: Dict) -> None:
+    """Write the results with enough context (commit, server, data size) to compare runs later"""
+    if not path:
+        return
+    server = await db.client.server_info()
+    counts = {name: await db[name].estimated_document_count() for name in ("patients", "blood_tests", "blood_test_points")}
+    # Tamanho médio e total dos testes: compara os layouts de armazenamento
+    stats = (await db.blood_tests.aggregate([{"$collStats": {"storageStats": {}}}]).to_list(length=1) or [{}])[0].get("storageStats", {})
+    document = {
+        "suite": suite,
+        "metadata": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongodb": server.get("version"),
+            "documents": counts,
+            "blood_test_storage": {key: stats.get(key) for key in ("avgObjSize", "size", "storageSize", "totalIndexSize")},
+        },
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, default=str)
+    print(f"Results saved to {path}")
@@ -0,0 +1,72 @@
+"""Compare two benchmark result files and flag regressions.
+
+Usage (from patient-blood-tracker/backend):
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.10
+
+A benchmark regresses when its p95 latency grows, or its throughput drops,
+by more than the threshold. Exits with status 1 when any benchmark regressed,
+so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional
+
+
+def _change(baseline: Optional[float], current: Optional[float]) -> Optional[float]:
+    if baseline in (None, 0) or current is None:
+        return None
+    return (current - baseline) / baseline
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[Dict]:
+    rows = []
+    for name, before in baseline["results"].items():
+        after = current["results"].get(name)
+        if after is None:
+            continue
+        p95_change = _change(before.get("p95_ms"), after.get("p95_ms"))
+        throughput_change = _change(before.get("throughput_per_s"), after.get("throughput_per_s"))
+        rows.append({
+            "benchmark": name,
+            "p95_ms": (before.get("p95_ms"), after.get("p95_ms")),
+            "p95_change": p95_change,
+            "throughput_change": throughput_change,
+            "regressed": (p95_change or 0) > threshold or (throughput_change or 0) < -threshold,
+        })
+    return rows
+
+
+def _percent(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:+.1%}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative change (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline["suite"] != current["suite"]:
+        print(f"Cannot compare a {baseline['suite']} run with a {current['suite']} run")
+        return 2
+    if baseline["metadata"].get("documents") != current["metadata"].get("documents"):
+        print("Warning: the runs used databases of different sizes")
+
+    rows = compare(baseline, current, args.threshold)
+    for row in rows:
+        before, after = row["p95_ms"]
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        print(f"{row['benchmark']:>28}: p95 {before} -> {after} ms ({_percent(row['p95_change'])}), "
+              f"throughput {_percent(row['throughput_change'])}  {flag}")
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Synthetic data generator: patients, exam types, doctors, blood tests and their time-series points.
+
+Usage (from patient-blood-tracker/backend):
+
+    python -m benchmarks.datagen --patients 100000 --results 10000000
+    python -m benchmarks.datagen --in-memory --patients 2000 --results 100000
+
+It refuses to touch a database that already holds data unless --drop is
+given, which drops the collections it generates.
+
+Results follow a realistic panel mix (CBC and metabolic panels are common,
+thyroid and liver panels rarer), values are drawn around each analyte's
+reference range so a few percent fall outside it, and diabetic patients skew
+glucose/HbA1c upwards. The same --seed produces the same patients, panels
+and values (ids and dates are relative to when the generator runs).
+Documents are written directly (not through the services) with the fields
+the services would store: search keys, result flags and denormalized points.
+Blood tests use BLOOD_TEST_LAYOUT, or --layout, so both storage layouts can
+be benchmarked on the same data.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.core.text import build_search_keys, normalize_search_text
+from app.db.indexes import ensure_indexes
+from app.services.blood_test_layout import LAYOUTS, encode
+from app.services.cohort_service import CohortService
+from app.services.reference_ranges import classify_results, reference_range_key
+from app.services.time_series_service import TimeSeriesService
+
+from .common import add_database_arguments, open_database
+
+# name: (unidade, faixa masculina, faixa feminina, faixa infantil, limites críticos)
+ANALYTES = {
+    "Hemoglobin": ("g/dL", (13.5, 17.5), (12.0, 15.5), (11.0, 14.5), (7.0, 20.0)),
+    "Hematocrit": ("%", (41.0, 53.0), (36.0, 46.0), (33.0, 43.0), (20.0, 60.0)),
+    "White Blood Cells": ("10^3/uL", (4.5, 11.0), (4.5, 11.0), (5.0, 14.5), (2.0, 30.0)),
+    "Platelets": ("10^3/uL", (150.0, 400.0), (150.0, 400.0), (150.0, 450.0), (50.0, 1000.0)),
+    "Glucose": ("mg/dL", (70.0, 99.0), (70.0, 99.0), (60.0, 100.0), (40.0, 400.0)),
+    "Sodium": ("mmol/L", (135.0, 145.0), (135.0, 145.0), (135.0, 145.0), (120.0, 160.0)),
+    "Potassium": ("mmol/L", (3.5, 5.1), (3.5, 5.1), (3.4, 4.7), (2.5, 6.5)),
+    "Creatinine": ("mg/dL", (0.7, 1.3), (0.6, 1.1), (0.3, 0.7), (None, 10.0)),
+    "Urea": ("mg/dL", (15.0, 45.0), (15.0, 45.0), (10.0, 40.0), (None, 200.0)),
+    "Total Cholesterol": ("mg/dL", (120.0, 200.0), (120.0, 200.0), (100.0, 170.0), (None, None)),
+    "HDL Cholesterol": ("mg/dL", (40.0, 80.0), (50.0, 90.0), (45.0, 80.0), (None, None)),
+    "LDL Cholesterol": ("mg/dL", (50.0, 130.0), (50.0, 130.0), (50.0, 110.0), (None, None)),
+    "Triglycerides": ("mg/dL", (40.0, 150.0), (40.0, 150.0), (30.0, 90.0), (None, 1000.0)),
+    "TSH": ("mIU/L", (0.4, 4.0), (0.4, 4.0), (0.7, 5.0), (None, 50.0)),
+    "Free T4": ("ng/dL", (0.8, 1.8), (0.8, 1.8), (0.9, 2.0), (None, None)),
+    "HbA1c": ("%", (4.0, 5.6), (4.0, 5.6), (4.0, 5.6), (None, 14.0)),
+    "ALT": ("U/L", (7.0, 56.0), (7.0, 45.0), (5.0, 45.0), (None, 1000.0)),
+    "AST": ("U/L", (10.0, 40.0), (9.0, 32.0), (10.0, 40.0), (None, 1000.0)),
+}
+
+# (painel, peso, analitos)
+PANELS = [
+    ("CBC", 0.30, ["Hemoglobin", "Hematocrit", "White Blood Cells", "Platelets"]),
+    ("Basic Metabolic", 0.28, ["Glucose", "Sodium", "Potassium", "Creatinine", "Urea"]),
+    ("Lipid", 0.20, ["Total Cholesterol", "HDL Cholesterol", "LDL Cholesterol", "Triglycerides"]),
+    ("Thyroid", 0.10, ["TSH", "Free T4"]),
+    ("Diabetes", 0.07, ["Glucose", "HbA1c"]),
+    ("Liver", 0.05, ["ALT", "AST"]),
+]
+
+DISEASES = [("hypertension", 0.25), ("diabetes", 0.10), ("hypothyroidism", 0.05), ("chronic kidney disease", 0.03)]
+FIRST_NAMES = ["Ana", "Maria", "João", "José", "Pedro", "Paula", "Lucas", "Julia", "Carlos", "Fernanda",
+               "Rafael", "Beatriz", "Gabriel", "Mariana", "Bruno", "Camila", "Diego", "Larissa", "Felipe", "Renata"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Rodrigues", "Almeida", "Nascimento",
+              "Carvalho", "Gomes", "Martins", "Araújo", "Ribeiro", "Barbosa", "Rocha", "Dias", "Teixeira", "Moreira"]
+LABS = ["Lab Central", "Diagnósticos Norte", "BioAnálises", "Laboratório Sul"]
+HISTORY_DAYS = 5 * 365
+# Posição de cada faixa na tupla de ANALYTES
+RANGE_POSITIONS = {"male": 1, "female": 2, "child": 3}
+BATCH_SIZE = 5000
+GENERATED_COLLECTIONS = ("patients", "exam_types", "doctors", "blood_tests", "blood_test_points",
+                         "cohort_rollups", "cohort_rollup_dirty", "collection_versions")
+
+
+def exam_type_documents() -> List[Dict]:
+    now = datetime.utcnow()
+    documents = []
+    for name, (unit, male, female, child, (critical_min, critical_max)) in ANALYTES.items():
+        reference_values = {}
+        for key, (low, high) in (("male", male), ("female", female), ("child", child)):
+            reference_values[key] = {"min": low, "max": high, "critical_min": critical_min, "critical_max": critical_max}
+        documents.append({
+            "_id": ObjectId(), "name": name, "description": f"{name} ({unit})",
+            "reference_values": reference_values, "created_at": now, "updated_at": now,
+        })
+    return documents
+
+
+def patient_documents(rng: random.Random, count: int, start_index: int = 0) -> List[Dict]:
+    now = datetime.utcnow()
+    documents = []
+    for i in range(start_index, start_index + count):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+        email = f"patient{i}@example.com"
+        documents.append({
+            "_id": ObjectId(),
+            "name": name,
+            "email": email,
+            "date_of_birth": now - timedelta(days=rng.randint(2 * 365, 95 * 365)),
+            "gender": rng.choice(["male", "female"]),
+            "phone": f"+55 11 9{rng.randint(10000000, 99999999)}",
+            "address": None,
+            "diseases": [disease for disease, p in DISEASES if rng.random() < p],
+            "notes": None,
+            "search_name": normalize_search_text(name),
+            "search_keys": build_search_keys(name, email),
+            "created_at": now,
+            "updated_at": now,
+        })
+    return documents
+
+
+def draw_value(rng: random.Random, analyte: str, patient: Dict, when: datetime) -> float:
+    """Normal around the middle of the range that applies to the patient on `when`, so roughly 5% fall outside it"""
+    key = reference_range_key(patient, RANGE_POSITIONS, when) or "male"
+    low, high = ANALYTES[analyte][RANGE_POSITIONS[key]]
+    mean, sd = (low + high) / 2, (high - low) / 4
+    if analyte in ("Glucose", "HbA1c") and "diabetes" in patient["diseases"]:
+        mean += 2 * sd
+    return round(max(rng.gauss(mean, sd), 0.01), 2)
+
+
+def blood_test_document(rng: random.Random, patient: Dict, exam_types: Dict[str, str], doctors: List[str]) -> Dict:
+    panels = rng.choices(PANELS, weights=[weight for _, weight, _ in PANELS], k=rng.choice([1, 1, 2]))
+    analytes = list(dict.fromkeys(analyte for _, _, names in panels for analyte in names))
+    now = datetime.utcnow()
+    test_date = now - timedelta(days=rng.randint(0, HISTORY_DAYS), minutes=rng.randint(0, 1439))
+    return {
+        "_id": ObjectId(),
+        "patient_id": str(patient["_id"]),
+        "test_date": test_date,
+        "exam_types": [exam_types[analyte] for analyte in analytes],
+        "results": [
+            {"exam_type_id": exam_types[analyte], "value": draw_value(rng, analyte, patient, test_date)}
+            for analyte in analytes
+        ],
+        "notes": None,
+        "doctor_id": rng.choice(doctors),
+        "lab_name": rng.choice(LABS),
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+async def non_empty_collections(db: AsyncIOMotorDatabase) -> List[str]:
+    names = await db.list_collection_names(filter={"name": {"$not": {"$regex": "^system\\."}}})
+    return sorted([name for name in names if await db[name].estimated_document_count()])
+
+
+async def generate(
+    db: AsyncIOMotorDatabase, patients: int, results: int, seed: int = 42,
+    batch_size: int = BATCH_SIZE, layout: Optional[str] = None, drop: bool = False
+) -> Dict:
+    """Regenerate the benchmark collections (dropping them first only if `drop`); returns counts and timings"""
+    if not drop:
+        existing = await non_empty_collections(db)
+        if existing:
+            raise SystemExit(
+                f"Database {db.name} is not empty ({', '.join(existing)}); "
+                "pass --drop to replace the generated collections"
+            )
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for name in GENERATED_COLLECTIONS:
+        await db.drop_collection(name)
+
+    exam_types = exam_type_documents()
+    await db.exam_types.insert_many(exam_types)
+    exam_type_ids = {doc["name"]: str(doc["_id"]) for doc in exam_types}
+    reference_values = {str(doc["_id"]): doc["reference_values"] for doc in exam_types}
+    doctors = [{"_id": ObjectId(), "name": f"Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "email": f"doctor{i}@example.com", "specialty": "Clinical Pathology"} for i in range(50)]
+    await db.doctors.insert_many(doctors)
+    doctor_ids = [str(doc["_id"]) for doc in doctors]
+
+    patient_list = []
+    for offset in range(0, patients, batch_size):
+        batch = patient_documents(rng, min(batch_size, patients - offset), offset)
+        await db.patients.insert_many(batch, ordered=False)
+        patient_list.extend({"_id": p["_id"], "gender": p["gender"], "date_of_birth": p["date_of_birth"],
+                             "diseases": p["diseases"]} for p in batch)
+    print(f"{patients} patients written ({time.perf_counter() - started:.1f}s)")
+
+    written_tests = written_results = 0
+    pending = None
+    while written_results < results:
+        tests, points = [], []
+        while len(tests) < batch_size and written_results < results:
+            patient = rng.choice(patient_list)
+            test = blood_test_document(rng, patient, exam_type_ids, doctor_ids)
+            classify_results(test["results"], patient, reference_values, test["test_date"])
+            tests.append(test)
+            points.extend(TimeSeriesService.points_for(test, patient))
+            written_results += len(test["results"])
+        if pending:
+            await pending
+        # Gera o próximo lote enquanto este é gravado
+        pending = asyncio.ensure_future(asyncio.gather(
+            db.blood_tests.insert_many([encode(test, layout) for test in tests], ordered=False),
+            db.blood_test_points.insert_many(points, ordered=False),
+        ))
+        written_tests += len(tests)
+        if written_tests % (batch_size * 20) < batch_size:
+            print(f"  {written_tests} tests / {written_results} results ({time.perf_counter() - started:.1f}s)")
+    if pending:
+        await pending
+    print(f"{written_tests} blood tests with {written_results} results written ({time.perf_counter() - started:.1f}s)")
+
+    # Índices depois da carga: construir uma vez sai mais barato que manter durante os inserts
+    await ensure_indexes(db)
+    await CohortService(db).refresh_rollups(full=True)
+    elapsed = time.perf_counter() - started
+    print(f"Indexes and cohort rollups built ({elapsed:.1f}s)")
+    return {
+        "patients": patients,
+        "blood_tests": written_tests,
+        "results": written_results,
+        "average_results_per_test": round(written_results / written_tests, 2) if written_tests else 0,
+        "seconds": round(elapsed, 1),
+    }
+
+
+async def main(args):
+    async with open_database(args) as db:
+        await generate(db, args.patients, args.results, args.seed, args.batch_size, args.layout, args.drop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.datagen", description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--results", type=int, default=10_000_000, help="Total exam results (tests x results per test)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--layout", choices=LAYOUTS, help="Blood test storage layout (default: BLOOD_TEST_LAYOUT)")
+    parser.add_argument("--drop", action="store_true", help="Drop the generated collections of a database that is not empty")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,158 @@
+"""HTTP load profile against the API: concurrent virtual users over a weighted request mix.
+
+Usage (from patient-blood-tracker/backend, after benchmarks.datagen):
+
+    python -m benchmarks.load --users 50 --duration 60 --output load.json
+    python -m benchmarks.load --base-url http://localhost:8000 --users 200
+
+Without --base-url the FastAPI app runs in-process (httpx ASGITransport), so
+the numbers include routing, validation and serialization but no network or
+server worker overhead. --revalidate makes clients send If-None-Match with
+the ETag they last saw, like a polling frontend. Reports p50/p95/p99 per
+request type and the overall throughput.
+
+With --base-url the server must use the same database as --mongo-url and
+--db-name, since request ids are sampled from it.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+from .common import add_database_arguments, latency_summary, open_database, print_summary, save_results
+from .services import sample
+
+API = settings.API_V1_PREFIX
+
+# (nome, peso): o mix imita o uso do frontend, com leitura predominante
+PROFILE = [
+    ("list_patients", 10),
+    ("search_patients", 15),
+    ("get_patient", 10),
+    ("patient_dashboard", 20),
+    ("patient_blood_tests", 15),
+    ("patient_summary", 8),
+    ("test_statistics", 8),
+    ("list_exam_types", 6),
+    ("create_blood_test", 5),
+    ("cohort_trend", 3),
+]
+
+
+def build_request(rng: random.Random, name: str, data: Dict) -> Tuple[str, str, Optional[Dict]]:
+    patient_id = rng.choice(data["patient_ids"])
+    exam_type_id = rng.choice(data["exam_type_ids"])
+    if name == "list_patients":
+        return "GET", f"{API}/patients/?limit=20", None
+    if name == "search_patients":
+        return "GET", f"{API}/patients/?limit=20&search={rng.choice(data['prefixes'])}", None
+    if name == "get_patient":
+        return "GET", f"{API}/patients/{patient_id}", None
+    if name == "patient_dashboard":
+        return "GET", f"{API}/patients/{patient_id}/dashboard", None
+    if name == "patient_blood_tests":
+        return "GET", f"{API}/blood-tests/patient/{patient_id}/cursor?limit=20", None
+    if name == "patient_summary":
+        return "GET", f"{API}/blood-tests/patient/{patient_id}/summary?exam_type_id={exam_type_id}", None
+    if name == "test_statistics":
+        return "GET", f"{API}/blood-tests/patient/{patient_id}/statistics/{exam_type_id}", None
+    if name == "list_exam_types":
+        return "GET", f"{API}/exam-types/", None
+    if name == "cohort_trend":
+        return "GET", f"{API}/cohorts/{exam_type_id}/trend", None
+    exam_type_ids = rng.sample(data["exam_type_ids"], k=min(4, len(data["exam_type_ids"])))
+    return "POST", f"{API}/blood-tests/", {
+        "patient_id": patient_id,
+        "test_date": datetime.utcnow().isoformat(),
+        "exam_types": exam_type_ids,
+        "results": [{"exam_type_id": e, "value": round(rng.uniform(1, 200), 2)} for e in exam_type_ids],
+        "lab_name": "Load Test Lab",
+    }
+
+
+async def virtual_user(
+    client: httpx.AsyncClient, rng: random.Random, data: Dict, deadline: float, revalidate: bool,
+    samples: Dict[str, List[float]], errors: Dict[str, int], created: List[str]
+) -> None:
+    names = [name for name, _ in PROFILE]
+    weights = [weight for _, weight in PROFILE]
+    etags = {}
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights=weights)[0]
+        method, url, body = build_request(rng, name, data)
+        headers = {"If-None-Match": etags[url]} if revalidate and url in etags else {}
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body, headers=headers)
+        except httpx.HTTPError:
+            errors[name] += 1
+            continue
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            errors[name] += 1
+            continue
+        samples[name].append(elapsed)
+        if "etag" in response.headers:
+            etags[url] = response.headers["etag"]
+        if method == "POST":
+            created.append(response.json()["_id"])
+
+
+async def run(client: httpx.AsyncClient, data: Dict, users: int, duration: float, revalidate: bool, seed: int) -> Dict:
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    created = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        virtual_user(client, random.Random(seed + i), data, deadline, revalidate, samples, errors, created)
+        for i in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+
+    results = {name: latency_summary(samples[name], elapsed, errors[name]) for name, _ in PROFILE}
+    results["overall"] = latency_summary(
+        [s for values in samples.values() for s in values], elapsed, sum(errors.values())
+    )
+    for name, summary in results.items():
+        print_summary(name, summary)
+    return {"results": results, "created": created}
+
+
+async def main(args):
+    async with open_database(args) as db:
+        data = await sample(db)
+        if args.base_url:
+            transport, base_url = None, args.base_url
+        else:
+            from app.main import app
+            transport, base_url = httpx.ASGITransport(app=app), "http://benchmark"
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=30) as client:
+            outcome = await run(client, data, args.users, args.duration, args.revalidate, args.seed)
+            for test_id in outcome["created"]:
+                await client.delete(f"{API}/blood-tests/{test_id}")
+        params = {
+            "users": args.users, "duration": args.duration, "revalidate": args.revalidate,
+            "seed": args.seed, "target": args.base_url or "in-process", "profile": dict(PROFILE),
+        }
+        await save_results(args.output, "load", db, params, outcome["results"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument("--base-url", help="Run against a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match with the last ETag seen per URL")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""CPU cost per 100-item page: validated response_model path vs the trusted-read path.
+
+Usage (from patient-blood-tracker/backend): python -m benchmarks.serialization
+"""
+import random
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.core.responses import MongoJSONResponse
+from app.models.blood_test import BloodTestInDB
+from app.models.patient import PatientInDB
+
+PAGE_SIZE = 100
+
+
+def patient_documents(n: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"Patient {i}",
+            "email": f"patient{i}@example.com",
+            "date_of_birth": now - timedelta(days=365 * random.randint(1, 90)),
+            "gender": random.choice(["male", "female"]),
+            "phone": "+55 11 99999-0000",
+            "address": "Rua Exemplo, 123",
+            "diseases": ["hypertension"],
+            "notes": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(n)
+    ]
+
+
+def blood_test_documents(n: int, analytes: int = 20) -> List[dict]:
+    now = datetime.utcnow()
+    exam_types = [str(ObjectId()) for _ in range(analytes)]
+    return [
+        {
+            "_id": ObjectId(),
+            "patient_id": str(ObjectId()),
+            "test_date": now - timedelta(days=i),
+            "exam_types": exam_types,
+            "results": [{"exam_type_id": e, "value": random.uniform(1, 200)} for e in exam_types],
+            "notes": None,
+            "doctor_id": None,
+            "lab_name": "Lab",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(n)
+    ]
+
+
+def validated_path(model, documents: List[dict]) -> bytes:
+    """What the endpoints did before: validate in the service, then again through response_model"""
+    adapter = TypeAdapter(List[model])
+    items = [model(**doc) for doc in documents]
+    revalidated = adapter.validate_python([item.model_dump(by_alias=True) for item in items])
+    return JSONResponse(jsonable_encoder(adapter.dump_python(revalidated, by_alias=True))).body
+
+
+def trusted_path(model, documents: List[dict]) -> bytes:
+    return MongoJSONResponse([model.model_construct(**doc) for doc in documents]).body
+
+
+def measure(label: str, model, documents: List[dict], number: int = 200) -> dict:
+    validated = min(timeit.repeat(lambda: validated_path(model, documents), number=number, repeat=3)) / number
+    trusted = min(timeit.repeat(lambda: trusted_path(model, documents), number=number, repeat=3)) / number
+    result = {
+        "page": label,
+        "validated_ms": round(validated * 1000, 3),
+        "trusted_ms": round(trusted * 1000, 3),
+        "cpu_saved_ms": round((validated - trusted) * 1000, 3),
+        "speedup": round(validated / trusted, 1),
+    }
+    print(f"{label:>20}: validated {result['validated_ms']} ms, trusted {result['trusted_ms']} ms "
+          f"({result['speedup']}x, {result['cpu_saved_ms']} ms saved per page)")
+    return result
+
+
+def run() -> List[dict]:
+    return [
+        measure(f"{PAGE_SIZE} patients", PatientInDB, patient_documents(PAGE_SIZE)),
+        measure(f"{PAGE_SIZE} blood tests", BloodTestInDB, blood_test_documents(PAGE_SIZE)),
+    ]
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,116 @@
+"""Micro-benchmarks of the service methods against a generated database.
+
+Usage (from patient-blood-tracker/backend, after benchmarks.datagen):
+
+    python -m benchmarks.services --iterations 500 --output services.json
+
+Each benchmark runs sequentially on the shared client (so it measures one
+request's latency, not throughput under load) over randomly sampled
+patients, name prefixes and exam types. Blood tests created by the
+create_blood_test benchmark are deleted at the end.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+from app.models.blood_test import BloodTestCreate
+from app.services.blood_test_service import BloodTestService
+from app.services.cohort_service import CohortService
+from app.services.dashboard_service import DashboardService
+from app.services.patient_service import PatientService
+
+from .common import add_database_arguments, latency_summary, open_database, print_summary, save_results
+
+SAMPLE_SIZE = 1000
+
+
+async def sample(db) -> Dict[str, List]:
+    """Random patients, name prefixes and exam types to spread the benchmark over"""
+    patients = await db.patients.aggregate([{"$sample": {"size": SAMPLE_SIZE}}, {"$project": {"name": 1}}]).to_list(length=None)
+    exam_types = [str(doc["_id"]) async for doc in db.exam_types.find({}, {"_id": 1})]
+    if not patients or not exam_types:
+        raise SystemExit("The benchmark database is empty; run python -m benchmarks.datagen first")
+    return {
+        "patient_ids": [str(p["_id"]) for p in patients],
+        "prefixes": [p["name"][:4] for p in patients],
+        "words": [p["name"].split()[-1] for p in patients],
+        "exam_type_ids": exam_types,
+    }
+
+
+async def measure(name: str, operation: Callable[[], Awaitable], iterations: int, warmup: int) -> Dict:
+    for _ in range(warmup):
+        await operation()
+    samples = []
+    errors = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            await operation()
+        except Exception:
+            errors += 1
+            continue
+        samples.append(time.perf_counter() - started)
+    summary = latency_summary(samples, errors=errors)
+    print_summary(name, summary)
+    return summary
+
+
+async def run(db, iterations: int, warmup: int, seed: int) -> Dict[str, Dict]:
+    rng = random.Random(seed)
+    data = await sample(db)
+    patients = PatientService(db)
+    blood_tests = BloodTestService(db)
+    dashboards = DashboardService(db)
+    cohorts = CohortService(db)
+    created = []
+
+    async def create_blood_test():
+        exam_type_ids = rng.sample(data["exam_type_ids"], k=min(4, len(data["exam_type_ids"])))
+        test = await blood_tests.create_blood_test(BloodTestCreate(
+            patient_id=rng.choice(data["patient_ids"]),
+            test_date=datetime.utcnow(),
+            exam_types=exam_type_ids,
+            results=[{"exam_type_id": e, "value": round(rng.uniform(1, 200), 2)} for e in exam_type_ids],
+            lab_name="Benchmark Lab"
+        ))
+        created.append(str(test.id))
+
+    benchmarks = {
+        "create_blood_test": create_blood_test,
+        "get_patients": lambda: patients.get_patients(limit=20),
+        "get_patients_prefix_search": lambda: patients.get_patients(limit=20, search=rng.choice(data["prefixes"])),
+        "get_patients_text_search": lambda: patients.get_patients(limit=20, search=rng.choice(data["words"]), search_mode="text"),
+        "get_patient_summary": lambda: blood_tests.get_patient_summary(rng.choice(data["patient_ids"]), rng.choice(data["exam_type_ids"])),
+        "get_test_statistics": lambda: blood_tests.get_test_statistics(rng.choice(data["patient_ids"]), rng.choice(data["exam_type_ids"])),
+        "get_patient_dashboard": lambda: dashboards.get_patient_dashboard(rng.choice(data["patient_ids"])),
+        "get_cohort_trend": lambda: cohorts.get_trend(rng.choice(data["exam_type_ids"])),
+    }
+    results = {}
+    try:
+        for name, operation in benchmarks.items():
+            results[name] = await measure(name, operation, iterations, warmup)
+    finally:
+        for test_id in created:
+            await blood_tests.delete_blood_test(test_id)
+    return results
+
+
+async def main(args):
+    async with open_database(args) as db:
+        results = await run(db, args.iterations, args.warmup, args.seed)
+        params = {"iterations": args.iterations, "warmup": args.warmup, "seed": args.seed}
+        await save_results(args.output, "services", db, params, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.services", description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+import pytest
+from bson import ObjectId
+
+from app.services.blood_test_layout import (
+    COMPACT, COMPACT_FIELDS, DOCUMENTS, RESULT_FLAGS, RESULT_IDS, RESULT_VALUES,
+    decode, encode, exam_type_filter, resolve_layout, results_update, storage_projection,
+)
+
+HEMOGLOBIN = str(ObjectId())
+GLUCOSE = str(ObjectId())
+
+
+def blood_test(exam_types=None):
+    results = [
+        {"exam_type_id": HEMOGLOBIN, "value": 13.2, "flag": "normal"},
+        {"exam_type_id": GLUCOSE, "value": 130.0, "flag": "high"},
+    ]
+    return {
+        "_id": ObjectId(),
+        "patient_id": str(ObjectId()),
+        "results": results,
+        "exam_types": exam_types if exam_types is not None else [HEMOGLOBIN, GLUCOSE],
+        "lab_name": "Lab Central",
+    }
+
+
+@pytest.mark.parametrize("layout", [DOCUMENTS, COMPACT])
+def test_round_trip(layout):
+    original = blood_test()
+    assert decode(encode(original, layout)) == original
+
+
+def test_documents_layout_stores_results_as_is():
+    original = blood_test()
+    stored = encode(original, DOCUMENTS)
+    assert stored == original
+    assert not any(field in stored for field in COMPACT_FIELDS)
+
+
+def test_compact_layout_stores_parallel_arrays():
+    stored = encode(blood_test(), COMPACT)
+    assert stored[RESULT_IDS] == [ObjectId(HEMOGLOBIN), ObjectId(GLUCOSE)]
+    assert stored[RESULT_VALUES] == [13.2, 130.0]
+    assert stored[RESULT_FLAGS] == ["normal", "high"]
+    # Derivável de result_ids: não é gravado
+    assert "results" not in stored and "exam_types" not in stored
+
+
+def test_compact_layout_keeps_exam_types_that_differ_from_results():
+    original = blood_test(exam_types=[HEMOGLOBIN, GLUCOSE, "pending"])
+    stored = encode(original, COMPACT)
+    assert stored["exam_types"] == [HEMOGLOBIN, GLUCOSE, "pending"]
+    assert decode(stored) == original
+
+
+def test_encode_does_not_modify_the_input():
+    original = blood_test()
+    encode(original, COMPACT)
+    assert "results" in original and RESULT_IDS not in original
+
+
+def test_results_update_unsets_the_other_layout():
+    results = blood_test()["results"]
+    compact = results_update(results, [HEMOGLOBIN, GLUCOSE], COMPACT)
+    assert set(compact["$set"]) == set(COMPACT_FIELDS)
+    assert set(compact["$unset"]) == {"results", "exam_types"}
+    documents = results_update(results, [HEMOGLOBIN, GLUCOSE], DOCUMENTS)
+    assert set(documents["$set"]) == {"results", "exam_types"}
+    assert set(documents["$unset"]) == set(COMPACT_FIELDS)
+
+
+def test_storage_projection_adds_compact_fields():
+    assert storage_projection(None) is None
+    assert storage_projection({"test_date": 1}) == {"test_date": 1}
+    assert storage_projection({"exam_types": 1}) == {"exam_types": 1, RESULT_IDS: 1}
+    assert storage_projection({"results": 1}) == {"results": 1, **{field: 1 for field in COMPACT_FIELDS}}
+
+
+def test_decode_narrows_to_the_projection():
+    stored = encode(blood_test(), COMPACT)
+    fetched = {key: stored[key] for key in ("_id", RESULT_IDS)}
+    assert decode(fetched, {"exam_types": 1}) == {"_id": stored["_id"], "exam_types": [HEMOGLOBIN, GLUCOSE]}
+
+    fetched = {key: stored[key] for key in ("_id", *COMPACT_FIELDS)}
+    decoded = decode(fetched, {"results": 1})
+    assert "exam_types" not in decoded
+    assert [result["exam_type_id"] for result in decoded["results"]] == [HEMOGLOBIN, GLUCOSE]
+
+
+def test_decode_passes_documents_layout_and_missing_documents_through():
+    original = blood_test()
+    assert decode(original) is original
+    assert decode(None) is None
+
+
+def test_decode_without_flags():
+    stored = {RESULT_IDS: [ObjectId(HEMOGLOBIN)], RESULT_VALUES: [1.5]}
+    assert decode(stored)["results"] == [{"exam_type_id": HEMOGLOBIN, "value": 1.5, "flag": None}]
+
+
+def test_exam_type_filter_matches_both_layouts():
+    assert exam_type_filter(GLUCOSE) == {"$or": [{"results.exam_type_id": GLUCOSE}, {RESULT_IDS: ObjectId(GLUCOSE)}]}
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        resolve_layout("packed")
@@ -0,0 +1,40 @@
+from app.db.command_metrics import MAX_SHAPE_LENGTH, command_collection, query_shape
+
+
+def test_find_shape_hides_values():
+    command = {"find": "patients", "filter": {"email": "ana@example.com", "age": {"$gte": 30}}, "sort": {"name": 1}, "limit": 20, "$db": "tracker"}
+    assert query_shape("find", command) == "find patients {filter: {email: ?, age: {$gte: ?}}, sort: {name: ?}}"
+
+
+def test_equal_queries_share_a_shape():
+    first = {"find": "blood_tests", "filter": {"patient_id": "a", "test_date": {"$lt": 1}}}
+    second = {"find": "blood_tests", "filter": {"patient_id": "b", "test_date": {"$lt": 2}}}
+    assert query_shape("find", first) == query_shape("find", second)
+
+
+def test_lists_of_documents_keep_their_structure():
+    command = {"find": "blood_tests", "filter": {"$or": [{"a": 1}, {"b": 2}], "exam_types": {"$in": ["x", "y", "z"]}}}
+    assert query_shape("find", command) == "find blood_tests {filter: {$or: [{a: ?}, {b: ?}], exam_types: {$in: ?}}}"
+
+
+def test_aggregate_shape():
+    command = {"aggregate": "blood_test_points", "pipeline": [{"$match": {"exam_type_id": "x"}}, {"$group": {"_id": "$gender"}}], "cursor": {}}
+    assert query_shape("aggregate", command) == "aggregate blood_test_points {pipeline: [{$match: {exam_type_id: ?}}, {$group: {_id: ?}}]}"
+
+
+def test_write_shapes_use_the_first_statement():
+    update = {"update": "patients", "updates": [{"q": {"_id": 1}, "u": {"$set": {"name": "x"}}}, {"q": {"email": 2}}]}
+    assert query_shape("update", update) == "update patients {q: {_id: ?}}"
+    assert query_shape("findAndModify", {"findAndModify": "deletions", "query": {"_id": "p:1"}}) == "findAndModify deletions {query: {_id: ?}}"
+    assert query_shape("insert", {"insert": "blood_tests", "documents": [{"a": 1}]}) == "insert blood_tests"
+
+
+def test_get_more_is_attributed_to_its_collection():
+    command = {"getMore": 123456789, "collection": "blood_tests"}
+    assert command_collection("getMore", command) == "blood_tests"
+    assert query_shape("getMore", command) == "getMore blood_tests"
+
+
+def test_shape_is_truncated():
+    command = {"find": "patients", "filter": {f"field_{i}": i for i in range(100)}}
+    assert len(query_shape("find", command)) == MAX_SHAPE_LENGTH
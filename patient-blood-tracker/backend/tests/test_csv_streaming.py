@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.core.streaming import MalformedRecord, iter_csv
+
+
+async def _chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def collect(data: bytes, size: int = 4, **kwargs):
+    async def run():
+        return [record async for record in iter_csv(_chunks(data, size), **kwargs)]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [1, 7, 1024])
+def test_csv_quoted_multiline_cells(size):
+    data = (
+        '\ufeffname,email,notes,diseases\r\n'
+        '"Silva, Ana",ana@example.com,"first line\nsecond ""quoted"" line",diabetes; hypertension\r\n'
+        'Bruno,bruno@example.com,,\r\n'
+    ).encode()
+    assert collect(data, size, list_columns=["diseases"]) == [
+        {
+            "name": "Silva, Ana",
+            "email": "ana@example.com",
+            "notes": 'first line\nsecond "quoted" line',
+            "diseases": ["diabetes", "hypertension"],
+        },
+        {"name": "Bruno", "email": "bruno@example.com"},
+    ]
+
+
+def test_csv_column_count_mismatch_is_malformed():
+    records = collect(b"name,email\nAna,ana@example.com\nBruno\nCarla,c@example.com,extra\nDiego,d@example.com")
+    assert records[0] == {"name": "Ana", "email": "ana@example.com"}
+    assert isinstance(records[1], MalformedRecord) and "Line 3" in records[1].error
+    assert isinstance(records[2], MalformedRecord) and "got 3" in records[2].error
+    assert records[3] == {"name": "Diego", "email": "d@example.com"}
+
+
+def test_csv_header_only():
+    assert collect(b"name,email\n") == []
@@ -0,0 +1,42 @@
+import base64
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.core.pagination import decode_cursor, encode_cursor, keyset_filter, keyset_sort
+
+
+@pytest.mark.parametrize("value", [datetime(2024, 3, 1, 12, 30, 15, 250000), "Silva, Ana", 42, 1.5, None])
+def test_cursor_round_trip(value):
+    object_id = ObjectId()
+    assert decode_cursor(encode_cursor(value, object_id)) == (value, object_id)
+
+
+def test_cursor_is_url_safe_without_padding():
+    token = encode_cursor("?&/+ ção", ObjectId())
+    assert "=" not in token
+    assert set(token) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor", "e30", encode_cursor("x", ObjectId())[:-3]])
+def test_malformed_cursor(token):
+    with pytest.raises(ValueError, match="Invalid pagination cursor"):
+        decode_cursor(token)
+
+
+def test_cursor_with_invalid_object_id():
+    token = base64.urlsafe_b64encode(b'{"v":"x","id":"not-an-id"}').decode()
+    with pytest.raises(ValueError, match="Invalid pagination cursor"):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("descending, op", [(False, "$gt"), (True, "$lt")])
+def test_keyset_filter_continues_after_the_cursor(descending, op):
+    when, object_id = datetime(2024, 1, 1), ObjectId()
+    assert keyset_filter("test_date", encode_cursor(when, object_id), descending) == {"$or": [
+        {"test_date": {op: when}},
+        {"test_date": when, "_id": {op: object_id}},
+    ]}
+    direction = -1 if descending else 1
+    assert keyset_sort("test_date", descending) == [("test_date", direction), ("_id", direction)]
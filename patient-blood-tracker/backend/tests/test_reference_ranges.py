@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from app.services.reference_ranges import (
+    FLAG_CRITICAL, FLAG_HIGH, FLAG_LOW, FLAG_NORMAL,
+    age_band, age_on, classify_results, classify_value, normalize_gender, reference_range_key,
+)
+
+GLUCOSE_RANGE = {"min": 70, "max": 99, "critical_min": 40, "critical_max": 400}
+REFERENCE_VALUES = {
+    "male": {"min": 13.5, "max": 17.5},
+    "female": {"min": 12.0, "max": 15.5},
+    "child": {"min": 11.0, "max": 14.0},
+}
+
+
+@pytest.mark.parametrize("value, flag", [
+    (39.9, FLAG_CRITICAL), (40, FLAG_LOW), (69.9, FLAG_LOW), (70, FLAG_NORMAL),
+    (99, FLAG_NORMAL), (99.1, FLAG_HIGH), (400, FLAG_HIGH), (400.1, FLAG_CRITICAL),
+])
+def test_classify_value(value, flag):
+    assert classify_value(value, GLUCOSE_RANGE) == flag
+
+
+def test_classify_value_without_critical_limits():
+    assert classify_value(1000, {"min": 70, "max": 99}) == FLAG_HIGH
+    assert classify_value(-5, {"min": 70, "max": 99}) == FLAG_LOW
+
+
+@pytest.mark.parametrize("age, band", [
+    (None, None), (0, "0-17"), (17, "0-17"), (18, "18-29"), (29, "18-29"),
+    (30, "30-39"), (79, "70-79"), (80, "80+"), (104, "80+"), (-1, None),
+])
+def test_age_band(age, band):
+    assert age_band(age) == band
+
+
+def test_age_on_counts_birthdays():
+    born = datetime(1990, 6, 15)
+    assert age_on(born, datetime(2020, 6, 14)) == 29
+    assert age_on(born, datetime(2020, 6, 15)) == 30
+    assert age_on(None, datetime(2020, 6, 15)) is None
+
+
+@pytest.mark.parametrize("gender, key", [("M", "male"), (" Feminino ", "female"), ("other", None), (None, None)])
+def test_normalize_gender(gender, key):
+    assert normalize_gender(gender) == key
+
+
+def test_reference_range_key():
+    when = datetime(2024, 1, 1)
+    adult = {"gender": "f", "date_of_birth": datetime(1980, 1, 1)}
+    child = {"gender": "f", "date_of_birth": datetime(2010, 1, 1)}
+    assert reference_range_key(adult, REFERENCE_VALUES, when) == "female"
+    assert reference_range_key(child, REFERENCE_VALUES, when) == "child"
+    # Sem faixa infantil, a criança usa a do gênero
+    assert reference_range_key(child, {"female": REFERENCE_VALUES["female"]}, when) == "female"
+    assert reference_range_key({"gender": "unknown"}, REFERENCE_VALUES, when) is None
+    assert reference_range_key(None, REFERENCE_VALUES, when) is None
+
+
+def test_classify_results_uses_the_age_on_the_test_date():
+    patient = {"gender": "male", "date_of_birth": datetime(2006, 7, 1)}
+    results = [{"exam_type_id": "hemoglobin", "value": 14.5}, {"exam_type_id": "unknown", "value": 1.0}]
+    reference_values = {"hemoglobin": REFERENCE_VALUES}
+    # Aos 17 anos vale a faixa infantil (14.5 > 14.0); aos 18, a masculina
+    assert [r["flag"] for r in classify_results(results, patient, reference_values, datetime(2024, 6, 30))] == [FLAG_HIGH, None]
+    assert [r["flag"] for r in classify_results(results, patient, reference_values, datetime(2024, 7, 1))] == [FLAG_NORMAL, None]
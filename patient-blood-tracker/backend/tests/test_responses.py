@@ -0,0 +1,61 @@
+import json
+from datetime import datetime
+
+from bson import ObjectId
+
+from app.core.responses import dump_json
+from app.models.doctor import Doctor
+from app.models.pagination import Page
+from app.models.patient import PatientInDB
+
+
+def patient_document():
+    return {
+        "_id": ObjectId(),
+        "name": "Maria Silva",
+        "email": "maria@example.com",
+        "date_of_birth": datetime(1980, 5, 17),
+        "gender": "female",
+        "phone": "555-0100",
+        "address": "Rua A, 1",
+        "diseases": ["diabetes"],
+        "created_at": datetime(2024, 1, 2, 3, 4, 5),
+        "updated_at": datetime(2024, 1, 2, 3, 4, 5),
+        # Campos internos do documento, fora do modelo
+        "search_keys": ["maria", "silva"],
+        "search_name": "maria silva",
+        "_relevance": 2,
+        "score": 1.5,
+    }
+
+
+def trusted(model):
+    return json.loads(dump_json(model))
+
+
+def validated(model_cls, doc):
+    return model_cls(**doc).model_dump(mode="json", by_alias=True)
+
+
+def test_constructed_model_matches_validated_dump():
+    doc = patient_document()
+    assert trusted(PatientInDB.model_construct(**doc)) == validated(PatientInDB, doc)
+
+
+def test_internal_fields_are_not_sent():
+    body = trusted(PatientInDB.model_construct(**patient_document()))
+    assert not {"search_keys", "search_name", "_relevance", "score"} & body.keys()
+    assert "_id" in body and "id" not in body
+
+
+def test_model_without_id_field_drops_id():
+    doc = patient_document()
+    doc["specialty"] = "cardiology"
+    assert trusted(Doctor.model_construct(**doc)) == validated(Doctor, doc)
+
+
+def test_page_items():
+    doc = patient_document()
+    page = Page[PatientInDB].model_construct(items=[PatientInDB.model_construct(**doc)], next_cursor="abc")
+    assert trusted(page) == {"items": [validated(PatientInDB, doc)], "next_cursor": "abc"}
+
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.streaming import MalformedRecord, iter_json_array, iter_ndjson
+
+
+async def _chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def collect(parser, data: bytes, size: int = 4, **kwargs):
+    async def run():
+        return [record async for record in parser(_chunks(data, size), **kwargs)]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [1, 3, 1024])
+def test_json_array_across_chunk_boundaries(size):
+    data = b'[{"a": 1, "b": "x,]"}, 12345, [1, 2], "s"]'
+    assert collect(iter_json_array, data, size) == [{"a": 1, "b": "x,]"}, 12345, [1, 2], "s"]
+
+
+def test_json_array_empty():
+    assert collect(iter_json_array, b" [ ] ") == []
+
+
+def test_json_array_truncated_raises_after_complete_elements():
+    records = []
+
+    async def run():
+        async for record in iter_json_array(_chunks(b'[{"a": 1}, {"a": 2}, {"a"', 5)):
+            records.append(record)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+    assert records == [{"a": 1}, {"a": 2}]
+
+
+@pytest.mark.parametrize("data", [b'{"a": 1}', b'[1 2]', b'[1,2]x'])
+def test_json_array_malformed(data):
+    with pytest.raises(ValueError):
+        collect(iter_json_array, data)
+
+
+def test_json_array_malformed_element_fails_before_reading_the_tail():
+    consumed = []
+
+    async def chunks():
+        yield b'[{"a": 1}, {"a": tru}, '
+        for _ in range(10000):
+            consumed.append(1)
+            yield b'{"padding": "' + b"x" * 1000 + b'"}, '
+        yield b"{}]"
+
+    async def run():
+        return [record async for record in iter_json_array(chunks())]
+
+    with pytest.raises(ValueError, match="Malformed"):
+        asyncio.run(run())
+    assert len(consumed) <= 1
+
+
+def test_json_array_oversized_element():
+    async def chunks():
+        yield b'[{"a": "'
+        while True:
+            yield b"x" * 65536
+
+    async def run():
+        return [record async for record in iter_json_array(chunks())]
+
+    with pytest.raises(ValueError, match="larger than"):
+        asyncio.run(run())
+
+
+@pytest.mark.parametrize("data", [b"[1.5, -2e3, true]", b"[null,false , 10]"])
+def test_json_array_numbers_and_literals_split_anywhere(data):
+    expected = json.loads(data)
+    for size in range(1, len(data)):
+        assert collect(iter_json_array, data, size) == expected
+
+
+def test_ndjson_reports_malformed_lines():
+    records = collect(iter_ndjson, b'{"a": 1}\n\nnot json\n{"a": 2}')
+    assert records[0] == {"a": 1} and records[2] == {"a": 2}
+    assert isinstance(records[1], MalformedRecord)
+    assert "line 3" in records[1].error
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 1024])
+def test_ndjson_across_chunk_boundaries(size):
+    data = '{"lab_name": "Diagnósticos Norte"}\r\n\n{"value": 1.5}'.encode()
+    assert collect(iter_ndjson, data, size) == [{"lab_name": "Diagnósticos Norte"}, {"value": 1.5}]